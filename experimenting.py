@@ -1,35 +1,40 @@
-from random import choice
 import sys
 
 import pygame
 
 from golfram.ball import GolfBall
 from golfram.geometry import Vector
+from golfram.graphics import LazyTexture
 from golfram.level import Level, LevelComplete
+from golfram import profiling, textures
+from golfram.replay import FixedTimestep
 from golfram.tile import BoostTile, Tile
 
 # Load tile textures and make tiles
 class Red(Tile):
-    texture = pygame.image.load('sprites/red.png')
+    texture = LazyTexture('sprites/red.png')
 
 class Green(Tile):
-    texture = pygame.image.load('sprites/green.png')
+    texture = LazyTexture('sprites/green.png')
 
 class Blue(Tile):
-    texture = pygame.image.load('sprites/blue.png')
+    texture = LazyTexture('sprites/blue.png')
 
 class Boost(BoostTile):
     boost_velocity = Vector(-2, 0)
-    texture_active = pygame.image.load('sprites/boost_active.png')
-    texture_inactive = pygame.image.load('sprites/boost_inactive.png')
+    texture_active = LazyTexture('sprites/boost_active.png')
+    texture_inactive = LazyTexture('sprites/boost_inactive.png')
 
 class RandomLevel(Level):
 
     def set_up(self):
         # Create a level of 6x6 random tiles
         N = 8
-        choices = [Boost] + [Red] * 2 + [Green] * 2 + [Blue] * 2
-        self.tiles = [[choice(choices)() for x in range(N)] for y in range(N)]
+        # One shared tile of each kind; the grid gives every boost tile its
+        # own copy, since they keep state
+        choices = [Boost()] + [Red()] * 2 + [Green()] * 2 + [Blue()] * 2
+        self.tiles = [[self.random.choice(choices) for x in range(N)]
+                      for y in range(N)]
         # This is still wrong. We shouldn't have to define width and height at
         # all. Or at least not in pixels.
         self.width = 64 * N
@@ -46,27 +51,37 @@ class RandomLevel(Level):
 # setup pygame window
 pygame.init()
 screen = pygame.display.set_mode((64 * 8, 64 * 8))
+textures.manager.convert_all()
 pygame.display.set_caption("Test stuFf")
 
+# Run with GOLFRAM_PROFILE=profile.json to see where each frame's time goes
+profiling.enable_from_environment()
+
 # Continuously generate test levels and shoot the ball across them
 while True:
     level = RandomLevel(screen)
     clock = pygame.time.Clock()
+    # Step the physics by a fixed amount, so a level plays out the same
+    # whatever the frame rate
+    stepper = FixedTimestep(level)
+    level.draw(screen)
+    pygame.display.flip()
     while True:
-        # Draw
-        level.draw(screen)
-        pygame.display.flip()
+        # Draw only what changed since the last frame
+        rects = level.draw_dirty(screen)
+        if profiling.profiler.enabled:
+            rects.append(profiling.profiler.draw_overlay(screen))
+        pygame.display.update(rects)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                profiling.dump_to_environment()
                 pygame.quit()
                 sys.exit()
         # Move objects
         clock.tick(60)
         dt = clock.get_time() / 1000.0
-        n = 10
         try:
-            for i in range(n):
-                level.tick(dt=dt/n)
+            stepper.advance(dt)
         except (IndexError, LevelComplete):
             break
-    del level, clock
+    del level, clock, stepper
@@ -2,11 +2,8 @@ import argparse
 import pickle
 from random import choice
 
-import pygame
-
-import golfram.config
-from golfram.core import Level
-from golfram.util import error, get_path, info
+# pygame and the rest of golfram are imported when a levelset is played, so
+# --version and --bunny don't wait for SDL
 
 # Some constants that should maybe eventually be relocated.
 # Maybe to a Settings class.
@@ -14,9 +11,6 @@ GOLFRAM_ALPHA = 'Golfram Alpha'
 VERSION = 'golfram-alpha-0.1'
 RESOLUTION = [640,480]
 
-# Load golfram settings
-golfram.config.load('settings.ini')
-
 # Parse command line arguments
 parser = argparse.ArgumentParser(description="Play a nice game of minigolf.")
 parser.add_argument('-v', '--version', action='version', version=VERSION)
@@ -31,7 +25,8 @@ if not args.bunny and not args.levelset:
 # Print a bunny, if requested
 if args.bunny:
     try:
-        bunnies = pickle.load(open('bunnies', 'r'))
+        with open('bunnies', 'rb') as f:
+            bunnies = pickle.load(f, encoding='latin1')
     except:
         print("Bunnies are unavailable. No further information is available " +
               "because the code in this area is hacked together and uses a " +
@@ -41,6 +36,16 @@ if args.bunny:
 
 # Load the specified levelset, if requested
 if args.levelset:
+    import pygame
+
+    import golfram.config
+    from golfram import textures
+    from golfram.level import Level
+    from golfram.util import get_path, info
+
+    # Load golfram settings
+    golfram.config.load('settings.ini')
+
     #info("Loading levelset {}".format(args.levelset))
     info("Ignoring levelset {}; loading demo.lvl".format(args.levelset))
     # Create game object, load levels, whatever...
@@ -50,11 +55,12 @@ if args.levelset:
     # Set up a basic pygame window
     pygame.init()
     screen = pygame.display.set_mode(RESOLUTION)
+    textures.manager.convert_all()
     pygame.display.set_caption(GOLFRAM_ALPHA)
 
     # Draw the level
     level_surface = pygame.Surface(screen.get_size()).convert()
-    level.draw_on_surface(level_surface)
+    level.draw(level_surface)
     screen.blit(level_surface, dest=(0, 0))
     pygame.display.flip()
 
@@ -1,21 +1,20 @@
-import pygame
-
 from golfram.geometry import Circle, Rectangle, Vector
+from golfram.graphics import LazyTexture
 
 class GolfBall:
 
     diameter = 0.0427
     mass = 0.0459
     shape = Circle(radius=diameter/2)
-    texture = pygame.image.load('sprites/ball-12x12.png')
+    texture = LazyTexture('sprites/ball-12x12.png')
 
     def __init__(self, position=None, velocity=None):
-        if not position:
+        if position is None:
             position = Vector(0, 0)
-        if not velocity:
+        if velocity is None:
             velocity = Vector(0, 0)
         self.position = position
-        self.velocity = Vector(0, 0)
+        self.velocity = velocity
 
 
 if __name__ == '__main__':
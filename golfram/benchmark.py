@@ -0,0 +1,350 @@
+"""Benchmarks of the engine's hot paths
+
+Run them from the top of the source tree (the textures are found relative
+to it):
+
+    python -m golfram.benchmark
+    python -m golfram.benchmark --save baseline.json
+    python -m golfram.benchmark --compare baseline.json --threshold 0.1
+
+Each benchmark reports the best time per call over several runs. Saved
+results are JSON baselines; comparing against one lists every benchmark
+that got slower by more than the threshold (a fraction, so 0.1 is 10%) and
+exits with status 1 if there were any:
+
+    >>> baseline = {'results': {'vector.add': 1.0e-6, 'level.tick': 2.0e-3}}
+    >>> current = {'results': {'vector.add': 1.2e-6, 'level.tick': 2.1e-3}}
+    >>> for name, old, new in regressions(current, baseline, 0.1):
+    ...     print(name, round(new / old, 2))
+    vector.add 1.2
+
+Drawing is measured with SDL's dummy video driver, so no window opens; the
+drawing benchmarks are skipped if pygame isn't installed.
+
+Command line tools and headless workers should start quickly, so --imports
+checks instead how long the engine's modules take to import, each in a
+fresh interpreter (with python -X importtime). It exits with status 1 if
+one goes over its budget in IMPORT_BUDGETS, or brings in pygame or NumPy:
+
+    python -m golfram.benchmark --imports
+
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+from golfram.util import info, warn
+
+# (name, setup) of every benchmark, in the order they were defined. setup()
+# returns the function to time.
+BENCHMARKS = []
+
+def benchmark(name):
+    """Register the decorated setup function as a benchmark"""
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+# Micro-benchmarks
+
+@benchmark('vector.add')
+def _vector_add():
+    from golfram.geometry import Vector
+    a, b = Vector(1.5, -2.0), Vector(0.25, 0.75)
+    return lambda: a + b
+
+@benchmark('vector.add_scaled')
+def _vector_add_scaled():
+    from golfram.geometry import Vector
+    a, b = Vector(1.5, -2.0), Vector(0.25, 0.75)
+    return lambda: a.add_scaled(b, 0.001)
+
+@benchmark('vector.normalize')
+def _vector_normalize():
+    from golfram.geometry import Vector
+    a = Vector(1.5, -2.0)
+    return a.normalize
+
+@benchmark('unit.call')
+def _unit_call():
+    from golfram.units import m, px
+    quantity = 64 * px
+    return lambda: m(quantity)
+
+@benchmark('level.tile_at_point')
+def _tile_at_point():
+    from golfram.geometry import Vector
+    point = Vector(1.0, 2.0)
+    level = _make_level(16)
+    return lambda: level.tile_at_point(point)
+
+@benchmark('paging.get')
+def _paged_get():
+    from array import array
+    from golfram.paging import PagedTileGrid
+    from golfram.tile import Tile
+    grid = PagedTileGrid([Tile(), Tile()], lambda rows, columns: array(
+        'B', [0] * (len(rows) * len(columns))), 256, 256, blocking=True)
+    grid.get(100, 100)
+    return lambda: grid.get(100, 100)
+
+@benchmark('tile.acceleration_on_object')
+def _acceleration_on_object():
+    from golfram.ball import GolfBall
+    from golfram.geometry import Vector
+    from golfram.tile import Tile
+    tile, ball = Tile(), GolfBall(velocity=Vector(1.0, 0.5))
+    return lambda: tile.acceleration_on_object(ball)
+
+
+# Macro-benchmarks: whole simulations
+
+def _tick(balls, steps, collisions=False, batch=False):
+    def setup():
+        level = _make_level(32, balls)
+        if collisions:
+            level.enable_collisions()
+        if batch:
+            from golfram.physics import BatchPhysics
+            level.set_engine(BatchPhysics(level))
+        def run():
+            for i in range(steps):
+                level.tick(1 / 600.0)
+            del level._redraw_queue[:]
+        return run
+    return setup
+
+benchmark('level.tick.1x1000')(_tick(1, 1000))
+benchmark('level.tick.100x100')(_tick(100, 100))
+benchmark('level.tick.300x10.collisions')(_tick(300, 10, collisions=True))
+benchmark('level.tick.1000x10.batch')(_tick(1000, 10, batch=True))
+
+
+# Drawing
+
+@benchmark('level.draw')
+def _draw():
+    screen = _dummy_display()
+    level = _make_level(16, textured=True)
+    return lambda: level.draw(screen)
+
+@benchmark('level.draw_dirty')
+def _draw_dirty():
+    screen = _dummy_display()
+    level = _make_level(16, 1, textured=True)
+    level.draw(screen)
+    def run():
+        level.tick(1 / 60.0)
+        level.draw_dirty(screen)
+    return run
+
+@benchmark('level.draw.zoom')
+def _draw_zoom():
+    # Switching between two zoom levels, both of whose sprites are cached
+    screen = _dummy_display()
+    level = _make_level(16, 1, textured=True)
+    renderer = level.renderer
+    zooms = [0.5, 1.0]
+    def run():
+        zooms.reverse()
+        renderer.set_zoom(zooms[0])
+        renderer.draw(screen)
+    return run
+
+
+def _make_level(size, balls=0, textured=False):
+    """Return a headless size x size level with balls moving about"""
+    from golfram.ball import GolfBall
+    from golfram.geometry import Vector
+    from golfram.level import Level
+    from golfram.tile import Tile
+    from golfram.units import PX_PER_M
+    if textured:
+        from golfram.graphics import LazyTexture
+        kinds = [type(name, (Tile,), {'texture': LazyTexture(
+                     'sprites/{}.png'.format(name))})()
+                 for name in ('red', 'green', 'blue')]
+    else:
+        kinds = [Tile(), Tile(), Tile()]
+    tiles = [[kinds[(row * 7 + column * 3) % 3] for column in range(size)]
+             for row in range(size)]
+    level = Level(tiles=tiles, seed=0)
+    side = size * level.tilesize / PX_PER_M
+    for i in range(balls):
+        x = (i * 0.618034 % 1) * (side - 0.2) + 0.1
+        y = (i * 0.414214 % 1) * (side - 0.2) + 0.1
+        level.add_entity(GolfBall(position=Vector(x, y),
+                                  velocity=Vector(1.0 + i % 3, 0.5 - i % 2)))
+    return level
+
+# The most milliseconds each module may take to import, counting everything
+# it imports that wasn't already imported when Python started
+IMPORT_BUDGETS = {
+    'golfram.ball': 30,
+    'golfram.fields': 30,
+    'golfram.game': 80,
+    'golfram.level': 80,
+    'golfram.levelfile': 60,
+    'golfram.physics': 30,
+    'golfram.replay': 80,
+    'golfram.server': 250,
+    'golfram.shared': 100,
+    'golfram.solver': 100,
+}
+
+# Modules that only the code paths that need them may import
+HEAVY_MODULES = ('numpy', 'pygame')
+
+
+def _dummy_display():
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    import pygame
+    from golfram import textures
+    pygame.display.init()
+    screen = pygame.display.set_mode((640, 480))
+    textures.manager.convert_all()
+    return screen
+
+
+def run(names=None, repeat=5):
+    """Run the benchmarks (all of them, or those named); return the results
+
+    The results are a dict ready to be saved as JSON, holding the seconds
+    per call of each benchmark under 'results'.
+
+    """
+    results = {}
+    for name, setup in BENCHMARKS:
+        if names and name not in names:
+            continue
+        try:
+            function = setup()
+        except ImportError as e:
+            warn("skipping {}: {}".format(name, e))
+            continue
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat, number))
+        results[name] = best / number
+    return {'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results}
+
+def regressions(current, baseline, threshold):
+    """Return (name, old, new) of each benchmark more than threshold slower
+    than in baseline"""
+    slower = []
+    old_results = baseline['results']
+    for name, new in sorted(current['results'].items()):
+        old = old_results.get(name)
+        if old is not None and new > old * (1 + threshold):
+            slower.append((name, old, new))
+    return slower
+
+def import_time(module, repeat=3):
+    """Return the best seconds taken importing module in a fresh
+    interpreter, and the HEAVY_MODULES that were imported along with it"""
+    best, heavy = None, []
+    for i in range(repeat):
+        process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c',
+                                    'import ' + module],
+                                   stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+        output = process.communicate()[1]
+        if process.returncode:
+            raise ImportError("importing {} failed:\n{}".format(module,
+                                                                output))
+        seconds, heavy = _parse_import_time(output, module)
+        if best is None or seconds < best:
+            best = seconds
+    return best, heavy
+
+def _parse_import_time(output, module):
+    """Return the seconds module took to import, and the HEAVY_MODULES
+    imported, according to the output of python -X importtime
+
+    >>> output = '''import time: self [us] | cumulative | imported package
+    ... import time:      8000 |      90000 |   numpy
+    ... import time:       500 |      95000 | golfram.physics'''
+    >>> _parse_import_time(output, 'golfram.physics')
+    (0.095, ['numpy'])
+
+    """
+    seconds, heavy = None, []
+    for line in output.splitlines():
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        if name == module:
+            seconds = int(fields[1]) / 1e6
+        elif name.split('.')[0] in HEAVY_MODULES and name not in heavy:
+            heavy.append(name)
+    return seconds, heavy
+
+def check_imports(budgets=IMPORT_BUDGETS):
+    """Print the import time of each module against its budget; return the
+    number of problems found"""
+    failed = 0
+    for module, budget in sorted(budgets.items()):
+        seconds, heavy = import_time(module)
+        print('{:32} {:9.1f} ms  (budget {} ms)'.format(module, seconds * 1000,
+                                                       budget))
+        if seconds * 1000 > budget:
+            warn("{} takes {:.1f} ms to import".format(module,
+                                                     seconds * 1000))
+            failed += 1
+        if heavy:
+            warn("{} imports {}".format(module, ', '.join(heavy)))
+            failed += 1
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time golfram's hot paths.")
+    parser.add_argument('names', nargs='*',
+                        help="benchmarks to run (default: all)")
+    parser.add_argument('--save', metavar='FILE',
+                        help="save the results as a JSON baseline")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare the results with a saved baseline")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="slowdown counted as a regression (default 0.1)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--imports', action='store_true',
+                        help="check the modules' import times instead")
+    args = parser.parse_args(argv)
+    if args.imports:
+        return 1 if check_imports() else 0
+    current = run(args.names, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    for name, seconds in sorted(current['results'].items()):
+        line = '{:32} {:12.3f} us'.format(name, seconds * 1e6)
+        if baseline is not None and name in baseline['results']:
+            line += '  {:+.1%}'.format(seconds / baseline['results'][name] - 1)
+        print(line)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        info("saved results to {}".format(args.save))
+    if baseline is not None:
+        slower = regressions(current, baseline, args.threshold)
+        for name, old, new in slower:
+            warn("{} is {:.1%} slower".format(name, new / old - 1))
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""Collisions between entities, and between entities and obstacles
+
+Checking every pair of entities is O(n**2) per substep, so candidates are
+found with a SpatialHash: a uniform grid, sized to the level's tiles, in
+which each entity is filed under every cell its bounding box touches. Only
+entities sharing a cell are tested exactly.
+
+Entities are circles (their shape, centred on their position), obstacles
+are Rectangles. Collisions are elastic by default:
+
+    >>> from golfram.ball import GolfBall
+    >>> from golfram.geometry import Vector
+    >>> from golfram.level import Level
+    >>> from golfram.tile import Tile
+    >>> level = Level(tiles=[[Tile()] * 4] * 4)
+    >>> a = GolfBall(position=Vector(0.5, 0.5), velocity=Vector(1, 0))
+    >>> b = GolfBall(position=Vector(0.54, 0.5), velocity=Vector(-1, 0))
+    >>> level.add_entity(a)
+    >>> level.add_entity(b)
+    >>> collisions = level.enable_collisions()
+    >>> collisions.resolve()
+    1
+    >>> a.velocity, b.velocity
+    (Vector(-1.0, 0.0), Vector(1.0, 0.0))
+
+"""
+import math
+
+from golfram.units import PX_PER_M
+
+class SpatialHash(object):
+    """A uniform grid of buckets of objects, updated incrementally
+
+    Objects are filed by their bounding box (x0, y0, x1, y1). Moving an
+    object only touches the buckets when it actually changes cells.
+
+    >>> grid = SpatialHash(1.0)
+    >>> grid.update('a', (0.1, 0.1, 0.3, 0.3))
+    >>> grid.update('b', (1.1, 0.2, 1.4, 0.4))
+    >>> grid.update('c', (5, 5, 5.5, 5.5))
+    >>> list(grid.pairs())
+    []
+    >>> grid.update('a', (0.8, 0.1, 1.1, 0.3))
+    >>> sorted(next(grid.pairs()))
+    ['a', 'b']
+
+    """
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        # (column, row) -> set of objects
+        self.buckets = {}
+        # object -> (column0, row0, column1, row1) of the cells it's in
+        self._spans = {}
+
+    def __len__(self):
+        return len(self._spans)
+
+    def update(self, obj, bbox):
+        """Insert obj, or move it if it is already in the grid"""
+        size = self.cell_size
+        span = (int(math.floor(bbox[0] / size)),
+                int(math.floor(bbox[1] / size)),
+                int(math.floor(bbox[2] / size)),
+                int(math.floor(bbox[3] / size)))
+        old = self._spans.get(obj)
+        if old == span:
+            return
+        if old is not None:
+            self._unfile(obj, old)
+        self._spans[obj] = span
+        buckets = self.buckets
+        for column in range(span[0], span[2] + 1):
+            for row in range(span[1], span[3] + 1):
+                bucket = buckets.get((column, row))
+                if bucket is None:
+                    bucket = buckets[(column, row)] = set()
+                bucket.add(obj)
+
+    def remove(self, obj):
+        span = self._spans.pop(obj, None)
+        if span is not None:
+            self._unfile(obj, span)
+
+    def query(self, bbox):
+        """Return the set of objects in the cells bbox touches"""
+        size = self.cell_size
+        found = set()
+        for column in range(int(math.floor(bbox[0] / size)),
+                            int(math.floor(bbox[2] / size)) + 1):
+            for row in range(int(math.floor(bbox[1] / size)),
+                             int(math.floor(bbox[3] / size)) + 1):
+                found.update(self.buckets.get((column, row), ()))
+        return found
+
+    def pairs(self):
+        """Yield each pair of objects sharing at least one cell, once"""
+        seen = set()
+        for bucket in self.buckets.values():
+            if len(bucket) < 2:
+                continue
+            members = list(bucket)
+            for i, a in enumerate(members):
+                for b in members[i + 1:]:
+                    key = (id(a), id(b)) if id(a) < id(b) else (id(b), id(a))
+                    if key not in seen:
+                        seen.add(key)
+                        yield a, b
+
+    def _unfile(self, obj, span):
+        buckets = self.buckets
+        for column in range(span[0], span[2] + 1):
+            for row in range(span[1], span[3] + 1):
+                bucket = buckets[(column, row)]
+                bucket.discard(obj)
+                if not bucket:
+                    del buckets[(column, row)]
+
+
+class CollisionSystem(object):
+    """Find and respond to collisions among a level's entities
+
+    Entities need a shape with a radius (a Circle) and may have a mass
+    (default 1). Obstacles are Rectangles that never move. restitution is
+    the fraction of the approach speed kept after a collision; 1 is
+    perfectly elastic.
+
+    """
+    def __init__(self, level, restitution=1.0):
+        self.level = level
+        self.restitution = restitution
+        self.entities = SpatialHash(level.tilesize / PX_PER_M)
+        self.obstacles = SpatialHash(level.tilesize / PX_PER_M)
+
+    def add_obstacle(self, rectangle):
+        self.obstacles.update(rectangle, (rectangle.nw.x, rectangle.nw.y,
+                                          rectangle.se.x, rectangle.se.y))
+
+    def remove_obstacle(self, rectangle):
+        self.obstacles.remove(rectangle)
+
+    def resolve(self):
+        """Separate every colliding pair and bounce them apart
+
+        Pairs are handled in the order the entities were added to the level,
+        so the outcome doesn't depend on how the hash happens to be laid out.
+
+        """
+        hits = 0
+        entities = self.entities
+        order = {}
+        for entity, physics in self.level._entities:
+            if getattr(entity, 'shape', None) is None:
+                continue
+            order[entity] = len(order)
+            x, y, r = _circle(entity)
+            entities.update(entity, (x - r, y - r, x + r, y + r))
+        for entity in [e for e in entities._spans if e not in order]:
+            entities.remove(entity)
+        pairs = []
+        for a, b in entities.pairs():
+            if order[a] > order[b]:
+                a, b = b, a
+            pairs.append((order[a], order[b], a, b))
+        pairs.sort(key=lambda pair: pair[:2])
+        for i, j, a, b in pairs:
+            if self._collide(a, b):
+                hits += 1
+        if self.obstacles:
+            for entity in order:
+                x, y, r = _circle(entity)
+                for obstacle in self.obstacles.query((x - r, y - r,
+                                                      x + r, y + r)):
+                    if self._bounce(entity, obstacle):
+                        hits += 1
+        return hits
+
+    def _collide(self, a, b):
+        ax, ay, ar = _circle(a)
+        bx, by, br = _circle(b)
+        dx, dy = bx - ax, by - ay
+        reach = ar + br
+        distance_squared = dx * dx + dy * dy
+        if distance_squared >= reach * reach:
+            return False
+        distance = math.sqrt(distance_squared)
+        if distance == 0:
+            nx, ny = 1.0, 0.0
+        else:
+            nx, ny = dx / distance, dy / distance
+        inverse_a = 1.0 / getattr(a, 'mass', 1.0)
+        inverse_b = 1.0 / getattr(b, 'mass', 1.0)
+        inverse_total = inverse_a + inverse_b
+        # Push them apart so they just touch, the lighter one further
+        overlap = (reach - distance) / inverse_total
+        a.position.x -= nx * overlap * inverse_a
+        a.position.y -= ny * overlap * inverse_a
+        b.position.x += nx * overlap * inverse_b
+        b.position.y += ny * overlap * inverse_b
+        # Exchange momentum along the normal if they are approaching
+        approach = ((a.velocity.x - b.velocity.x) * nx +
+                    (a.velocity.y - b.velocity.y) * ny)
+        if approach > 0:
+            impulse = (1 + self.restitution) * approach / inverse_total
+            a.velocity.x -= nx * impulse * inverse_a
+            a.velocity.y -= ny * impulse * inverse_a
+            b.velocity.x += nx * impulse * inverse_b
+            b.velocity.y += ny * impulse * inverse_b
+        return True
+
+    def _bounce(self, entity, rectangle):
+        x, y, r = _circle(entity)
+        cx = min(max(x, rectangle.nw.x), rectangle.se.x)
+        cy = min(max(y, rectangle.nw.y), rectangle.se.y)
+        dx, dy = x - cx, y - cy
+        distance_squared = dx * dx + dy * dy
+        if distance_squared >= r * r:
+            return False
+        if distance_squared == 0:
+            # The centre is inside; leave by the nearest side
+            exits = [(x - rectangle.nw.x, -1.0, 0.0),
+                     (rectangle.se.x - x, 1.0, 0.0),
+                     (y - rectangle.nw.y, 0.0, -1.0),
+                     (rectangle.se.y - y, 0.0, 1.0)]
+            depth, nx, ny = min(exits)
+            depth += r
+        else:
+            distance = math.sqrt(distance_squared)
+            nx, ny = dx / distance, dy / distance
+            depth = r - distance
+        entity.position.x += nx * depth
+        entity.position.y += ny * depth
+        approach = entity.velocity.x * nx + entity.velocity.y * ny
+        if approach < 0:
+            entity.velocity.x -= (1 + self.restitution) * approach * nx
+            entity.velocity.y -= (1 + self.restitution) * approach * ny
+        return True
+
+
+def _circle(entity):
+    shape = entity.shape
+    return (entity.position.x + shape.center.x,
+            entity.position.y + shape.center.y, shape.radius)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -1,9 +1,12 @@
-import ConfigParser
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
 
 _settings = {}
 
 def load(filename):
-    config = ConfigParser.RawConfigParser()
+    config = configparser.RawConfigParser()
     config.read(filename)
     #_settings['data_path'] = config.get('Settings', 'data_path')
 
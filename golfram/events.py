@@ -0,0 +1,194 @@
+"""Events raised while a level is simulated
+
+Entities entering and leaving tiles are the level's events. Rather than
+being handled on the spot, in the middle of the physics, they are queued
+and dispatched together once the level's tick is over, in the order they
+happened. Handlers subscribe to an EventBus by event type, and by what the
+event is about: a tile, a tile class, a (row, column) cell or an entity.
+
+    >>> from golfram.ball import GolfBall
+    >>> from golfram.geometry import Vector
+    >>> from golfram.level import Level
+    >>> from golfram.tile import Tile
+    >>> level = Level(tiles=[[Tile() for column in range(4)]])
+    >>> ball = GolfBall(position=Vector(0.1, 0.1), velocity=Vector(1, 0))
+    >>> level.add_entity(ball)
+    >>> entered = []
+    >>> level.events.subscribe(ENTER, entered.append, (0, 2))
+    >>> for i in range(100):
+    ...     level.tick(0.01)
+    >>> [(event.type, event.cell) for event in entered]
+    [('enter', (0, 2))]
+
+Tiles are flyweights, so neighbouring cells of one kind share a tile; it's
+the cell that changes, whichever engine moves the ball:
+
+    >>> from golfram.physics import AnalyticIntegrator, BatchPhysics
+    >>> grass = Tile()
+    >>> for engine in (None, BatchPhysics, AnalyticIntegrator):
+    ...     level = Level(tiles=[[grass] * 4])
+    ...     ball = GolfBall(position=Vector(0.1, 0.1), velocity=Vector(1, 0))
+    ...     level.add_entity(ball)
+    ...     entered = []
+    ...     level.events.subscribe(ENTER, entered.append, (0, 1))
+    ...     if engine is AnalyticIntegrator:
+    ...         elapsed = AnalyticIntegrator(level).run_until_rest()
+    ...     else:
+    ...         if engine is not None:
+    ...             level.set_engine(engine(level))
+    ...         for i in range(100):
+    ...             level.tick(0.01)
+    ...     print([event.cell for event in entered])
+    [(0, 1)]
+    [(0, 1)]
+    [(0, 1)]
+
+Events nobody would hear aren't even queued: when no handler listens for
+a type of event, only tiles whose class overrides the matching callback
+(Tile.on_enter() or Tile.on_exit()) cause one.
+
+"""
+from collections import namedtuple
+
+from golfram.tile import Tile
+
+# Event types
+ENTER = 'enter'
+EXIT = 'exit'
+
+Event = namedtuple('Event', 'type entity tile cell')
+
+# Tile class -> (whether it overrides on_exit(), on_enter())
+_callbacks = {}
+
+
+class EventBus(object):
+    """Handlers of a level's events, and the events waiting for them"""
+
+    def __init__(self):
+        # (event type, key) -> handlers
+        self._handlers = {}
+        # event type -> how many handlers there are for it
+        self._counts = {}
+        self.queue = []
+
+    def subscribe(self, event_type, handler, key=None):
+        """Call handler(event) for each event_type event about key
+
+        key is a tile, a tile class, a (row, column) cell, an entity, or
+        None for every event of the type. Tiles that keep state have a copy
+        in each of their cells, so subscribe to their class or cell.
+
+        """
+        self._handlers.setdefault((event_type, key), []).append(handler)
+        self._counts[event_type] = self._counts.get(event_type, 0) + 1
+
+    def unsubscribe(self, event_type, handler, key=None):
+        handlers = self._handlers[(event_type, key)]
+        handlers.remove(handler)
+        if not handlers:
+            del self._handlers[(event_type, key)]
+        self._counts[event_type] -= 1
+
+    def listening(self, event_type):
+        """Return whether any handler listens for event_type"""
+        return self._counts.get(event_type, 0) > 0
+
+    def post(self, event_type, entity, tile=None, cell=None):
+        """Queue an event, to be handled at the next dispatch()"""
+        self.queue.append(Event(event_type, entity, tile, cell))
+
+    def crossed(self, entity, tile, cell, new_tile, new_cell):
+        """Queue the events of entity rolling from one tile onto another"""
+        callbacks = _callbacks.get(type(tile))
+        if callbacks is None:
+            callbacks = _tile_callbacks(type(tile))
+        if callbacks[0] or self._counts.get(EXIT):
+            self.queue.append(Event(EXIT, entity, tile, cell))
+        callbacks = _callbacks.get(type(new_tile))
+        if callbacks is None:
+            callbacks = _tile_callbacks(type(new_tile))
+        if callbacks[1] or self._counts.get(ENTER):
+            self.queue.append(Event(ENTER, entity, new_tile, new_cell))
+
+    def dispatch(self):
+        """Handle every queued event, oldest first
+
+        A tile's own on_enter() or on_exit() comes first, then the
+        handlers for the event's tile, tile class, cell, entity and type,
+        in that order. Events that handlers post are handled too.
+
+        If a handler raises, the events up to and including the one being
+        handled are dropped all the same, and the rest stay queued:
+
+        >>> bus = EventBus()
+        >>> def fail(event):
+        ...     raise ValueError(event.cell)
+        >>> bus.subscribe(ENTER, fail, (0, 0))
+        >>> for cell in [(0, 0), (0, 1)]:
+        ...     bus.post(ENTER, None, cell=cell)
+        >>> try:
+        ...     bus.dispatch()
+        ... except ValueError as e:
+        ...     print(e)
+        (0, 0)
+        >>> [event.cell for event in bus.queue]
+        [(0, 1)]
+
+        Handlers may unsubscribe themselves (or subscribe others) while
+        being called; that takes effect from the next event:
+
+        >>> bus.clear()
+        >>> heard = []
+        >>> def once(event):
+        ...     heard.append('once')
+        ...     bus.unsubscribe(ENTER, once)
+        >>> bus.subscribe(ENTER, once)
+        >>> bus.subscribe(ENTER, heard.append)
+        >>> bus.post(ENTER, None)
+        >>> bus.post(ENTER, None)
+        >>> bus.dispatch()
+        >>> [entry if entry == 'once' else entry.type for entry in heard]
+        ['once', 'enter', 'enter']
+
+        """
+        queue = self.queue
+        handlers = self._handlers
+        i = 0
+        try:
+            while i < len(queue):
+                event = queue[i]
+                i += 1
+                event_type, tile = event.type, event.tile
+                if tile is not None:
+                    if event_type == ENTER:
+                        tile.on_enter(event.entity)
+                    elif event_type == EXIT:
+                        tile.on_exit(event.entity)
+                if not self._counts.get(event_type):
+                    continue
+                for key in (tile, type(tile), event.cell, event.entity):
+                    if key is not None:
+                        for handler in tuple(handlers.get((event_type, key),
+                                                          ())):
+                            handler(event)
+                for handler in tuple(handlers.get((event_type, None), ())):
+                    handler(event)
+        finally:
+            del queue[:i]
+
+    def clear(self):
+        """Drop the queued events without handling them"""
+        del self.queue[:]
+
+
+def _tile_callbacks(tile_class):
+    callbacks = _callbacks[tile_class] = (
+        tile_class.on_exit is not Tile.on_exit,
+        tile_class.on_enter is not Tile.on_enter)
+    return callbacks
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,324 @@
+"""Fields precomputed over a level's tiles
+
+AI players and aim assistance keep asking the same questions: how hard
+does the ball have to be hit to get from here to the hole, which way is
+it, and where does a ball left here end up? Rather than simulating, they
+can read the answers from a LevelFields, which holds them for every tile:
+
+    >>> from golfram.level import Level
+    >>> from golfram.tile import Tile, WallTile
+    >>> level = Level(tiles=[[Tile()] * 5])
+    >>> fields = LevelFields(level, goal=[(0, 4)])
+    >>> fields.next_cell(0, 0), round(fields.distance(0, 0) / fields.tile_length)
+    ((0, 1), 4)
+    >>> round(fields.launch_speed(0, 0), 3)
+    1.047
+
+When a tile changes the fields are updated incrementally, only for the
+tiles whose answers depend on it. Level.set_tile() takes care of that:
+
+    >>> level.fields = fields
+    >>> level.set_tile(0, 2, WallTile())
+    >>> fields.next_cell(0, 0), fields.launch_speed(0, 0)
+    (None, inf)
+
+The distance field is a shortest path search backwards from the goal over
+the grid's 8-neighbourhood, around solid tiles and never cutting their
+corners. Paths are weighed by the kinetic energy they need: ball speed
+squared over two, of which friction f takes f per metre rolled. A boost
+tile is taken to bring the speed along its boost_velocity b towards |b|,
+so it gives (or, against it, takes) up to (b.d)**2/2 over a tile crossed in
+direction d.
+
+The rest field follows a ball put down on each tile: on ordinary tiles it
+stays put, and boost tiles send it in the direction of their boost with
+that energy, tile by tile, until friction has used it up. Both are tile
+level approximations; when the exact answer matters, simulate.
+
+"""
+import heapq
+import math
+from array import array
+
+from golfram.units import PX_PER_M
+
+_INFINITY = float('inf')
+
+# The 8-neighbourhood, as (row, column) offsets
+_NEIGHBOURS = ((-1, 0), (1, 0), (0, -1), (0, 1),
+               (-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+class LevelFields(object):
+    """The distance-to-goal and rest-position fields of a level
+
+    goal is a list of the (row, column) of the goal's tiles. The fields are
+    flat, row-major arrays: energy (the kinetic energy per unit mass, in
+    m**2/s**2, needed to roll to the goal), distance (the length of that
+    path, in metres), next (the index of the next tile along it) and rest
+    (the index of the tile a ball put down there comes to rest on). -1
+    means there is no such tile.
+
+    arrays, if given, are the (energy, distance, next, rest) of another
+    LevelFields of the same level, such as read-only views onto shared
+    memory. They are used instead of searching again, until a tile changes
+    and they are copied.
+
+    """
+    def __init__(self, level, goal, arrays=None):
+        self.level = level
+        grid = level.grid
+        self.rows, self.columns = grid.rows, grid.columns
+        self.tile_length = level.tilesize / PX_PER_M
+        self.goal = set(row * self.columns + column for row, column in goal)
+        size = self.rows * self.columns
+        # (friction, solid, boost velocity) of each of the grid's tile
+        # types, and the cost of each step from one type to another
+        self._kinds = []
+        self._step_costs = {}
+        self._update_kinds()
+        if arrays is not None:
+            self.energy, self.distance_field, self.next, self.rest = arrays
+            # Worked out when they are first needed
+            self._paths = None
+            return
+        self.energy = array('d', [_INFINITY]) * size
+        self.distance_field = array('d', [_INFINITY]) * size
+        self.next = array('i', [-1]) * size
+        self.rest = array('i', range(size))
+        # boost tile index -> indices of the tiles where its ball ends up
+        # depends on
+        self._paths = {}
+        heap = []
+        for i in self.goal:
+            self.energy[i] = self.distance_field[i] = 0.0
+            heap.append((0.0, i))
+        heapq.heapify(heap)
+        self._search(heap)
+        for i in range(size):
+            self._update_rest(i)
+
+    def distance(self, row, column):
+        """Return the metres rolled from (row, column) to the goal"""
+        return self.distance_field[row * self.columns + column]
+
+    def launch_speed(self, row, column):
+        """Return the least speed that gets a ball from (row, column) to the
+        goal, or inf if it can't get there"""
+        return math.sqrt(2 * self.energy[row * self.columns + column])
+
+    def next_cell(self, row, column):
+        """Return the next tile towards the goal, or None"""
+        i = self.next[row * self.columns + column]
+        return divmod(i, self.columns) if i >= 0 else None
+
+    def rest_cell(self, row, column):
+        """Return the tile a ball put down on (row, column) ends up on, or
+        None if it never comes to rest"""
+        i = self.rest[row * self.columns + column]
+        return divmod(i, self.columns) if i >= 0 else None
+
+    def tile_changed(self, row, column):
+        """Update the fields after the tile at (row, column) changed"""
+        self._update_kinds()
+        if self._paths is None:
+            self._make_writable()
+        columns = self.columns
+        changed = row * columns + column
+        energy, distance, next = self.energy, self.distance_field, self.next
+        # Every tile whose path to the goal goes through the changed tile,
+        # or cuts one of its corners, has to be worked out again
+        roots = [changed]
+        for drow, dcolumn in _NEIGHBOURS:
+            r, c = row + drow, column + dcolumn
+            if not self._inside(r, c):
+                continue
+            i = next[r * columns + c]
+            if i >= 0:
+                nr, nc = divmod(i, columns)
+                if nr != r and nc != c and (row, column) in ((r, nc), (nr, c)):
+                    roots.append(r * columns + c)
+        dirty = set(roots)
+        stack = list(roots)
+        while stack:
+            i = stack.pop()
+            r, c = divmod(i, columns)
+            for drow, dcolumn in _NEIGHBOURS:
+                j = (r + drow) * columns + c + dcolumn
+                if (self._inside(r + drow, c + dcolumn) and next[j] == i and
+                        j not in dirty):
+                    dirty.add(j)
+                    stack.append(j)
+        for i in dirty:
+            next[i] = -1
+            energy[i] = distance[i] = 0.0 if i in self.goal else _INFINITY
+        # Start them off from their neighbours that are still right, and
+        # let the neighbours of the changed tile try any new way through it
+        heap = []
+        for i in dirty:
+            r, c = divmod(i, columns)
+            if i not in self.goal and self._passable(r, c):
+                for drow, dcolumn in _NEIGHBOURS:
+                    j = (r + drow) * columns + c + dcolumn
+                    if j in dirty or not self._can_step(r, c, drow, dcolumn):
+                        continue
+                    cost = energy[j] + self._step_cost(r, c, drow, dcolumn)
+                    if cost < energy[i]:
+                        energy[i] = cost
+                        distance[i] = distance[j] + self._step_length(
+                            drow, dcolumn)
+                        next[i] = j
+            if energy[i] < _INFINITY:
+                heap.append((energy[i], i))
+        for drow, dcolumn in _NEIGHBOURS:
+            r, c = row + drow, column + dcolumn
+            if self._inside(r, c) and energy[r * columns + c] < _INFINITY:
+                heap.append((energy[r * columns + c], r * columns + c))
+        heapq.heapify(heap)
+        self._search(heap)
+        # Boost tiles whose balls roll over the changed tile
+        for i in [i for i, path in self._paths.items() if changed in path]:
+            self._update_rest(i)
+        self._update_rest(changed)
+
+    def _search(self, heap):
+        """Dijkstra's algorithm, backwards from the tiles on heap"""
+        columns = self.columns
+        energy, distance, next = self.energy, self.distance_field, self.next
+        while heap:
+            e, i = heapq.heappop(heap)
+            if e > energy[i]:
+                continue
+            row, column = divmod(i, columns)
+            for drow, dcolumn in _NEIGHBOURS:
+                # The tile a ball would roll onto i from
+                r, c = row + drow, column + dcolumn
+                if not self._can_step(r, c, -drow, -dcolumn):
+                    continue
+                j = r * columns + c
+                cost = e + self._step_cost(r, c, -drow, -dcolumn)
+                if cost < energy[j]:
+                    energy[j] = cost
+                    distance[j] = distance[i] + self._step_length(drow,
+                                                                  dcolumn)
+                    next[j] = i
+                    heapq.heappush(heap, (cost, j))
+
+    def _make_writable(self):
+        """Copy the fields from the arrays they were made with, and work
+        out what the rest field depends on"""
+        fields = []
+        for field in (self.energy, self.distance_field, self.next, self.rest):
+            copy = array(field.format if isinstance(field, memoryview)
+                         else field.typecode)
+            copy.frombytes(bytes(field))
+            fields.append(copy)
+        self.energy, self.distance_field, self.next, self.rest = fields
+        self._paths = {}
+        for i in range(self.rows * self.columns):
+            if self._kind(*divmod(i, self.columns))[2] is not None:
+                self._update_rest(i)
+
+    def _update_kinds(self):
+        # Tile types are only ever added to a grid
+        types = self.level.grid.types
+        for tile in types[len(self._kinds):]:
+            self._kinds.append((tile.friction, tile.solid, _boost(tile)))
+
+    def _kind(self, row, column):
+        return self._kinds[self.level.grid.indices[row * self.columns +
+                                                   column]]
+
+    def _update_rest(self, i):
+        self._paths.pop(i, None)
+        row, column = divmod(i, self.columns)
+        if self._kind(row, column)[2] is None:
+            self.rest[i] = i
+            return
+        # Roll the ball tile by tile until it runs out of energy
+        path = set([i])
+        energy = 0.0
+        for step in range(self.rows * self.columns):
+            friction, solid, boost = self._kind(row, column)
+            if boost is not None:
+                speed = math.hypot(boost.x, boost.y)
+                drow = int(round(boost.y / speed))
+                dcolumn = int(round(boost.x / speed))
+                energy = max(energy, speed * speed / 2)
+            # Whether the ball gets any further depends on the tiles ahead
+            # too, including the corners it would pass
+            for r, c in ((row + drow, column + dcolumn),
+                         (row + drow, column), (row, column + dcolumn)):
+                if self._inside(r, c):
+                    path.add(r * self.columns + c)
+            if not self._can_step(row, column, drow, dcolumn):
+                break
+            cost = friction * self._step_length(drow, dcolumn)
+            if energy < cost:
+                break
+            energy -= cost
+            row, column = row + drow, column + dcolumn
+        else:
+            # Round and round a loop of boosts
+            row = column = None
+        self._paths[i] = path
+        self.rest[i] = (row * self.columns + column if row is not None
+                        else -1)
+
+    def _inside(self, row, column):
+        return 0 <= row < self.rows and 0 <= column < self.columns
+
+    def _passable(self, row, column):
+        return (self._inside(row, column) and
+                not self._kind(row, column)[1])
+
+    def _can_step(self, row, column, drow, dcolumn):
+        """Return whether a ball can roll from (row, column) to the
+        neighbouring tile in direction (drow, dcolumn)"""
+        if not (self._passable(row, column) and
+                self._passable(row + drow, column + dcolumn)):
+            return False
+        if drow and dcolumn:
+            return (self._passable(row + drow, column) and
+                    self._passable(row, column + dcolumn))
+        return True
+
+    def _step_length(self, drow, dcolumn):
+        return self.tile_length * (math.sqrt(2) if drow and dcolumn else 1)
+
+    def _step_cost(self, row, column, drow, dcolumn):
+        """Return the energy used rolling from the middle of (row, column)
+        to the middle of its neighbour in direction (drow, dcolumn)"""
+        indices, columns = self.level.grid.indices, self.columns
+        key = (indices[row * columns + column],
+               indices[(row + drow) * columns + column + dcolumn],
+               drow, dcolumn)
+        cost = self._step_costs.get(key)
+        if cost is not None:
+            return cost
+        half = self._step_length(drow, dcolumn) / 2
+        norm = math.hypot(drow, dcolumn)
+        ux, uy = dcolumn / norm, drow / norm
+        cost = 0.0
+        for friction, solid, boost in (self._kinds[key[0]],
+                                       self._kinds[key[1]]):
+            tile_cost = friction * half
+            if boost is not None:
+                along = boost.x * ux + boost.y * uy
+                tile_cost -= along * abs(along) / 4
+            cost += max(tile_cost, 0.0)
+        self._step_costs[key] = cost
+        return cost
+
+
+def _boost(tile):
+    """Return the tile's boost velocity, or None if it doesn't have one"""
+    boost = getattr(tile, 'boost_velocity', None)
+    if boost is None or not boost:
+        return None
+    return boost
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
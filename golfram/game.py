@@ -1,14 +1,18 @@
-from Level import *
-import pygame
-from pygame.locals import *
+from golfram.level import Level
+
+# The zoom levels zoom_in() and zoom_out() step through. Each one in use
+# costs a scaled copy of every texture drawn at it.
+ZOOM_LEVELS = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0)
 
 class Game:
 
-    def __init__(self, viewsize, level=None, players=[]):
+    def __init__(self, viewsize, level=None, players=None):
         self.level = level
-        self.players = players
+        # Each game needs its own list, or every game would share one
+        self.players = players if players is not None else []
         self.viewoffsetx = self.viewoffsety = 0
         self.viewsize = viewsize
+        self.zoom = 1.0
 
     def load_level(self, levelname):
         self.level = Level.load_file(levelname)
@@ -16,30 +20,124 @@ class Game:
     def add_player(self, ply):
         self.players.append(ply)
 
+    def remove_player(self, ply):
+        self.players.remove(ply)
+
     def reset(self):
         self.level = None
         self.players = []
         self.viewoffsetx = self.viewoffsety = 0
+        self.zoom = 1.0
+
+    def tick(self, dt):
+        """Advance the game by dt seconds
+
+        Raises LevelComplete once the level is complete.
 
-    def tick(self):
-        return
+        """
+        if self.level is not None:
+            self.prefetch()
+            self.level.tick(dt)
 
-    def draw(self):
-        return self.level.draw(self.viewoffsetx, self.viewoffsety, self.viewsize[0] / self.level.tilesize, self.viewsize[1] / self.level.tilesize)
+    def draw(self, surface):
+        """Draw the part of the level in view; return the rectangles drawn
+
+        The view offsets are in tiles. When they changed since the last draw,
+        the picture already on surface is scrolled instead of redrawn. When
+        the zoom changed, everything is drawn again, from sprites scaled the
+        first time each zoom level was used.
+
+        """
+        self.prefetch()
+        renderer = self.level.renderer
+        tilesize = renderer.tilesize
+        renderer.set_zoom(self.zoom)
+        if renderer.tilesize != tilesize:
+            # The level may no longer cover what it did
+            surface.fill((0, 0, 0))
+            tilesize = renderer.tilesize
+        rects = renderer.scroll_to(surface, self.viewoffsetx * tilesize,
+                                   self.viewoffsety * tilesize)
+        return rects + renderer.draw_dirty(surface)
+
+    def prefetch(self):
+        """Have the tiles in view and under each entity loaded, if the level
+        pages its tiles in (see golfram.paging)"""
+        level = self.level
+        prefetch = getattr(level.grid, 'prefetch', None)
+        if prefetch is None:
+            return
+        # Don't make a renderer just for this: headless games have none
+        renderer = level._renderer
+        tilesize = (renderer.tilesize if renderer is not None
+                    else level.tilesize)
+        areas = [(range(self.viewoffsety, self.viewoffsety +
+                        -(-self.viewsize[1] // tilesize)),
+                  range(self.viewoffsetx, self.viewoffsetx +
+                        -(-self.viewsize[0] // tilesize)))]
+        for entity, physics in level._entities:
+            row, column = level.cell_at_point(entity.position)
+            areas.append((range(row, row + 1), range(column, column + 1)))
+        prefetch(areas)
 
     def scroll_down(self, amt=1):
+        """Scroll the view amt tiles down
+
+        The view never scrolls past the level's edges, except as far as
+        it has to for the last row or column to be in view, and it stays
+        at the top left corner of levels smaller than the view:
+
+        >>> from golfram.tile import Tile
+        >>> game = Game((640, 480), Level(tiles=[[Tile()] * 20] * 10))
+        >>> game.scroll_down(100)
+        >>> game.scroll_right(-3)
+        >>> game.viewoffsetx, game.viewoffsety
+        (0, 3)
+        >>> game.zoom_out()
+        >>> game.viewoffsety
+        0
+
+        """
         self.viewoffsety += amt
+        self._clamp_view()
 
     def scroll_up(self, amt=1):
-        if self.viewoffsety > amt:
-            self.viewoffsety -= amt
+        self.viewoffsety -= amt
+        self._clamp_view()
 
     def scroll_left(self, amt=1):
-        self.viewoffsetx += amt
+        self.viewoffsetx -= amt
+        self._clamp_view()
 
     def scroll_right(self, amt=1):
-        if self.viewoffsetx > amt:
-            self.viewoffsetx -= amt
+        self.viewoffsetx += amt
+        self._clamp_view()
+
+    def zoom_in(self):
+        """Zoom in to the next of ZOOM_LEVELS"""
+        bigger = [zoom for zoom in ZOOM_LEVELS if zoom > self.zoom]
+        if bigger:
+            self.zoom = bigger[0]
+
+    def zoom_out(self):
+        """Zoom out to the previous of ZOOM_LEVELS"""
+        smaller = [zoom for zoom in ZOOM_LEVELS if zoom < self.zoom]
+        if smaller:
+            self.zoom = smaller[-1]
+            # More of the level fits in view now
+            self._clamp_view()
+
+    def _clamp_view(self):
+        level = self.level
+        if level is not None:
+            tilesize = level.tilesize * self.zoom
+            grid = level.grid
+            self.viewoffsetx = min(self.viewoffsetx, grid.columns -
+                                   int(self.viewsize[0] // tilesize))
+            self.viewoffsety = min(self.viewoffsety, grid.rows -
+                                   int(self.viewsize[1] // tilesize))
+        self.viewoffsetx = max(self.viewoffsetx, 0)
+        self.viewoffsety = max(self.viewoffsety, 0)
 
 
 if __name__ == '__main__':
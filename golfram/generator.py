@@ -0,0 +1,402 @@
+"""Generating levels in bulk
+
+Levels are generated a batch at a time, every level of a batch at once in
+NumPy arrays: smoothed noise is cut into patches of terrain, each kind of
+terrain covering its share of the level, and a start and a goal tile are
+picked. Each batch draws from its own random generator, seeded with the
+seed of the run and the batch's number, so a run can be repeated exactly
+however many processes share the work.
+
+A level only makes it through if it is playable: the start and the goal
+must be tiles the ball can rest on, far enough apart, and a shot of no
+more than max_speed must be able to roll the ball into the goal. The
+energy that takes is what LevelFields works out, but found for the whole
+batch at once: generated terrain has no walls or boosts, so repeatedly
+relaxing every tile from its eight neighbours, all levels together,
+settles on the same answer as LevelFields' search of each level.
+
+    >>> levels = list(generate(seed=1, count=3, width=12, height=8,
+    ...                        processes=0))
+    >>> [level.indices.shape for level in levels]
+    [(8, 12), (8, 12), (8, 12)]
+    >>> all(level.launch_speed <= 4.0 for level in levels)
+    True
+    >>> again = list(generate(seed=1, count=3, width=12, height=8,
+    ...                       processes=0))
+    >>> [level.goal for level in again] == [level.goal for level in levels]
+    True
+
+write() saves a level as a .lvl file next to a shared .tiledefs, and
+compiles it, so the game loads it with mmap straight away. From the
+command line, the whole pipeline runs across every core:
+
+    python -m golfram.generator daily/ --count 20000 --seed 20261018
+
+"""
+from __future__ import division
+import argparse
+import collections
+import itertools
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+from golfram import levelfile
+from golfram.fields import _NEIGHBOURS
+from golfram.level import Level
+from golfram.tile import Tile
+from golfram.units import PX_PER_M
+from golfram.util import error, info
+
+DEFAULT_TILEDEFS = os.path.join(os.path.dirname(__file__), '..', 'levels',
+                                'demo.tiledefs')
+# The tile types generated levels are made of, from the smoothest to the
+# roughest terrain, and the share of each level each one covers
+DEFAULT_TERRAIN = '41230'
+DEFAULT_SHARES = (0.05, 0.5, 0.25, 0.15, 0.05)
+
+GeneratedLevel = collections.namedtuple(
+    'GeneratedLevel', 'seed batch number indices start goal launch_speed')
+
+
+class GenerationError(Exception):
+    """Too few of the levels generated were playable"""
+
+
+class Palette(object):
+    """The tile types of a .tiledefs file, and which of them are terrain
+
+    terrain is a string of the chars of the tile types to generate levels
+    from, and shares the fraction of each level covered by each of them.
+
+    """
+    def __init__(self, tiledefs=DEFAULT_TILEDEFS, terrain=DEFAULT_TERRAIN,
+                 shares=DEFAULT_SHARES):
+        if len(terrain) != len(shares):
+            raise ValueError("need a share for each terrain type")
+        self.tiledefs = os.path.abspath(tiledefs)
+        with open(tiledefs) as f:
+            self.info, self.types = levelfile._parse_tiledefs(f, tiledefs)
+        chars = [tile_type['char'] for tile_type in self.types]
+        self.terrain = [chars.index(char) for char in terrain]
+        total = float(sum(shares))
+        self.shares = [share / total for share in shares]
+        self.frictions = [Tile.friction if tile_type['friction'] is None
+                          else tile_type['friction']
+                          for tile_type in self.types]
+
+
+def generate_batch(seed, batch, size, width, height, palette=None,
+                   smoothness=2, min_distance=None, max_speed=4.0):
+    """Generate a batch of size levels; return those that are playable
+
+    smoothness is the radius, in tiles, of the blur that turns the noise
+    into patches of terrain. The start and goal must be at least
+    min_distance tiles apart (by default, half the level's larger side).
+
+    """
+    import numpy
+    if palette is None:
+        palette = Palette()
+    if min_distance is None:
+        min_distance = max(width, height) // 2
+    rng = numpy.random.default_rng([seed, batch])
+    # Smoothed noise, ranked within each level, so that each kind of
+    # terrain covers exactly its share
+    noise = rng.random((size, height + 2 * smoothness,
+                        width + 2 * smoothness))
+    noise = _box_blur(_box_blur(noise, smoothness, 1), smoothness, 2)
+    ranks = noise.reshape(size, -1).argsort(axis=1).argsort(axis=1)
+    edges = numpy.cumsum(palette.shares)[:-1] * width * height
+    terrain = numpy.searchsorted(edges, ranks, side='right')
+    indices = numpy.array(palette.terrain, dtype=numpy.uint8)[terrain]
+    indices = indices.reshape(size, height, width)
+    # Start and goal, on tiles that a ball can come to rest on
+    starts = numpy.stack([rng.integers(0, height, size),
+                          rng.integers(0, width, size)], axis=1)
+    goals = numpy.stack([rng.integers(0, height, size),
+                         rng.integers(0, width, size)], axis=1)
+    frictions = numpy.array(palette.frictions)
+    levels = numpy.arange(size)
+    ok = ((abs(starts - goals).max(axis=1) >= min_distance) &
+          (frictions[indices[levels, starts[:, 0], starts[:, 1]]] > 0) &
+          (frictions[indices[levels, goals[:, 0], goals[:, 1]]] > 0))
+    chosen = numpy.flatnonzero(ok)
+    speeds = launch_speeds(frictions[indices[chosen]], starts[chosen],
+                           goals[chosen])
+    playable = []
+    for i, speed in zip(chosen.tolist(), speeds.tolist()):
+        if speed <= max_speed:
+            playable.append(GeneratedLevel(seed, batch, i, indices[i],
+                                           tuple(starts[i].tolist()),
+                                           tuple(goals[i].tolist()), speed))
+    return playable
+
+def launch_speeds(frictions, starts, goals):
+    """Return the least speed that rolls a ball from start to goal, for
+    each of a stack of levels without walls or boosts
+
+    frictions is an array of the friction of every tile of every level
+    (level, row, column), and starts and goals hold a (row, column) for
+    each level. Speeds are what LevelFields.launch_speed() would say:
+
+        >>> import numpy
+        >>> from golfram.fields import LevelFields
+        >>> from golfram.tile import Tile
+        >>> rough, smooth = Tile(), Tile()
+        >>> rough.friction, smooth.friction = 1.0, 0.2
+        >>> rows = [[rough, smooth, smooth], [smooth, rough, smooth]]
+        >>> fields = LevelFields(Level(tiles=rows), goal=[(1, 2)])
+        >>> frictions = numpy.array([[[t.friction for t in row]
+        ...                           for row in rows]])
+        >>> speed, = launch_speeds(frictions, numpy.array([[0, 0]]),
+        ...                        numpy.array([[1, 2]])).tolist()
+        >>> abs(speed - fields.launch_speed(0, 0)) < 1e-12
+        True
+
+    """
+    import numpy
+    count = len(frictions)
+    levels = numpy.arange(count)
+    tile_length = Level.tilesize / PX_PER_M
+    # The energy used rolling across half of each tile, straight on
+    half = numpy.maximum(frictions, 0.0) * (tile_length / 2)
+    energy = numpy.full(frictions.shape, numpy.inf)
+    energy[levels, goals[:, 0], goals[:, 1]] = 0.0
+    while True:
+        relaxed = energy.copy()
+        for drow, dcolumn in _NEIGHBOURS:
+            # Tiles in here step onto the tiles in there
+            here = (slice(None), _span(drow), _span(dcolumn))
+            there = (slice(None), _span(-drow), _span(-dcolumn))
+            scale = math.sqrt(2) if drow and dcolumn else 1.0
+            numpy.minimum(relaxed[here], energy[there] +
+                          (half[here] + half[there]) * scale,
+                          out=relaxed[here])
+        if (relaxed == energy).all():
+            break
+        energy = relaxed
+    return numpy.sqrt(2 * energy[levels, starts[:, 0], starts[:, 1]])
+
+def _span(offset):
+    """Return the slice of an axis whose tiles have a neighbour at offset"""
+    if offset > 0:
+        return slice(0, -offset)
+    if offset < 0:
+        return slice(-offset, None)
+    return slice(None)
+
+def _box_blur(a, radius, axis):
+    """Average a over windows of 2 * radius + 1 along axis, dropping the
+    radius values at each end that have no full window"""
+    import numpy
+    window = 2 * radius + 1
+    length = a.shape[axis]
+    shape = list(a.shape)
+    shape[axis] = 1
+    sums = numpy.concatenate([numpy.zeros(shape), numpy.cumsum(a, axis)],
+                             axis)
+    return (sums.take(range(window, length + 1), axis) -
+            sums.take(range(0, length + 1 - window), axis)) / window
+
+
+def generate(seed, count, width=16, height=12, processes=None,
+             batch_size=256, max_batches=None, **options):
+    """Yield count playable levels, in the same order every time
+
+    Batches are generated over a pool of processes (0 generates in this
+    process; None uses every CPU), a few at a time ahead of the levels
+    being consumed, so levels stream out as the batches finish. options
+    are passed on to generate_batch().
+
+    Raises GenerationError if max_batches batches don't make count levels
+    between them. By default, that's enough batches for one level in a
+    hundred to be playable:
+
+        >>> try:
+        ...     levels = list(generate(seed=1, count=3, width=12, height=8,
+        ...                            processes=0, batch_size=16,
+        ...                            max_speed=0.01))
+        ... except GenerationError as e:
+        ...     print(e)
+        only 0 of 3 levels were playable after 100 batches
+
+    Asking for no levels yields none, without generating anything:
+
+        >>> list(generate(seed=1, count=0, processes=0))
+        []
+
+    """
+    if count <= 0:
+        return
+    if max_batches is None:
+        max_batches = 100 * -(-count // batch_size)
+    if processes == 0:
+        batches = (generate_batch(seed, batch, batch_size, width, height,
+                                  **options)
+                   for batch in range(max_batches))
+        for level in _take(batches, count, max_batches):
+            yield level
+        return
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = collections.deque()
+        numbers = iter(range(max_batches))
+
+        def results():
+            while True:
+                # Keep every process busy, and the next batch coming
+                for number in itertools.islice(numbers, 2 * processes -
+                                               len(pending)):
+                    pending.append(pool.apply_async(
+                        generate_batch, (seed, number, batch_size, width,
+                                         height), options))
+                if not pending:
+                    return
+                yield pending.popleft().get()
+        for level in _take(results(), count, max_batches):
+            yield level
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _take(batches, count, max_batches):
+    wanted = count
+    for levels in batches:
+        for level in levels:
+            if count <= 0:
+                return
+            count -= 1
+            yield level
+        if count <= 0:
+            return
+    raise GenerationError("only {} of {} levels were playable after {} "
+                          "batches".format(wanted - count, wanted,
+                                           max_batches))
+
+
+def write_tiledefs(directory, palette, name='generated.tiledefs'):
+    """Write palette's tile types to directory; return the file's name
+
+    The atlas stays where it is, so the @texture path is made relative to
+    directory.
+
+    """
+    info = palette.info
+    lines = []
+    if info['texture']:
+        atlas = os.path.join(os.path.dirname(palette.tiledefs),
+                             info['texture'])
+        lines.append('@texture {}'.format(os.path.relpath(atlas, directory)))
+    if info['tilesize'] is not None:
+        lines.append('@tilesize {}'.format(info['tilesize']))
+    for tile_type in palette.types:
+        line = '@tt char={}'.format(tile_type['char'])
+        if tile_type['friction'] is not None:
+            line += ' friction={!r}'.format(tile_type['friction'])
+        if tile_type['texture'] is not None:
+            line += ' texture=({},{})'.format(*tile_type['texture'])
+        lines.append(line)
+    with open(os.path.join(directory, name), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return name
+
+def write(directory, name, level, palette, tiledefs='generated.tiledefs',
+          compile=True):
+    """Write a GeneratedLevel to directory as name.lvl; return the filename
+
+    The level's @goal and @start are "row column". Unless compile is False,
+    the compiled level is written too, without parsing the .lvl again.
+
+    """
+    height, width = level.indices.shape
+    chars = [tile_type['char'] for tile_type in palette.types]
+    rows = [''.join(chars[i] for i in row) for row in level.indices.tolist()]
+    meta = collections.OrderedDict([
+        ('width', str(width)), ('height', str(height)),
+        ('goal', '{} {}'.format(*level.goal)),
+        ('start', '{} {}'.format(*level.start)),
+        ('seed', '{} {} {}'.format(level.seed, level.batch, level.number)),
+    ])
+    filename = os.path.join(directory, name + '.lvl')
+    with open(filename, 'w') as f:
+        f.write('@tiledefs {}\n'.format(tiledefs))
+        for key, value in meta.items():
+            f.write('@{} {}\n'.format(key, value))
+        f.write('@leveldata\n{}\n@endleveldata\n'.format('\n'.join(rows)))
+    if compile:
+        with open(os.path.join(directory, tiledefs)) as f:
+            tiledefs_info, types = levelfile._parse_tiledefs(f, tiledefs)
+        tiledefs_info['tiledefs'] = tiledefs
+        tiledefs_info['meta'] = dict(meta)
+        compiled = levelfile.CompiledLevel(width, height, types,
+                                           level.indices.ravel().tolist(),
+                                           tiledefs_info)
+        levelfile.write_compiled(
+            os.path.splitext(filename)[0] + levelfile.COMPILED_EXTENSION,
+            compiled, [filename, os.path.join(directory, tiledefs)])
+    return filename
+
+
+def _positive_int(text):
+    try:
+        number = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("not a whole number: {!r}".format(
+                                         text))
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, not {}".format(
+                                         number))
+    return number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate playable levels in bulk.")
+    parser.add_argument('directory', help="where to write the levels")
+    parser.add_argument('--count', type=_positive_int, default=1000)
+    parser.add_argument('--width', type=int, default=16)
+    parser.add_argument('--height', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefix', default='level',
+                        help="levels are named PREFIX-NUMBER.lvl")
+    parser.add_argument('--tiledefs', default=DEFAULT_TILEDEFS)
+    parser.add_argument('--max-speed', type=float, default=4.0,
+                        help="the fastest shot a level may need, in m/s")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="size of the pool (default: every CPU)")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--max-batches', type=int, default=None,
+                        help="give up after this many batches (default: "
+                             "enough for 1%% of levels to be playable)")
+    parser.add_argument('--no-compile', action='store_false', dest='compile',
+                        help="only write the .lvl files")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.directory):
+        os.makedirs(args.directory)
+    palette = Palette(args.tiledefs)
+    tiledefs = write_tiledefs(args.directory, palette)
+    start = time.time()
+    digits = len(str(args.count - 1))
+    try:
+        for number, level in enumerate(generate(
+                args.seed, args.count, args.width, args.height,
+                args.processes, args.batch_size, args.max_batches,
+                palette=palette, max_speed=args.max_speed)):
+            write(args.directory, '{}-{:0{}d}'.format(args.prefix, number,
+                                                     digits),
+                  level, palette, tiledefs, args.compile)
+    except GenerationError as e:
+        error(str(e))
+        return 1
+    info("wrote {} levels to {} in {:.1f} s".format(
+         args.count, args.directory, time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
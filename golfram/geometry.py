@@ -1,16 +1,40 @@
 import math
+from array import array
 
 class Circle:
 
     __slots__ = ('center', 'radius')
 
     def __init__(self, radius, center=None):
-        if center:
+        if center is not None:
             self.center = center
         else:
             self.center = Vector(0, 0)
         self.radius = radius
 
+    def __repr__(self):
+        return 'Circle({0!r}, {1!r})'.format(self.radius, self.center)
+
+    def is_touching(self, shape):
+        """Return whether the circle overlaps a Circle or Rectangle
+
+        >>> c = Circle(1, Vector(0, 0))
+        >>> c.is_touching(Circle(1, Vector(1.5, 0)))
+        True
+        >>> c.is_touching(Rectangle(nw=Vector(0.8, 0.8), width=1, height=1))
+        False
+
+        """
+        if isinstance(shape, Circle):
+            reach = self.radius + shape.radius
+            dx = shape.center.x - self.center.x
+            dy = shape.center.y - self.center.y
+            return dx * dx + dy * dy < reach * reach
+        closest = shape.closest_point(self.center)
+        dx = closest.x - self.center.x
+        dy = closest.y - self.center.y
+        return dx * dx + dy * dy < self.radius * self.radius
+
 
 class Rectangle:
     """A simple two-dimensional rectangle"""
@@ -25,16 +49,18 @@ class Rectangle:
 
         """
         if width and height:
-            if se and not nw:
+            if se is not None and nw is None:
                 self.se = se
                 self.nw = Vector(self.se.x - width, self.se.y - height)
             else:
-                if nw:
+                if nw is not None:
                     self.nw = nw
                 else:
                     self.nw = Vector(0, 0)
                 self.se = Vector(self.nw.x + width, self.nw.y + height)
-        elif nw and se:
+            self.width = width
+            self.height = height
+        elif nw is not None and se is not None:
             self.nw = nw
             self.se = se
             self.width = self.se.x - self.nw.x
@@ -49,15 +75,47 @@ class Rectangle:
         return self.__repr__()
 
     def contains(self, point):
-        return (point.x >= self.nw.x and point.x <= self.sw.x and
-                point.y >= self.nw.y and point.y <= self.sw.y)
+        return (point.x >= self.nw.x and point.x <= self.se.x and
+                point.y >= self.nw.y and point.y <= self.se.y)
+
+    def closest_point(self, point):
+        """Return the point in the rectangle closest to point"""
+        return Vector(min(max(point.x, self.nw.x), self.se.x),
+                      min(max(point.y, self.nw.y), self.se.y))
+
+    def is_touching(self, shape):
+        """Return whether the rectangle overlaps a Rectangle or Circle
 
-    def is_touching(self, rectangle):
-        raise NotImplemented()
+        >>> r = Rectangle(nw=Vector(0, 0), width=2, height=2)
+        >>> r.is_touching(Rectangle(nw=Vector(1, 1), se=Vector(3, 3)))
+        True
+        >>> r.is_touching(Rectangle(nw=Vector(2.5, 0), width=1, height=1))
+        False
+
+        """
+        if isinstance(shape, Circle):
+            return shape.is_touching(self)
+        return (self.nw.x < shape.se.x and shape.nw.x < self.se.x and
+                self.nw.y < shape.se.y and shape.nw.y < self.se.y)
 
 
 class Vector:
-    """A simple two-dimensional vector"""
+    """A simple two-dimensional vector
+
+    The arithmetic operators return new vectors. The augmented assignments,
+    add_scaled() and set() change the vector in place instead, which avoids
+    creating short-lived vectors in hot loops:
+
+    >>> v = Vector(1, 2)
+    >>> w = v
+    >>> v += Vector(1, 1)
+    >>> v *= 2
+    >>> w
+    Vector(4.0, 6.0)
+    >>> v.add_scaled(Vector(1, 0), 0.5)
+    Vector(4.5, 6.0)
+
+    """
 
     __slots__ = ('x', 'y')
 
@@ -77,7 +135,8 @@ class Vector:
     __hash__ = None
 
     def __bool__(self):
-        return not self.x == 0 and not self.y == 0
+        return self.x != 0 or self.y != 0
+    __nonzero__ = __bool__ # Needed for Python 2.x
 
     def __add__(self, other):
         return Vector(self.x + other.x, self.y + other.y)
@@ -97,6 +156,30 @@ class Vector:
         return Vector(self.x / value, self.y / value)
     __div__ = __truediv__ # Needed for Python 2.x
 
+    def __iadd__(self, other):
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def __isub__(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        return self
+
+    def __imul__(self, value):
+        # The dot product isn't a vector, so it can't be done in place
+        if isinstance(value, Vector):
+            return NotImplemented
+        self.x *= value
+        self.y *= value
+        return self
+
+    def __itruediv__(self, value):
+        self.x /= value
+        self.y /= value
+        return self
+    __idiv__ = __itruediv__ # Needed for Python 2.x
+
     def __neg__(self):
         return Vector(-self.x, -self.y)
 
@@ -121,6 +204,18 @@ class Vector:
         """
         return math.sqrt(self.x ** 2 + self.y ** 2)
 
+    def add_scaled(self, other, scale):
+        """Add other * scale to the vector in place and return it"""
+        self.x += other.x * scale
+        self.y += other.y * scale
+        return self
+
+    def set(self, x, y):
+        """Set both components in place and return the vector"""
+        self.x = x
+        self.y = y
+        return self
+
     def normalize(self):
         """Return a unit vector in the direction of the vector
 
@@ -134,7 +229,165 @@ class Vector:
     def project(self, other):
         """Calculates the vector projection onto other"""
         joseph = other.normalize()
-        return self * joseph * joseph
+        joseph *= self * joseph
+        return joseph
+
+
+class VectorArray:
+    """A packed array of two-dimensional vectors
+
+    The components are stored interleaved (x0, y0, x1, y1, ...) in an
+    array('d'), so a batch of vectors costs 16 bytes each and no objects.
+    Indexing returns a copy as a Vector; view() returns a Vector that reads
+    and writes its place in the array instead, so that code written for
+    Vectors works on the packed vectors directly. BatchPhysics keeps its
+    entities' positions and velocities this way.
+
+    >>> a = VectorArray([Vector(1, 2), Vector(3, 4)])
+    >>> b = VectorArray([Vector(1, 1), Vector(0, 2)])
+    >>> a.add_scaled(b, 2)
+    >>> a[1]
+    Vector(3.0, 8.0)
+    >>> len(a)
+    2
+    >>> v = a.view(1)
+    >>> v += Vector(1, 1)
+    >>> a[1]
+    Vector(4.0, 9.0)
+
+    A view follows its vector when an earlier one is popped, and keeps a
+    copy of its own once its vector is popped:
+
+    >>> a.pop(0)
+    Vector(3.0, 4.0)
+    >>> v.x = 5
+    >>> a[0]
+    Vector(5.0, 9.0)
+    >>> a.pop()
+    Vector(5.0, 9.0)
+    >>> v, len(a)
+    (Vector(5.0, 9.0), 0)
+
+    """
+    __slots__ = ('data', '_views')
+
+    def __init__(self, vectors=()):
+        self.data = array('d')
+        # index -> the view of that vector
+        self._views = {}
+        for vector in vectors:
+            self.data.append(vector.x)
+            self.data.append(vector.y)
+
+    def __len__(self):
+        return len(self.data) // 2
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return Vector(self.data[2*i], self.data[2*i + 1])
+
+    def __setitem__(self, i, vector):
+        if i < 0:
+            i += len(self)
+        self.data[2*i] = vector.x
+        self.data[2*i + 1] = vector.y
+
+    def __iter__(self):
+        data = self.data
+        for i in range(0, len(data), 2):
+            yield Vector(data[i], data[i + 1])
+
+    def append(self, vector):
+        try:
+            self.data.extend((vector.x, vector.y))
+        except BufferError:
+            raise BufferError(_RESIZED_WHILE_SHARED)
+
+    def pop(self, i=-1):
+        """Remove the i'th vector and return a copy of it"""
+        if i < 0:
+            i += len(self)
+        vector = self[i]
+        try:
+            del self.data[2*i:2*i + 2]
+        except BufferError:
+            raise BufferError(_RESIZED_WHILE_SHARED)
+        views = self._views
+        view = views.pop(i, None)
+        if view is not None:
+            view._data, view._offset = array('d', vector), 0
+        for j in sorted(j for j in views if j > i):
+            view = views[j - 1] = views.pop(j)
+            view._offset -= 2
+        return vector
+
+    def view(self, i):
+        """Return a Vector that reads and writes the i'th vector in place"""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        view = self._views.get(i)
+        if view is None:
+            view = self._views[i] = _VectorView(self.data, 2 * i)
+        return view
+
+    def add_scaled(self, other, scale):
+        """Add other * scale to every vector in place
+
+        other is a VectorArray of the same length.
+
+        """
+        try:
+            self.as_numpy()[:] += other.as_numpy() * scale
+            return
+        except ImportError:
+            pass
+        data, others = self.data, other.data
+        for i in range(len(data)):
+            data[i] += others[i] * scale
+
+    def as_numpy(self):
+        """Return an (n, 2) NumPy array sharing the vectors' memory
+
+        While the NumPy array is around, the VectorArray can't change size:
+        append() and pop() raise BufferError. NumPy is only imported here, so
+        the rest of the class works without it.
+
+        """
+        import numpy
+        return numpy.frombuffer(self.data, dtype=float).reshape(-1, 2)
+
+
+_RESIZED_WHILE_SHARED = ("drop the arrays from as_numpy() before resizing a "
+                         "VectorArray")
+
+
+class _VectorView(Vector):
+    """A Vector whose components live in a VectorArray"""
+
+    __slots__ = ('_data', '_offset')
+
+    def __init__(self, data, offset):
+        self._data = data
+        self._offset = offset
+
+    @property
+    def x(self):
+        return self._data[self._offset]
+
+    @x.setter
+    def x(self, value):
+        self._data[self._offset] = value
+
+    @property
+    def y(self):
+        return self._data[self._offset + 1]
+
+    @y.setter
+    def y(self, value):
+        self._data[self._offset + 1] = value
 
 
 if __name__ == '__main__':
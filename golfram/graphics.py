@@ -1,4 +1,31 @@
-from golfram.units import px
+import os
+from collections import OrderedDict
+
+from golfram import textures
+from golfram.geometry import Rectangle, Vector
+from golfram.units import PX_PER_M, m, px
+
+class LazyTexture(object):
+    """A texture class attribute that is only loaded when it is first used
+
+    Loading images at class definition time means importing a module needs
+    pygame and decodes a PNG, even if nothing is ever drawn. Use this instead:
+
+    >>> decoded = textures.manager.decoded
+    >>> class Thing(object):
+    ...     texture = LazyTexture('sprites/red.png')
+    >>> textures.manager.decoded == decoded
+    True
+
+    The image comes from golfram.textures, so it is only decoded once and is
+    converted to the display format when there is a display.
+
+    """
+    def __init__(self, filename):
+        self.filename = os.path.normpath(filename)
+
+    def __get__(self, instance, owner):
+        return textures.get(self.filename)
 
 class Canvas:
     """A wrapper for pygame's Surface to help with offsets and rendering
@@ -23,6 +50,405 @@ class Canvas:
         self.bounds = bounds
 
 
+class LevelRenderer(object):
+    """Draw a Level, keeping track of what needs to be redrawn
+
+    draw() paints the part of the level that is in view. draw_dirty() only
+    repaints the tiles that the level queued in its _redraw_queue, the tiles
+    under every entity's old and new position, and animated tiles (like
+    BoostTile) whose texture changed since they were last drawn. It returns
+    the rectangles it painted so that only those need to be pushed to the
+    display:
+
+        pygame.display.update(level.draw_dirty(screen))
+
+    Only tiles and entities inside the view are ever drawn. The view is as
+    big as the surface being drawn on, and its top left corner is at
+    self.view in screen pixels; move it with scroll_to().
+
+    Textures are drawn self.zoom times their size in the level (tiles are
+    scaled to the level's tilesize, whatever size their art is), through
+    the shared textures.SpriteCache, so that each texture is only scaled
+    once per zoom level. Change it with set_zoom().
+
+    """
+    def __init__(self, level, chunks=None, sprites=None):
+        self.level = level
+        self.sprites = sprites if sprites is not None else textures.sprites
+        self.zoom = 1.0
+        # The width of a tile on screen
+        self.tilesize = level.tilesize
+        if chunks is None:
+            chunks = ChunkCache(level, sprites=self.sprites)
+        self.chunks = chunks
+        self.view = (0, 0)
+        # Where each entity was drawn last, as (x, y, width, height) in screen
+        # pixels
+        self._entity_rects = {}
+        # The texture last drawn on each animated tile, by (row, column)
+        self._textures = {}
+        self._drawn = False
+
+    def draw(self, surface):
+        """Draw every tile and entity in view; return the area drawn"""
+        self._textures = {}
+        self._draw_area(surface, self._view_rect(surface))
+        del self.level._redraw_queue[:]
+        self._entity_rects = self._draw_entities(surface)
+        self._drawn = True
+        return [surface.get_rect()]
+
+    def draw_dirty(self, surface):
+        """Redraw what changed since the last draw; return the rectangles
+
+        The result is the same as drawing everything again, even over tiles
+        that are partly see-through:
+
+        >>> os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+        >>> import pygame
+        >>> from golfram.ball import GolfBall
+        >>> from golfram.level import Level
+        >>> from golfram.tile import Tile
+        >>> class Clear(Tile):
+        ...     texture = pygame.Surface((8, 8), pygame.SRCALPHA)
+        >>> level = Level(tiles=[[Clear()] * 4])
+        >>> level.add_entity(GolfBall(position=Vector(0.1, 0.1),
+        ...                           velocity=Vector(1, 0)))
+        >>> dirty = pygame.Surface((256, 64))
+        >>> renderer = LevelRenderer(level)
+        >>> rects = renderer.draw(dirty)
+        >>> for i in range(10):
+        ...     level.tick(0.01)
+        >>> rects = renderer.draw_dirty(dirty)
+        >>> full = pygame.Surface((256, 64))
+        >>> rects = LevelRenderer(level).draw(full)
+        >>> (pygame.image.tostring(dirty, 'RGB') ==
+        ...  pygame.image.tostring(full, 'RGB'))
+        True
+
+        """
+        if not self._drawn:
+            return self.draw(surface)
+        level = self.level
+        cells = set(level._redraw_queue)
+        del level._redraw_queue[:]
+        for rect in self._entity_rects.values():
+            cells.update(self._cells_under(rect))
+        for rect in self._entity_footprints().values():
+            cells.update(self._cells_under(rect))
+        for cell, texture in self._textures.items():
+            if level.get_tile(*cell).texture is not texture:
+                cells.add(cell)
+        visible = set(self._cells_under(self._view_rect(surface)))
+        size = self.tilesize
+        x0, y0 = self.view
+        rects = []
+        for row, column in sorted(cells & visible):
+            self._draw_cell(surface, row, column)
+            rects.append((column * size - x0, row * size - y0, size, size))
+        self._entity_rects = self._draw_entities(surface)
+        return rects
+
+    def set_zoom(self, zoom):
+        """Draw everything zoom times its size from now on
+
+        Tiles have to be a whole number of pixels wide, so the zoom used is
+        rounded to the nearest one that makes them so. The view keeps its
+        top left corner over the same spot of the level. The next
+        draw_dirty() draws everything.
+
+        """
+        tilesize = max(int(round(self.level.tilesize * zoom)), 1)
+        if tilesize == self.tilesize:
+            return
+        ratio = tilesize / float(self.tilesize)
+        self.view = (int(self.view[0] * ratio), int(self.view[1] * ratio))
+        self.zoom = tilesize / float(self.level.tilesize)
+        self.tilesize = tilesize
+        self.chunks.set_tilesize(tilesize)
+        self._drawn = False
+
+    def scroll_to(self, surface, x, y):
+        """Move the view's top left corner to (x, y) in screen pixels
+
+        What is already on surface is shifted over, and only the strips that
+        come into view are drawn from scratch. Returns the rectangles drawn,
+        which is the whole surface unless the view didn't move. Strips past
+        the level's edges come out black:
+
+        >>> os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+        >>> import pygame
+        >>> from golfram.level import Level
+        >>> from golfram.tile import Tile
+        >>> class Green(Tile):
+        ...     texture = pygame.Surface((8, 8))
+        ...     texture.fill((0, 255, 0))
+        >>> surface = pygame.Surface((200, 64))
+        >>> renderer = LevelRenderer(Level(tiles=[[Green()] * 4]))
+        >>> rects = renderer.draw(surface)
+        >>> rects = renderer.scroll_to(surface, 100, 0)
+        >>> surface.get_at((150, 0)), surface.get_at((160, 0))
+        ((0, 255, 0, 255), (0, 0, 0, 255))
+
+        """
+        x, y = int(x), int(y)
+        dx, dy = x - self.view[0], y - self.view[1]
+        self._set_view(x, y, surface)
+        if not self._drawn or (dx, dy) == (0, 0):
+            return []
+        width, height = surface.get_size()
+        if abs(dx) >= width or abs(dy) >= height:
+            return self.draw(surface)
+        surface.scroll(-dx, -dy)
+        # The strips that were scrolled into view, in screen pixels
+        strips = []
+        if dx > 0:
+            strips.append((x + width - dx, y, dx, height))
+        elif dx < 0:
+            strips.append((x, y, -dx, height))
+        if dy > 0:
+            strips.append((x, y + height - dy, width, dy))
+        elif dy < 0:
+            strips.append((x, y, width, -dy))
+        for strip in strips:
+            surface.set_clip((strip[0] - x, strip[1] - y) + strip[2:])
+            self._draw_area(surface, strip)
+            for entity, rect in self._entity_footprints().items():
+                if _overlaps(rect, strip):
+                    surface.blit(self._sprite(entity.texture, rect),
+                                 (rect[0] - x, rect[1] - y))
+        surface.set_clip(None)
+        return [surface.get_rect()]
+
+    def _set_view(self, x, y, surface):
+        self.view = (x, y)
+        width, height = surface.get_size()
+        zoom = self.zoom
+        self.level._view = Rectangle(nw=Vector(m(x/zoom*px), m(y/zoom*px)),
+                                     width=m(width/zoom*px),
+                                     height=m(height/zoom*px))
+
+    def _view_rect(self, surface):
+        return self.view + surface.get_size()
+
+    def _draw_area(self, surface, rect):
+        """Draw every tile overlapping rect, given in screen pixels
+
+        Static tiles come from the pre-rendered chunks; animated tiles are
+        drawn on top of them one by one. Whatever part of rect is past the
+        level's edges is filled black.
+
+        """
+        grid = self.level.grid
+        x0, y0 = self.view
+        size = self.tilesize
+        if (rect[0] < 0 or rect[1] < 0 or
+                rect[0] + rect[2] > grid.columns * size or
+                rect[1] + rect[3] > grid.rows * size):
+            surface.fill((0, 0, 0), (rect[0] - x0, rect[1] - y0) + rect[2:])
+        for origin, chunk, animated in self.chunks.chunks_under(rect):
+            surface.blit(chunk, (origin[0] - x0, origin[1] - y0))
+            for row, column in animated:
+                self._draw_tile(surface, row, column, grid.get(row, column))
+
+    def _draw_cell(self, surface, row, column):
+        """Draw the tile at (row, column) afresh, as _draw_area() would
+
+        Textures may be partly transparent, so the cell is first covered
+        with its part of the chunk, wiping out whatever was drawn there.
+
+        """
+        n = self.chunks.chunk_size
+        size = self.tilesize
+        chunk, animated = self.chunks.get(row // n, column // n)
+        surface.blit(chunk, (column * size - self.view[0],
+                             row * size - self.view[1]),
+                     (column % n * size, row % n * size, size, size))
+        tile = self.level.get_tile(row, column)
+        if is_animated(tile):
+            self._draw_tile(surface, row, column, tile)
+
+    def _draw_tile(self, surface, row, column, tile):
+        texture = tile.texture
+        if is_animated(tile):
+            self._textures[(row, column)] = texture
+        size = self.tilesize
+        surface.blit(self.sprites.get(texture, (size, size)),
+                     (column * size - self.view[0], row * size - self.view[1]))
+
+    def _draw_entities(self, surface):
+        view = self._view_rect(surface)
+        footprints = self._entity_footprints()
+        for entity, rect in footprints.items():
+            if _overlaps(rect, view):
+                surface.blit(self._sprite(entity.texture, rect),
+                             (rect[0] - self.view[0], rect[1] - self.view[1]))
+        return footprints
+
+    def _entity_footprints(self):
+        footprints = {}
+        zoom = self.zoom
+        scale = PX_PER_M * zoom
+        for entity, physics in self.level._entities:
+            width, height = entity.texture.get_size()
+            footprints[entity] = (int(entity.position.x * scale),
+                                  int(entity.position.y * scale),
+                                  max(int(round(width * zoom)), 1),
+                                  max(int(round(height * zoom)), 1))
+        return footprints
+
+    def _sprite(self, texture, rect):
+        """Return texture scaled to the size of its footprint rect"""
+        return self.sprites.get(texture, rect[2:])
+
+    def _cells_under(self, rect):
+        """Return the (row, column) of every tile overlapping rect
+
+        rect is (x, y, width, height) in screen pixels. Cells outside the
+        level are left out.
+
+        """
+        x, y, width, height = rect
+        size = self.tilesize
+        grid = self.level.grid
+        rows = range(max(y // size, 0),
+                     min((y + height - 1) // size + 1, grid.rows))
+        columns = range(max(x // size, 0),
+                        min((x + width - 1) // size + 1, grid.columns))
+        return [(row, column) for row in rows for column in columns]
+
+
+class ChunkCache(object):
+    """Pre-rendered blocks of a level's static tiles
+
+    Each chunk is a surface holding chunk_size x chunk_size tiles, converted
+    to the display's pixel format if a display is set, so the background can
+    be drawn with a handful of large blits. Animated tiles are left out of
+    the chunks and listed alongside them so they can be drawn on top.
+
+    Chunks are rendered when they are first needed and the least recently
+    used ones are dropped once they take up more than max_bytes. Call
+    invalidate() when a tile changes. They are all dropped when the shared
+    textures.manager converts its images for a new display.
+
+    Tiles are tilesize pixels wide (by default the level's), their textures
+    scaled to fit by sprites (by default the shared textures.SpriteCache).
+
+    """
+    def __init__(self, level, chunk_size=16, max_bytes=32 * 1024 * 1024,
+                 tilesize=None, sprites=None):
+        self.level = level
+        self.tilesize = tilesize if tilesize is not None else level.tilesize
+        self.sprites = sprites if sprites is not None else textures.sprites
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # (tilesize, chunk_row, chunk_column) -> (surface, animated cells)
+        self._chunks = OrderedDict()
+        # textures.manager.conversions when the chunks were rendered
+        self._conversions = textures.manager.conversions
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def chunks_under(self, rect):
+        """Yield (origin, surface, animated cells) for each chunk in rect
+
+        rect is (x, y, width, height) in screen pixels, and origin is the
+        position of the chunk's top left corner in screen pixels.
+
+        """
+        x, y, width, height = rect
+        grid = self.level.grid
+        span = self.chunk_size * self.tilesize
+        rows = range(max(y // span, 0),
+                     min((y + height - 1) // span + 1,
+                         -(-grid.rows // self.chunk_size)))
+        columns = range(max(x // span, 0),
+                        min((x + width - 1) // span + 1,
+                            -(-grid.columns // self.chunk_size)))
+        for chunk_row in rows:
+            for chunk_column in columns:
+                chunk, animated = self.get(chunk_row, chunk_column)
+                yield (chunk_column * span, chunk_row * span), chunk, animated
+
+    def get(self, chunk_row, chunk_column):
+        """Return the (surface, animated cells) of one chunk"""
+        if self._conversions != textures.manager.conversions:
+            self.clear()
+            self._conversions = textures.manager.conversions
+        key = (self.tilesize, chunk_row, chunk_column)
+        try:
+            self._chunks[key] = entry = self._chunks.pop(key)
+        except KeyError:
+            entry = self._render(chunk_row, chunk_column)
+            self._chunks[key] = entry
+            self.bytes += _surface_bytes(entry[0])
+            while self.bytes > self.max_bytes and len(self._chunks) > 1:
+                surface, animated = self._chunks.popitem(last=False)[1]
+                self.bytes -= _surface_bytes(surface)
+        return entry
+
+    def invalidate(self, row, column):
+        """Forget the chunks holding the tile at (row, column)"""
+        chunk = (row // self.chunk_size, column // self.chunk_size)
+        for key in [key for key in self._chunks if key[1:] == chunk]:
+            self.bytes -= _surface_bytes(self._chunks.pop(key)[0])
+
+    def clear(self):
+        self._chunks.clear()
+        self.bytes = 0
+
+    def set_tilesize(self, tilesize):
+        """Hand out chunks with tiles tilesize pixels wide from now on
+
+        Chunks rendered at other sizes are kept (until they are the least
+        recently used), for zooming back.
+
+        """
+        self.tilesize = tilesize
+
+    def _render(self, chunk_row, chunk_column):
+        import pygame
+        grid = self.level.grid
+        size = self.tilesize
+        first_row = chunk_row * self.chunk_size
+        first_column = chunk_column * self.chunk_size
+        rows = range(first_row, min(first_row + self.chunk_size, grid.rows))
+        columns = range(first_column, min(first_column + self.chunk_size,
+                                          grid.columns))
+        surface = pygame.Surface((len(columns) * size, len(rows) * size))
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        animated = []
+        for row in rows:
+            for column in columns:
+                # Static tiles look the same in every cell, so the shared
+                # flyweight will do
+                tile = grid.type_at(row, column)
+                if is_animated(tile):
+                    animated.append((row, column))
+                else:
+                    surface.blit(self.sprites.get(tile.texture, (size, size)),
+                                 ((column - first_column) * size,
+                                  (row - first_row) * size))
+        return surface, animated
+
+
+def _surface_bytes(surface):
+    return surface.get_bytesize() * surface.get_width() * surface.get_height()
+
+
+def _overlaps(a, b):
+    return (a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and
+            a[1] < b[1] + b[3] and b[1] < a[1] + a[3])
+
+
+def is_animated(tile):
+    """Return whether the tile's texture can change from frame to frame"""
+    return getattr(tile, 'animated', False)
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
@@ -6,7 +6,7 @@ Get a Tile based on its row/column:
 
     >>> from golfram.tile import Tile
     >>> t = Tile()
-    >>> level = Level([[t,t,t]] * 3)
+    >>> level = Level(tiles=[[t,t,t]] * 3)
     >>> row, column = 0, 2
     >>> level.get_tile(row, column) is t
     True
@@ -16,19 +16,40 @@ Level.tile_at_point():
     >>> t1 = Tile()
     >>> t2 = Tile()
     >>> t3 = Tile()
-    >>> l = Level([[t1],[t2],[t3]])
+    >>> l = Level(tiles=[[t1],[t2],[t3]])
     >>> x = m(l.tilesize * 0.5 * px)
     >>> y = m(l.tilesize * 2.5 * px)
     >>> p = Vector(x, y)
     >>> l.tile_at_point(p) is t3
     True
 
+Levels don't need a display. Without a screen nothing touches pygame, so
+they can be simulated on machines with no SDL video driver at all:
+
+    >>> from golfram.ball import GolfBall
+    >>> ball = GolfBall(position=Vector(x, y))
+    >>> ball.velocity = Vector(0, -1)
+    >>> l.add_entity(ball)
+    >>> for i in range(200):
+    ...     l.tick(dt=0.001)
+    >>> l.tile_at_point(ball.position) is t2
+    True
+
 """
-import pygame
+import math
+import os
+import random
 
+from golfram import levelfile
 from golfram.ball import GolfBall
+from golfram.collision import CollisionSystem
+from golfram.events import EventBus
+from golfram.fields import LevelFields
 from golfram.geometry import Rectangle, Vector
-from golfram.units import m, px
+from golfram.graphics import LevelRenderer
+from golfram.tilegrid import TileGrid
+from golfram import units
+from golfram.units import PX_PER_M, m, px
 from golfram.util import get_path, info, warn
 
 class Level(object):
@@ -40,102 +61,405 @@ class Level(object):
     """
     # Actual levels (subclasses) will redefine these:
     ball_class = GolfBall
+    # Whether the edges of the grid are walls. Without them, an entity that
+    # leaves the grid makes tick() raise IndexError.
+    borders = True
+    border_restitution = 1.0
+    collisions = None
+    engine = None
+    # The LevelFields of the level, if it has a goal
+    fields = None
+    grid = None
     tilesize = 64
     tiles = None
     width = None
     height = None
 
-    def __init__(self, screen):
+    def __init__(self, screen=None, tiles=None, grid=None, seed=None):
+        """Create the level
+
+        screen is the pygame Surface the level will be shown on. It is only
+        used to size the view, so it can be left out to simulate the level
+        without a display. Either tiles (a list of rows of tiles) or grid (a
+        TileGrid) may be given to use them directly instead of having
+        set_up() create them.
+
+        Anything random about the level should come from self.random, which
+        is seeded with seed (or a fresh random seed, kept in self.seed), so
+        that the same seed always makes the same level.
+
+        Whichever way the tiles are given, they end up in self.grid, which
+        is what the rest of golfram reads them from.
+
+        """
         # The idea here is to keep track of what things we need to redraw,
-        # instead of redrawing everything every frame. I'm not sure what
-        # to store here, though; the objects themselves is a possibility, or
-        # maybe points or areas that have been soiled (but then we would have
-        # to figure out all the objects that are drawn in those points/areas
-        # which might be impossible).
+        # instead of redrawing everything every frame. This holds the
+        # (row, column) of every tile that has been soiled since the last
+        # draw; the LevelRenderer empties it.
         self._redraw_queue = []
-        # This is a mapping of 'event_name' to a list of functions that should
-        # be called when said event occurs.
-        self._events = {}
+        self._renderer = None
+        # Tile events queued during each tick, and their handlers
+        self.events = EventBus()
         # This is a list of tuples of the level's entities and whether they
         # need to be physicsed.
         self._entities = []
         # This is a rectangle that specifies what part of the level is
-        # currently visible.
-        self._view = Rectangle(width=m(screen.get_width()*px),
-                               height=m(screen.get_height()*px))
+        # currently visible. Headless levels don't have one.
+        if screen is not None:
+            self._view = Rectangle(width=m(screen.get_width()*px),
+                                   height=m(screen.get_height()*px))
+        else:
+            self._view = None
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.random = random.Random(seed)
         # Set up the level
+        if tiles is not None:
+            self.tiles = tiles
+        if grid is not None:
+            self.grid = grid
         self.set_up()
+        if self.grid is None and self.tiles is not None:
+            self.grid = TileGrid.from_rows(self.tiles)
+
+    @classmethod
+    def load_file(cls, filename, screen=None, seed=None, paging=None):
+        """Create a level from a .lvl file
+
+        The level is read through golfram.levelfile, so it is compiled and
+        cached on disk the first time and loaded with mmap after that.
+
+        """
+        compiled = levelfile.load(filename)
+        return cls.from_compiled(compiled, os.path.dirname(filename), screen,
+                                 seed, paging=paging)
+
+    @classmethod
+    def from_compiled(cls, compiled, directory, screen=None, seed=None,
+                      fields=True, paging=None):
+        """Create a level from a levelfile.CompiledLevel
+
+        directory is where the level's files are. If the level has a @goal
+        ("row column"), its LevelFields are worked out, unless fields is
+        False.
+
+        paging, if given, is a dict of arguments for a PagedTileGrid (like
+        region_size and max_bytes), which then holds the level's tiles
+        instead of a TileGrid; see golfram.paging. Paged levels have no
+        LevelFields.
+
+        """
+        if paging is not None:
+            from golfram.paging import PagedTileGrid
+            grid = PagedTileGrid.from_compiled(compiled, directory, **paging)
+            fields = False
+        else:
+            grid = levelfile.make_grid(compiled, directory)
+        level = cls(screen, grid=grid, seed=seed)
+        if paging is not None:
+            grid.on_load = level.tiles_loaded
+        level.meta = compiled.info['meta']
+        if fields and 'goal' in level.meta:
+            level.fields = LevelFields(level, [level.goal()])
+        level.width = compiled.width * level.tilesize
+        level.height = compiled.height * level.tilesize
+        return level
+
+    def goal(self):
+        """Return the (row, column) of the level's @goal, or None"""
+        goal = getattr(self, 'meta', {}).get('goal')
+        if goal is None:
+            return None
+        row, column = (int(n) for n in goal.split())
+        return row, column
 
     def add_entity(self, entity, physics=True):
         self._entities.append((entity, physics))
 
+    @property
+    def renderer(self):
+        """The LevelRenderer that draws this level, created on first use"""
+        if self._renderer is None:
+            self._renderer = LevelRenderer(self)
+        return self._renderer
+
     def draw(self, surface):
-        # Draw all tiles for now. Later, only draw tiles from the _redraw_queue
-        # Or, only draw tiles that are inside the _view rectangle
-        for row, tiles in enumerate(self.tiles):
-            for column, tile in enumerate(tiles):
-                destination = (column * self.tilesize, row * self.tilesize)
-                surface.blit(self.tiles[row][column].texture, destination)
-        # Draw all entities
-        for entity, physics in self._entities:
-            surface.blit(entity.texture, (px(entity.position.x*m),
-                                          px(entity.position.y*m)))
+        """Draw the whole level onto surface"""
+        return self.renderer.draw(surface)
+
+    def draw_dirty(self, surface):
+        """Redraw only what changed since the last draw
+
+        Returns the list of rectangles that were drawn, ready to be passed to
+        pygame.display.update().
+
+        """
+        return self.renderer.draw_dirty(surface)
+
+    def set_engine(self, engine):
+        """Hand the physics stepping over to engine
+
+        engine must have a tick(dt) method; see golfram.physics. Pass None to
+        go back to stepping each entity in tick(). The engine being replaced
+        is detached first, if it has a detach() method.
+
+        """
+        detach = getattr(self.engine, 'detach', None)
+        if detach is not None and engine is not self.engine:
+            detach()
+        self.engine = engine
+
+    def enable_collisions(self, restitution=1.0):
+        """Make the level's entities collide with each other
+
+        Returns the CollisionSystem, to which obstacles can be added. Balls
+        at rest are left where they are until something hits them:
+
+        >>> from golfram.tile import Tile
+        >>> level = Level(tiles=[[Tile()] * 3])
+        >>> resting = GolfBall(position=Vector(0.2, 0.2))
+        >>> level.add_entity(resting)
+        >>> level.add_entity(GolfBall(position=Vector(0.05, 0.2),
+        ...                           velocity=Vector(1, 0)))
+        >>> collisions = level.enable_collisions()
+        >>> level.tick(0.01)
+        >>> resting.position
+        Vector(0.2, 0.2)
+
+        """
+        self.collisions = CollisionSystem(self, restitution)
+        return self.collisions
 
     def get_tile(self, row, column):
         """Return the tile at the given coordinates"""
-        # Don't allow negative indices (which *are* valid for lists)
-        if row < 0 or column < 0:
-            raise IndexError()
-        return self.tiles[row][column]
+        return self.grid.get(row, column)
+
+    def set_tile(self, row, column, tile):
+        """Replace the tile at the given coordinates"""
+        self.grid.set(row, column, tile)
+        self._redraw_queue.append((row, column))
+        if self._renderer is not None:
+            self._renderer.chunks.invalidate(row, column)
+        if self.fields is not None:
+            self.fields.tile_changed(row, column)
+
+    def tiles_loaded(self, rows, columns):
+        """Have the tiles in rows and columns (ranges) redrawn, now that
+        a PagedTileGrid loaded them"""
+        if self._renderer is not None:
+            chunks = self._renderer.chunks
+            size = chunks.chunk_size
+            for chunk_row in range(rows.start // size,
+                                   (rows.stop - 1) // size + 1):
+                for chunk_column in range(columns.start // size,
+                                          (columns.stop - 1) // size + 1):
+                    chunks.invalidate(chunk_row * size, chunk_column * size)
+        self._redraw_queue.extend((row, column) for row in rows
+                                  for column in columns)
 
     def is_complete(self):
-        raise NotImplemented
+        return False
 
     def set_up(self):
-        raise NotImplemented
+        pass
 
     def tick(self, dt):
         if self.is_complete():
             raise LevelComplete
+        if self.engine is not None:
+            self.engine.tick(dt)
+        else:
+            self._step(dt)
+        if self.collisions is not None:
+            self.collisions.resolve()
+        if self.events.queue:
+            self.events.dispatch()
+
+    def _step(self, dt):
         for entity, physics in self._entities:
             if physics:
-                tile = self.tile_at_point(entity.position)
+                cell = self.cell_at_point(entity.position)
+                tile = self.grid.get(cell[0], cell[1], True)
                 # Calculate new velocity
                 a = tile.acceleration_on_object(entity)
-                dv = a * dt
-                entity.velocity += dv
-                # Move the entity
+                entity.velocity.add_scaled(a, dt)
+                # Move the entity, bouncing off anything in the way
                 v = entity.velocity
-                dr = 0.5 * a * dt**2 + v * dt
-                entity.position += dr
-                # If the entity moved onto a new tile, issue the appropriate
+                self.move(entity, 0.5 * a.x * dt**2 + v.x * dt,
+                          0.5 * a.y * dt**2 + v.y * dt)
+                # If the entity moved onto a new tile, queue the appropriate
                 # events, and mark the tiles to be redrawn.
-                self._redraw_queue.append(tile)
-                new_tile = self.tile_at_point(entity.position)
-                if new_tile is not tile:
-                    tile.on_exit(entity)
-                    new_tile.on_enter(entity)
-                    self._redraw_queue.append(new_tile)
+                self._redraw_queue.append(cell)
+                new_cell = self.cell_at_point(entity.position)
+                if new_cell != cell:
+                    new_tile = self.grid.get(new_cell[0], new_cell[1], True)
+                    self.events.crossed(entity, tile, cell, new_tile,
+                                        new_cell)
+                    self._redraw_queue.append(new_cell)
+
+    def is_blocked(self, row, column):
+        """Return whether an entity can't enter the given cell"""
+        grid = self.grid
+        if 0 <= row < grid.rows and 0 <= column < grid.columns:
+            return grid.type_at(row, column, True).solid
+        return self.borders
+
+    def move(self, entity, dx, dy):
+        """Move an entity by (dx, dy) metres, bouncing off walls
+
+        The entity's circle is swept along the whole path, so it can't pass
+        through a solid tile or the level's borders however far it moves in
+        one go. At each wall it hits, the rest of the path and the velocity
+        are reflected. Walls are treated as their rectangles grown by the
+        entity's radius, which slightly rounds off how corners are hit.
+
+        >>> from golfram.tile import Tile, WallTile
+        >>> level = Level(tiles=[[Tile(), Tile(), WallTile()]])
+        >>> ball = GolfBall(position=Vector(0.5, 0.1), velocity=Vector(1, 0))
+        >>> level.move(ball, 0.5, 0)
+        >>> ball.position.x < 0.5, ball.velocity
+        (True, Vector(-1.0, 0.0))
+
+        """
+        position, velocity = entity.position, entity.velocity
+        shape = getattr(entity, 'shape', None)
+        radius = shape.radius if shape is not None else 0.0
+        x, y = position.x, position.y
+        for bounce in range(_MAX_BOUNCES):
+            hit = self._first_hit(x, y, dx, dy, radius)
+            if hit is None:
+                x += dx
+                y += dy
+                break
+            t, nx, ny, restitution = hit
+            x += dx * t
+            y += dy * t
+            dx *= 1 - t
+            dy *= 1 - t
+            # Reflect what is left of the path and the velocity
+            along = dx * nx + dy * ny
+            if along < 0:
+                dx -= (1 + restitution) * along * nx
+                dy -= (1 + restitution) * along * ny
+            along = velocity.x * nx + velocity.y * ny
+            if along < 0:
+                velocity.x -= (1 + restitution) * along * nx
+                velocity.y -= (1 + restitution) * along * ny
+        position.set(x, y)
+
+    def _first_hit(self, x, y, dx, dy, radius):
+        """Find the first wall a circle moving by (dx, dy) runs into
+
+        Returns (fraction of the path travelled, normal x, normal y,
+        restitution), or None if the path is clear.
+
+        """
+        length = self.tilesize / PX_PER_M
+        grid = self.grid
+        best = None
+        # The level's borders
+        if self.borders:
+            right, bottom = grid.columns * length, grid.rows * length
+            for position, delta, low, high, normal in (
+                    (x, dx, radius, right - radius, (1.0, 0.0)),
+                    (y, dy, radius, bottom - radius, (0.0, 1.0))):
+                if delta < 0 and position + delta < low:
+                    t, sign = (low - position) / delta, 1.0
+                elif delta > 0 and position + delta > high:
+                    t, sign = (high - position) / delta, -1.0
+                else:
+                    continue
+                t = max(t, 0.0)
+                if best is None or t < best[0]:
+                    best = (t, normal[0] * sign, normal[1] * sign,
+                            self.border_restitution)
+        # Solid tiles near the path
+        first_column = int(math.floor((min(x, x + dx) - radius) / length))
+        last_column = int(math.floor((max(x, x + dx) + radius) / length))
+        first_row = int(math.floor((min(y, y + dy) - radius) / length))
+        last_row = int(math.floor((max(y, y + dy) + radius) / length))
+        for row in range(max(first_row, 0), min(last_row + 1, grid.rows)):
+            for column in range(max(first_column, 0),
+                                min(last_column + 1, grid.columns)):
+                tile = grid.type_at(row, column, True)
+                if not tile.solid:
+                    continue
+                hit = _sweep_box(x, y, dx, dy,
+                                 column * length - radius,
+                                 row * length - radius,
+                                 (column + 1) * length + radius,
+                                 (row + 1) * length + radius)
+                if hit is not None and (best is None or hit[0] < best[0]):
+                    best = hit + (tile.restitution,)
+        return best
 
     def tiles_to_px(self, tile_units):
         """Return the pixels equivalent of a dimension in tile units"""
         return tile_units * self.tilesize
 
+    def cell_at_point(self, point):
+        """Return the (row, column) of the tile at the given point.
+
+        point is a Vector instance, point.x and point.y are in meters.
+
+        """
+        if units.DEBUG:
+            row = int(px(point.y*m) // self.tilesize)
+            column = int(px(point.x*m) // self.tilesize)
+        else:
+            row = int(point.y * PX_PER_M) // self.tilesize
+            column = int(point.x * PX_PER_M) // self.tilesize
+        return row, column
+
     def tile_at_point(self, point):
         """Return the tile at the given point.
 
         point is a Vector instance, point.x and point.y are in meters.
 
         """
-        row = int(px(point.y*m) // self.tilesize)
-        column = int(px(point.x*m) // self.tilesize)
-        return self.get_tile(row, column)
+        return self.get_tile(*self.cell_at_point(point))
 
 
 class LevelComplete(Exception):
     pass
 
 
+# How many walls an entity may bounce off in a single move
+_MAX_BOUNCES = 8
+
+
+def _sweep_box(x, y, dx, dy, x0, y0, x1, y1):
+    """Return when a point moving by (dx, dy) enters a box, and the normal
+
+    The box is (x0, y0)-(x1, y1). Returns (t, normal x, normal y) with t the
+    fraction of the move, or None if the point doesn't enter the box. A
+    point already inside, or only grazing an edge, doesn't count.
+
+    """
+    t_enter, t_exit = 0.0, 1.0
+    normal = None
+    for position, delta, low, high, axis in ((x, dx, x0, x1, 0),
+                                             (y, dy, y0, y1, 1)):
+        if delta == 0:
+            if not low < position < high:
+                return None
+            continue
+        t0, t1 = (low - position) / delta, (high - position) / delta
+        if t0 > t1:
+            t0, t1 = t1, t0
+        if t0 >= t_enter:
+            t_enter = t0
+            normal = (-1.0 if delta > 0 else 1.0, 0.0) if axis == 0 else \
+                     (0.0, -1.0 if delta > 0 else 1.0)
+        t_exit = min(t_exit, t1)
+        if t_enter >= t_exit:
+            return None
+    if normal is None:
+        return None
+    return (t_enter,) + normal
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
@@ -0,0 +1,391 @@
+"""Reading and compiling level files
+
+A level is described by two text files. The .lvl file holds the grid and
+points to a .tiledefs file describing each kind of tile:
+
+    @width 5
+    @height 5
+    @tiledefs demo.tiledefs
+    @leveldata
+    12223
+    ...
+    @endleveldata
+
+    @texture sprites.png
+    @tilesize 8
+    @tt char=1 friction=0.240 texture=(0,0)
+
+Parsing text is slow compared to reading a few arrays, so each level is
+compiled into a binary file next to its source (demo.lvl -> demo.lvlc)
+holding a grid of tile type indices and a table of tile types. The
+compiled file remembers the modification times and a hash of its sources;
+while they match it is loaded with mmap instead of parsing the text again.
+
+    >>> demo = os.path.join(os.path.dirname(__file__), '..', 'levels',
+    ...                     'demo.lvl')
+    >>> level = load(demo)
+    >>> level.width, level.height
+    (5, 5)
+    >>> level.tile_type(0, 0)['char'], level.tile_type(0, 0)['friction']
+    ('1', 0.24)
+    >>> level.tile_type(1, 1)['texture']
+    (8, 8)
+
+When only the modification times changed (after a checkout, say), the
+hash still matches, and the compiled file is stamped with the new times so
+that the sources aren't hashed on every load:
+
+    >>> import shutil, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> for name in ('demo.lvl', 'demo.tiledefs'):
+    ...     copy = shutil.copy(os.path.join(os.path.dirname(demo), name),
+    ...                        directory)
+    >>> copy = os.path.join(directory, 'demo.lvl')
+    >>> load(copy).close()
+    >>> os.utime(copy, (1000000000, 1000000000))
+    >>> load(copy).close()
+    >>> with open(os.path.join(directory, 'demo.lvlc'), 'rb') as f:
+    ...     _MTIMES.unpack_from(f.read(), _MTIMES_OFFSET)[0]
+    1000000000.0
+    >>> shutil.rmtree(directory)
+
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+from array import array
+
+from golfram import textures
+from golfram.tile import Tile
+from golfram.tilegrid import TileGrid
+from golfram.util import warn
+
+# Magic number and version of the compiled format
+MAGIC = b'GLFC'
+VERSION = 1
+COMPILED_EXTENSION = '.lvlc'
+
+# magic, version, index size, source mtimes, source hash, width, height,
+# number of tile types, length of the JSON info block
+_HEADER = struct.Struct('<4sHBdd20sIIHI')
+# Where in the header the source mtimes are, to update them in place
+_MTIMES = struct.Struct('<dd')
+_MTIMES_OFFSET = struct.calcsize('<4sHB')
+# char (code point), has friction, friction, texture x, texture y
+_TILE_TYPE = struct.Struct('<I?dii')
+
+_DIRECTIVE = re.compile(r'@(\w+)\s*(.*)')
+_TT_FIELD = re.compile(r'(\w+)=(\([^)]*\)|\S+)')
+
+
+class LevelFormatError(Exception):
+    pass
+
+
+class CompiledLevel(object):
+    """A level in compiled form
+
+    grid is a flat, row-major sequence of indices into types, one per tile.
+    Each tile type is a dict with the keys 'char', 'friction' (None if the
+    tiledefs don't set one) and 'texture' (the (x, y) of the tile in the
+    texture atlas, or None). info holds the remaining settings: 'texture'
+    and 'tilesize' of the atlas, and the .lvl directives under 'meta'.
+
+    """
+    def __init__(self, width, height, types, grid, info, buffer=None):
+        self.width = width
+        self.height = height
+        self.types = types
+        self.grid = grid
+        self.info = info
+        # Keeps the mmap alive for as long as grid is a view onto it
+        self._buffer = buffer
+
+    def tile_type(self, row, column):
+        return self.types[self.grid[row * self.width + column]]
+
+    def close(self):
+        if self._buffer is not None:
+            self.grid.release()
+            self._buffer.close()
+            self._buffer = None
+
+
+class AtlasTile(Tile):
+    """A tile type whose texture is a square of a texture atlas
+
+    The atlas is only loaded when the texture is first asked for, and is
+    shared with every other tile and level using it through golfram.textures.
+
+    """
+    def __init__(self, char, atlas=None, position=None, size=None,
+                 friction=None):
+        self.char = char
+        self.atlas = atlas
+        self.position = position
+        self.size = size
+        if friction is not None:
+            self.friction = friction
+
+    @property
+    def texture(self):
+        if self.position is None:
+            return None
+        return textures.get(self.atlas, self.position + (self.size, self.size))
+
+
+def make_grid(level, directory):
+    """Return a TileGrid for a CompiledLevel
+
+    There is one AtlasTile per tile type, shared by every cell of that type,
+    and the grid reads its indices straight from the compiled level (so from
+    the mmap when there is one). directory is where the level's tiledefs
+    (and so its atlas) live.
+
+    """
+    types = make_types(level, directory)
+    grid = level.grid
+    if not isinstance(grid, (array, memoryview)):
+        grid = array('B' if len(types) <= 0x100 else 'H', grid)
+    return TileGrid(types, grid, level.height, level.width)
+
+
+def make_types(level, directory):
+    """Return an AtlasTile for each tile type of a CompiledLevel"""
+    info = level.info
+    atlas = info['texture'] and os.path.normpath(os.path.join(directory,
+                                                               info['texture']))
+    return [AtlasTile(t['char'], atlas, t['texture'], info['tilesize'],
+                      t['friction']) for t in level.types]
+
+
+def load(filename):
+    """Return the CompiledLevel for a .lvl file
+
+    The compiled file next to it is used if it is up to date; otherwise the
+    level is parsed and the compiled file is (re)written.
+
+    """
+    compiled_filename = os.path.splitext(filename)[0] + COMPILED_EXTENSION
+    try:
+        level = _read_compiled(compiled_filename, filename)
+    except (IOError, OSError, ValueError, LevelFormatError, struct.error):
+        level = None
+    if level is not None:
+        return level
+    level, sources = parse(filename)
+    try:
+        write_compiled(compiled_filename, level, sources)
+    except (IOError, OSError) as e:
+        warn("can't write compiled level: {}".format(e), file=filename)
+    return level
+
+
+def parse(filename):
+    """Parse a .lvl file and its tiledefs
+
+    Returns the CompiledLevel and a list of the source filenames.
+
+    """
+    with open(filename) as f:
+        meta, rows = _parse_level(f, filename)
+    try:
+        tiledefs = meta.pop('tiledefs')
+    except KeyError:
+        raise LevelFormatError("[{}] no @tiledefs given".format(filename))
+    tiledefs = os.path.join(os.path.dirname(filename), tiledefs)
+    with open(tiledefs) as f:
+        info, types = _parse_tiledefs(f, tiledefs)
+    info['tiledefs'] = os.path.basename(tiledefs)
+    info['meta'] = meta
+    indices = dict((tile_type['char'], i) for i, tile_type in enumerate(types))
+    width = int(meta.get('width', len(rows[0]) if rows else 0))
+    height = int(meta.get('height', len(rows)))
+    if len(rows) != height or any(len(row) != width for row in rows):
+        raise LevelFormatError("[{}] @leveldata isn't {}x{} tiles".format(
+                               filename, width, height))
+    try:
+        grid = [indices[char] for row in rows for char in row]
+    except KeyError as e:
+        raise LevelFormatError("[{}] no tile type for {}".format(filename, e))
+    level = CompiledLevel(width, height, types, grid, info)
+    return level, [filename, tiledefs]
+
+
+def write_compiled(filename, level, sources):
+    """Write level in compiled form, stamped with its sources"""
+    index_size = 1 if len(level.types) <= 0x100 else 2
+    info = json.dumps(level.info, sort_keys=True).encode('utf-8')
+    mtimes = [os.path.getmtime(source) for source in sources]
+    header = _HEADER.pack(MAGIC, VERSION, index_size, mtimes[0], mtimes[1],
+                          _hash_sources(sources), level.width, level.height,
+                          len(level.types), len(info))
+    grid = bytearray(level.width * level.height * index_size)
+    struct.pack_into('<{}{}'.format(len(level.grid), 'BH'[index_size - 1]),
+                     grid, 0, *level.grid)
+    # Write to a temporary file first so readers never see half a file
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(header)
+        f.write(info)
+        for tile_type in level.types:
+            texture = tile_type['texture'] or (-1, -1)
+            friction = tile_type['friction']
+            f.write(_TILE_TYPE.pack(ord(tile_type['char']),
+                                    friction is not None, friction or 0.0,
+                                    texture[0], texture[1]))
+        f.write(grid)
+    os.replace(temporary, filename)
+
+
+def _read_compiled(filename, source):
+    with open(filename, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) < _HEADER.size:
+        buffer.close()
+        raise LevelFormatError("[{}] compiled level is truncated".format(
+                               filename))
+    (magic, version, index_size, level_mtime, tiledefs_mtime, digest, width,
+     height, type_count, info_length) = _HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION or index_size not in (1, 2):
+        buffer.close()
+        raise LevelFormatError("[{}] not a compiled level".format(filename))
+    offset = _HEADER.size
+    if len(buffer) < (offset + info_length + type_count * _TILE_TYPE.size +
+                      width * height * index_size):
+        buffer.close()
+        raise LevelFormatError("[{}] compiled level is truncated".format(
+                               filename))
+    try:
+        info = json.loads(buffer[offset:offset + info_length].decode('utf-8'))
+    except ValueError:
+        buffer.close()
+        raise LevelFormatError("[{}] bad info in compiled level".format(
+                               filename))
+    offset += info_length
+    # Make sure the sources haven't changed. Comparing modification times
+    # is enough most of the time; if they differ the contents may still be
+    # the same (e.g. after a checkout), so fall back to the hash.
+    sources = [source, os.path.join(os.path.dirname(source),
+                                    info['tiledefs'])]
+    mtimes = [os.path.getmtime(name) for name in sources]
+    if mtimes != [level_mtime, tiledefs_mtime]:
+        if _hash_sources(sources) != digest:
+            buffer.close()
+            return None
+        _restamp(filename, mtimes)
+    types = []
+    for i in range(type_count):
+        char, has_friction, friction, x, y = _TILE_TYPE.unpack_from(buffer,
+                                                                    offset)
+        offset += _TILE_TYPE.size
+        types.append({'char': chr(char),
+                      'friction': friction if has_friction else None,
+                      'texture': (x, y) if x >= 0 else None})
+    grid = memoryview(buffer)[offset:offset + width * height * index_size]
+    if index_size == 2:
+        grid = grid.cast('H')
+    return CompiledLevel(width, height, types, grid, info, buffer)
+
+
+def _restamp(filename, mtimes):
+    """Update the source mtimes in a compiled file's header"""
+    try:
+        with open(filename, 'r+b') as f:
+            f.seek(_MTIMES_OFFSET)
+            f.write(_MTIMES.pack(*mtimes))
+    except (IOError, OSError) as e:
+        warn("can't update compiled level: {}".format(e), file=filename)
+
+
+def _hash_sources(sources):
+    digest = hashlib.sha1()
+    for source in sources:
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+def _parse_level(lines, filename):
+    meta = {}
+    rows = None
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if rows is not None:
+            if line == '@endleveldata':
+                return meta, rows
+            rows.append(line)
+            continue
+        if not line:
+            continue
+        match = _DIRECTIVE.match(line)
+        if not match:
+            raise LevelFormatError("[{}:{}] expected a directive".format(
+                                   filename, number))
+        name, value = match.groups()
+        if name == 'leveldata':
+            rows = []
+        elif name in meta:
+            warn("ignoring duplicate declaration", file=filename, line=number)
+        else:
+            meta[name] = value.strip()
+    raise LevelFormatError("[{}] @leveldata isn't closed".format(filename))
+
+
+def _parse_tiledefs(lines, filename):
+    info = {'texture': None, 'tilesize': None}
+    types = []
+    chars = set()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        match = _DIRECTIVE.match(line)
+        if not match:
+            raise LevelFormatError("[{}:{}] expected a directive".format(
+                                   filename, number))
+        name, value = match.groups()
+        if name == 'texture':
+            info['texture'] = value.strip()
+        elif name == 'tilesize':
+            info['tilesize'] = int(value)
+        elif name == 'tt':
+            fields = dict(_TT_FIELD.findall(value))
+            tile_type = _tile_type(fields, filename, number)
+            if tile_type['char'] in chars:
+                warn("ignoring duplicate declaration", file=filename,
+                     line=number)
+                continue
+            chars.add(tile_type['char'])
+            types.append(tile_type)
+        else:
+            warn("ignoring unknown directive @{}".format(name), file=filename,
+                 line=number)
+    return info, types
+
+
+def _tile_type(fields, filename, number):
+    try:
+        char = fields['char']
+        friction = fields.get('friction')
+        if friction is not None:
+            friction = float(friction)
+        texture = fields.get('texture')
+        if texture is not None:
+            x, y = texture.strip('()').split(',')
+            texture = (int(x), int(y))
+    except (KeyError, ValueError):
+        raise LevelFormatError("[{}:{}] bad tile type".format(filename,
+                                                              number))
+    if len(char) != 1:
+        raise LevelFormatError("[{}:{}] char must be a single character"
+                               .format(filename, number))
+    return {'char': char, 'friction': friction, 'texture': texture}
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,340 @@
+"""Levels too big to keep in memory
+
+A PagedTileGrid stands in for a TileGrid, but only holds the regions of the
+grid (squares of region_size x region_size tiles) that are in use. Regions
+are loaded on a background thread, and the least recently used ones are
+dropped once they take up more than max_bytes. Asking for a tile whose
+region isn't loaded yet doesn't wait, unless asked to: it queues the region
+and returns the placeholder tile meanwhile.
+
+    >>> from array import array
+    >>> from golfram.tile import Tile
+    >>> grass, sand = Tile(), Tile()
+    >>> def load_region(rows, columns):
+    ...     return array('B', [(row + column) % 2 for row in rows
+    ...                        for column in columns])
+    >>> grid = PagedTileGrid([grass, sand], load_region, 1000, 1000,
+    ...                      region_size=32)
+    >>> grid.get(500, 501) is grid.placeholder
+    True
+    >>> grid.wait()
+    >>> grid.get(500, 501) is sand, len(grid.regions)
+    (True, 1)
+    >>> grid.get(900, 900, wait=True) is grass, len(grid.regions)
+    (True, 2)
+    >>> grid.close()
+
+load_region(rows, columns) returns the type indices of the tiles in the
+rows and columns (ranges) of one region, row by row; it is called on the
+prefetch thread. prefetch() queues the regions around the tiles about to be
+needed, so that they are usually there in time. Game does this for the
+tiles in view and under each entity.
+
+Placeholders are only for drawing. Level's physics looks tiles up with
+wait set, loading missing regions there and then, so that entities never
+roll over a placeholder and every run of a level is the same however fast
+the regions arrive. Setting blocking makes every lookup wait like that.
+
+    >>> from golfram.ball import GolfBall
+    >>> from golfram.game import Game
+    >>> from golfram.geometry import Vector
+    >>> from golfram.level import Level
+    >>> from golfram.tile import WallTile
+    >>> def load_walls(rows, columns):
+    ...     return array('B', [column == 3 for row in rows
+    ...                        for column in columns])
+    >>> grid = PagedTileGrid([grass, WallTile()], load_walls, 4, 8,
+    ...                      region_size=2)
+    >>> level = Level(grid=grid)
+    >>> level.add_entity(GolfBall(position=Vector(0.5, 0.5),
+    ...                           velocity=Vector(2, 0)))
+    >>> game = Game((640, 480), level)
+    >>> for i in range(40):
+    ...     game.tick(0.01)
+    >>> ball = level._entities[0][0]
+    >>> ball.velocity.x < 0, level._renderer is None
+    (True, True)
+    >>> grid.close()
+
+The grid can't hand out a flat indices buffer, so LevelFields and
+BatchPhysics, which need one, don't work on a PagedTileGrid.
+
+"""
+import copy
+import queue
+import threading
+from array import array
+from collections import OrderedDict
+
+from golfram.tile import Tile
+
+
+class PlaceholderTile(Tile):
+    """A plain tile drawn flat grey, standing in for tiles not loaded yet"""
+
+    color = (96, 96, 96)
+    _texture = None
+
+    @property
+    def texture(self):
+        if PlaceholderTile._texture is None:
+            import pygame
+            texture = pygame.Surface((8, 8))
+            texture.fill(self.color)
+            PlaceholderTile._texture = texture
+        return PlaceholderTile._texture
+
+
+class PagedTileGrid(object):
+    """A rows x columns grid of tiles, loaded a region at a time
+
+    types is the list of flyweight tiles, as for a TileGrid. on_load, if
+    set, is called with the rows and columns (ranges) of each region as it
+    arrives (Level.from_compiled() sets it to Level.tiles_loaded(), which
+    has the region redrawn).
+
+    """
+    def __init__(self, types, load_region, rows, columns, region_size=64,
+                 max_bytes=16 * 1024 * 1024, placeholder=None,
+                 blocking=False):
+        self.types = list(types)
+        self.load_region = load_region
+        self.rows = rows
+        self.columns = columns
+        self.region_size = region_size
+        self.max_bytes = max_bytes
+        self.placeholder = (placeholder if placeholder is not None
+                            else PlaceholderTile())
+        self.blocking = blocking
+        self.on_load = None
+        self.bytes = 0
+        self._type_indices = dict((id(tile), i)
+                                  for i, tile in enumerate(self.types))
+        # (region row, region column) -> indices, least recently used first
+        self.regions = OrderedDict()
+        # Regions that were changed with set(), which are never dropped
+        self._edited = set()
+        # Regions queued for loading, and those the last prefetch() wanted
+        self._requested = set()
+        self._wanted = set()
+        # (row, column) -> the cell's own copy of a stateful flyweight
+        self._cell_tiles = {}
+        self._requests = queue.Queue()
+        self._loaded = queue.Queue()
+        self._thread = None
+
+    @classmethod
+    def from_compiled(cls, compiled, directory, **kwargs):
+        """Make a grid paging in a levelfile.CompiledLevel's tiles"""
+        from golfram import levelfile
+        grid, width = compiled.grid, compiled.width
+        typecode = 'B' if len(compiled.types) <= 0x100 else 'H'
+
+        def load_region(rows, columns):
+            indices = array(typecode)
+            for row in rows:
+                start = row * width
+                indices.extend(grid[start + columns.start:
+                                    start + columns.stop])
+            return indices
+        return cls(levelfile.make_types(compiled, directory), load_region,
+                   compiled.height, compiled.width, **kwargs)
+
+    def __len__(self):
+        return self.rows
+
+    def get(self, row, column, wait=False):
+        """Return the tile at (row, column), or the placeholder if its
+        region isn't loaded
+
+        With wait set (or blocking), a missing region is loaded on the spot
+        instead. Raises IndexError outside the grid, including for negative
+        indices.
+
+        """
+        tile = self.type_at(row, column, wait)
+        if tile.stateful and tile is not self.placeholder:
+            cell_tile = self._cell_tiles.get((row, column))
+            if cell_tile is None:
+                cell_tile = self._cell_tiles[(row, column)] = copy.copy(tile)
+            return cell_tile
+        return tile
+
+    def type_at(self, row, column, wait=False):
+        """Return the flyweight of the tile at (row, column), or the
+        placeholder unless wait is set"""
+        if not (0 <= row < self.rows and 0 <= column < self.columns):
+            raise IndexError("no tile at ({}, {})".format(row, column))
+        size = self.region_size
+        region_column, column = divmod(column, size)
+        key = (row // size, region_column)
+        indices = self.regions.get(key)
+        if indices is None:
+            indices = self._miss(key, wait)
+            if indices is None:
+                return self.placeholder
+        else:
+            self.regions.move_to_end(key)
+        width = min(size, self.columns - region_column * size)
+        return self.types[indices[row % size * width + column]]
+
+    def set(self, row, column, tile):
+        """Put tile at (row, column), loading its region first if need be"""
+        if not (0 <= row < self.rows and 0 <= column < self.columns):
+            raise IndexError("no tile at ({}, {})".format(row, column))
+        size = self.region_size
+        key = (row // size, column // size)
+        if key not in self.regions:
+            self._install(key, self._load(key))
+        i = self._type_indices.get(id(tile))
+        if i is None:
+            i = self._type_indices[id(tile)] = len(self.types)
+            self.types.append(tile)
+        indices = self.regions[key]
+        typecode = 'B' if len(self.types) <= 0x100 else 'H'
+        if getattr(indices, 'typecode', None) != typecode:
+            self.bytes -= _bytes(indices)
+            indices = self.regions[key] = array(typecode, indices)
+            self.bytes += _bytes(indices)
+        indices[row % size * self._width(key[1]) + column % size] = i
+        self._edited.add(key)
+        self._cell_tiles.pop((row, column), None)
+
+    def prefetch(self, areas, margin=1):
+        """Queue the regions overlapping each area, and margin regions
+        around them, for loading
+
+        Each area is a (rows, columns) pair of ranges of tiles. The regions
+        wanted by the last prefetch() aren't dropped to make room for
+        others, so max_bytes should leave room for them.
+
+        """
+        size = self.region_size
+        last_row = (self.rows - 1) // size
+        last_column = (self.columns - 1) // size
+        wanted = set()
+        for rows, columns in areas:
+            for region_row in range(max(rows.start // size - margin, 0),
+                                    min((rows.stop - 1) // size + margin,
+                                        last_row) + 1):
+                for region_column in range(
+                        max(columns.start // size - margin, 0),
+                        min((columns.stop - 1) // size + margin,
+                            last_column) + 1):
+                    wanted.add((region_row, region_column))
+        self._wanted = wanted
+        self.update()
+        for key in wanted:
+            if key not in self.regions:
+                self._request(key)
+
+    def update(self):
+        """Put the regions that finished loading in place"""
+        while True:
+            try:
+                key, indices = self._loaded.get_nowait()
+            except queue.Empty:
+                return
+            self._requested.discard(key)
+            if isinstance(indices, Exception):
+                raise indices
+            if key not in self.regions:
+                self._install(key, indices)
+
+    def wait(self):
+        """Wait until every queued region is loaded, and put them in place"""
+        while self._requested:
+            key, indices = self._loaded.get()
+            self._loaded.put((key, indices))
+            self.update()
+
+    def close(self):
+        """Stop the prefetch thread"""
+        if self._thread is not None:
+            self._requests.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def memory_usage(self):
+        """Return the approximate bytes used by the loaded regions"""
+        return self.bytes
+
+    def _miss(self, key, wait):
+        self.update()
+        indices = self.regions.get(key)
+        if indices is None:
+            if wait or self.blocking:
+                indices = self._load(key)
+                self._install(key, indices)
+            else:
+                self._request(key)
+        return indices
+
+    def _request(self, key):
+        if key in self._requested:
+            return
+        self._requested.add(key)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work,
+                                            name='golfram-prefetch')
+            self._thread.daemon = True
+            self._thread.start()
+        self._requests.put(key)
+
+    def _work(self):
+        while True:
+            key = self._requests.get()
+            if key is None:
+                return
+            try:
+                indices = self._load(key)
+            except Exception as e:
+                indices = e
+            self._loaded.put((key, indices))
+
+    def _load(self, key):
+        rows, columns = self._ranges(key)
+        indices = self.load_region(rows, columns)
+        if len(indices) != len(rows) * len(columns):
+            raise ValueError("region {} should have {} tiles, got {}".format(
+                                 key, len(rows) * len(columns),
+                                 len(indices)))
+        return indices
+
+    def _install(self, key, indices):
+        self.regions[key] = indices
+        self.bytes += _bytes(indices)
+        regions = self.regions
+        for old in list(regions):
+            if self.bytes <= self.max_bytes:
+                break
+            if old == key or old in self._edited or old in self._wanted:
+                continue
+            self.bytes -= _bytes(regions.pop(old))
+            self._forget_cell_tiles(old)
+        if self.on_load is not None:
+            self.on_load(*self._ranges(key))
+
+    def _forget_cell_tiles(self, key):
+        rows, columns = self._ranges(key)
+        for cell in [cell for cell in self._cell_tiles
+                     if cell[0] in rows and cell[1] in columns]:
+            del self._cell_tiles[cell]
+
+    def _ranges(self, key):
+        size = self.region_size
+        return (range(key[0] * size, min((key[0] + 1) * size, self.rows)),
+                range(key[1] * size, min((key[1] + 1) * size, self.columns)))
+
+    def _width(self, region_column):
+        size = self.region_size
+        return min(size, self.columns - region_column * size)
+
+
+def _bytes(indices):
+    return getattr(indices, 'itemsize', 1) * len(indices)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
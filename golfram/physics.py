@@ -0,0 +1,522 @@
+"""Alternative physics engines for Level
+
+Level.tick() steps each entity on its own, one tile lookup and a handful
+of Vector operations at a time. The engines in this module can be attached
+to a level with Level.set_engine() to take over the stepping.
+
+BatchPhysics keeps the positions and velocities of all physics entities in
+NumPy arrays and integrates them all at once. It needs NumPy.
+
+AnalyticIntegrator solves the motion across each tile in closed form and
+jumps from one tile crossing to the next.
+
+    >>> from golfram.ball import GolfBall
+    >>> from golfram.geometry import Vector
+    >>> from golfram.level import Level
+    >>> from golfram.tile import BoostTile, Tile
+    >>> class Boost(BoostTile):
+    ...     boost_velocity = Vector(-2, 0)
+    >>> def make_level():
+    ...     boost = Boost()
+    ...     level = Level(tiles=[[Tile(), boost, Tile()] for row in range(3)])
+    ...     for y in (0.05, 0.2, 0.4):
+    ...         ball = GolfBall(position=Vector(0.1, y))
+    ...         ball.velocity = Vector(1.5, 0.3)
+    ...         level.add_entity(ball)
+    ...     return level
+    >>> scalar, batch = make_level(), make_level()
+    >>> batch.set_engine(BatchPhysics(batch))
+    >>> for i in range(60):
+    ...     scalar.tick(dt=0.005)
+    ...     batch.tick(dt=0.005)
+    >>> for (a, _), (b, _) in zip(scalar._entities, batch._entities):
+    ...     assert abs(a.position.x - b.position.x) < 1e-9
+    ...     assert abs(a.velocity.y - b.velocity.y) < 1e-9
+
+"""
+import math
+import time
+
+from golfram.geometry import VectorArray
+from golfram.tile import BoostTile, Tile
+from golfram.units import PX_PER_M
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+# Imported by the first BatchPhysics: NumPy takes longer to import than the
+# rest of golfram put together, and headless tools may never need it
+numpy = None
+
+def _import_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("BatchPhysics requires numpy")
+
+
+class BatchPhysics(object):
+    """Integrate every physics entity of a level in one vectorized step
+
+    The friction and boost velocity planes of the level's TileGrid are
+    flattened, so the tile under every entity can be looked up with a
+    single fancy index. Tiles whose class overrides
+    acceleration_on_object() with something other than the Tile or
+    BoostTile behaviour are handed back to the tile one entity at a time,
+    so custom tiles keep working.
+
+    The positions and velocities stay in VectorArrays from tick to tick.
+    Each entity's position and velocity are swapped for views of its place
+    in them, so nothing is copied between the entities and the arrays, and
+    whatever else moves the entities (collisions, shots) moves them in the
+    arrays too. Change the entities' vectors in place (set(), +=) rather
+    than assigning new ones. Entities added to or removed from the level
+    are picked up at the next tick; detach() gives the entities their own
+    vectors back, and Level.set_engine() calls it.
+
+        >>> from golfram.ball import GolfBall
+        >>> from golfram.geometry import Vector
+        >>> from golfram.level import Level
+        >>> level = Level(tiles=[[Tile()] * 4])
+        >>> ball = GolfBall(position=Vector(0.1, 0.1))
+        >>> position = ball.position
+        >>> level.add_entity(ball)
+        >>> level.set_engine(BatchPhysics(level))
+        >>> ball.velocity += Vector(1, 0)
+        >>> level.tick(0.1)
+        >>> level.engine.positions.tolist() == [[ball.position.x, 0.1]]
+        True
+        >>> level.set_engine(None)
+        >>> ball.position is position, position.x > 0.1
+        (True, True)
+
+    Call refresh() after changing the level's tiles.
+
+    """
+    def __init__(self, level):
+        _import_numpy()
+        self.level = level
+        self._positions = VectorArray()
+        self._velocities = VectorArray()
+        # The entities being simulated, and the vectors they came with
+        self.entities = []
+        self._own_vectors = []
+        self._entity_count = None
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild the tile planes and entity arrays from the level"""
+        level = self.level
+        grid = self.grid = level.grid
+        self.rows, self.columns = grid.rows, grid.columns
+        self.tilesize = level.tilesize
+        is_boost = numpy.zeros(len(grid.types), dtype=bool)
+        is_custom = numpy.zeros(len(grid.types), dtype=bool)
+        for i, tile in enumerate(grid.types):
+            method = type(tile).acceleration_on_object
+            if method is BoostTile.acceleration_on_object:
+                is_boost[i] = True
+            elif method is not Tile.acceleration_on_object:
+                is_custom[i] = True
+        # Everything per cell, indexed by row * columns + column
+        types = grid.index_plane().ravel()
+        self.friction = grid.friction_plane().ravel()
+        self.boost = grid.boost_plane().reshape(-1, 2)
+        self.is_boost = is_boost[types]
+        self.is_custom = is_custom[types]
+        self.solid = grid.type_table('solid')[types].astype(bool)
+        # Unit vector along each boost, used for the velocity projection
+        norms = numpy.hypot(self.boost[:, 0], self.boost[:, 1])
+        norms[norms == 0] = 1.0
+        self.boost_direction = self.boost / norms[:, None]
+        self.sync()
+
+    def tile(self, index):
+        """Return the tile at a flat cell index"""
+        return self.grid.get(*divmod(int(index), self.columns))
+
+    def sync(self):
+        """Pick up the physics entities added to or removed from the level
+
+        tick() calls this when the number of the level's entities changes.
+
+        """
+        entities = [entity for entity, physics in self.level._entities
+                    if physics]
+        self._entity_count = len(self.level._entities)
+        if entities == self.entities:
+            return
+        # The arrays can't be resized while NumPy shares their memory
+        self.positions = self.velocities = None
+        wanted = set(map(id, entities))
+        for i in reversed(range(len(self.entities))):
+            if id(self.entities[i]) not in wanted:
+                self._release(i)
+        present = set(map(id, self.entities))
+        for entity in entities:
+            if id(entity) not in present:
+                self._bind(entity)
+        self.positions = self._positions.as_numpy()
+        self.velocities = self._velocities.as_numpy()
+        self.radii = numpy.array([getattr(getattr(entity, 'shape', None),
+                                          'radius', 0.0)
+                                  for entity in self.entities])
+
+    def detach(self):
+        """Give every entity its own position and velocity vectors back"""
+        self.positions = self.velocities = None
+        for i in reversed(range(len(self.entities))):
+            self._release(i)
+        self._entity_count = None
+
+    def _bind(self, entity):
+        i = len(self.entities)
+        self._positions.append(entity.position)
+        self._velocities.append(entity.velocity)
+        self._own_vectors.append((entity.position, entity.velocity))
+        entity.position = self._positions.view(i)
+        entity.velocity = self._velocities.view(i)
+        self.entities.append(entity)
+
+    def _release(self, i):
+        entity = self.entities.pop(i)
+        position, velocity = self._own_vectors.pop(i)
+        position.set(*self._positions.pop(i))
+        velocity.set(*self._velocities.pop(i))
+        entity.position, entity.velocity = position, velocity
+
+    def tile_indices(self, positions):
+        """Return the flat tile index under each position
+
+        Mirrors Level.tile_at_point(), including the truncation to whole
+        pixels, and raises IndexError if any position is off the grid.
+
+        """
+        pixels = numpy.trunc(positions * PX_PER_M)
+        cells = numpy.floor_divide(pixels, self.tilesize).astype(numpy.intp)
+        rows, columns = cells[:, 1], cells[:, 0]
+        if len(cells) and (rows.min() < 0 or columns.min() < 0 or
+                           rows.max() >= self.rows or
+                           columns.max() >= self.columns):
+            raise IndexError()
+        return rows * self.columns + columns
+
+    def step(self, dt):
+        """Advance every entity by dt seconds"""
+        if not self.entities:
+            return
+        p, v = self.positions, self.velocities
+        before = self.tile_indices(p)
+        # Friction opposes the current direction of motion
+        speed = numpy.hypot(v[:, 0], v[:, 1])
+        moving = speed > 0
+        direction = numpy.zeros_like(v)
+        direction[moving] = v[moving] / speed[moving, None]
+        a = -self.friction[before, None] * direction
+        # Boost tiles nudge the velocity toward their boost_velocity. This is
+        # applied after the friction is worked out, as BoostTile does.
+        boosted = self.is_boost[before]
+        if boosted.any():
+            b = self.boost[before[boosted]]
+            bn = self.boost_direction[before[boosted]]
+            vb = v[boosted]
+            projection = (vb * bn).sum(axis=1)[:, None] * bn
+            v[boosted] = vb + (b - projection) / 60
+            for i in numpy.flatnonzero(boosted):
+                self.tile(before[i]).active += 1
+        custom = self.is_custom[before]
+        if custom.any():
+            for i in numpy.flatnonzero(custom):
+                a[i] = self._custom_acceleration(i, self.tile(before[i]))
+        # Integrate
+        v += a * dt
+        self._move(0.5 * a * dt**2 + v * dt)
+        # Queue the tile events for entities which changed tiles
+        after = self.tile_indices(p)
+        redraw = self.level._redraw_queue
+        rows, columns = divmod(before, self.columns)
+        redraw.extend(zip(rows.tolist(), columns.tolist()))
+        for i in numpy.flatnonzero(before != after):
+            tile, new_tile = self.tile(before[i]), self.tile(after[i])
+            cell = divmod(int(after[i]), self.columns)
+            self.level.events.crossed(self.entities[i], tile,
+                                      divmod(int(before[i]), self.columns),
+                                      new_tile, cell)
+            redraw.append(cell)
+
+    def _move(self, displacement):
+        """Move every entity, letting the level sweep any that may hit a wall
+
+        An entity whose swept bounding box stays within a 2x2 block of open
+        cells can't hit anything and is moved directly. The rest (the few
+        near walls or borders, or moving more than a tile at once) go
+        through Level.move().
+
+        """
+        p, v = self.positions, self.velocities
+        level = self.level
+        length = self.tilesize / PX_PER_M
+        target = p + displacement
+        reach = self.radii[:, None]
+        low = numpy.floor((numpy.minimum(p, target) - reach) / length)
+        high = numpy.floor((numpy.maximum(p, target) + reach) / length)
+        low, high = low.astype(numpy.intp), high.astype(numpy.intp)
+        check = (high - low > 1).any(axis=1)
+        outside = ((low < 0).any(axis=1) | (high[:, 0] >= self.columns) |
+                   (high[:, 1] >= self.rows))
+        if level.borders:
+            check |= outside
+        if self.solid.any():
+            rows = numpy.clip(low[:, 1], 0, self.rows - 1), \
+                   numpy.clip(high[:, 1], 0, self.rows - 1)
+            columns = numpy.clip(low[:, 0], 0, self.columns - 1), \
+                      numpy.clip(high[:, 0], 0, self.columns - 1)
+            for row in rows:
+                for column in columns:
+                    check |= self.solid[row * self.columns + column]
+        clear = ~check
+        p[clear] = target[clear]
+        # The entities' vectors are views of p and v, so Level.move()
+        # updates them too
+        for i in numpy.flatnonzero(check):
+            level.move(self.entities[i], *displacement[i].tolist())
+
+    def _custom_acceleration(self, i, tile):
+        # The tile may change the velocity directly, which lands in the
+        # arrays too
+        a = tile.acceleration_on_object(self.entities[i])
+        return (a.x, a.y)
+
+    def tick(self, dt):
+        """Advance the level's entities by dt seconds
+
+        Level.tick() calls this when the engine is attached.
+
+        """
+        if len(self.level._entities) != self._entity_count:
+            self.sync()
+        self.step(dt)
+
+
+class AnalyticIntegrator(object):
+    """Move entities from event to event instead of in fixed steps
+
+    On an ordinary tile (one that uses Tile.acceleration_on_object()) an
+    entity decelerates at a constant rate along a straight line, so where it
+    will be at any time has a closed form. Rather than stepping, the
+    integrator works out when the entity next crosses a tile edge or comes
+    to rest and jumps straight there, queueing the tile events of each
+    crossing. Simulating a whole shot costs one step per tile crossed
+    instead of one per substep:
+
+    >>> from golfram.ball import GolfBall
+    >>> from golfram.geometry import Vector
+    >>> from golfram.level import Level
+    >>> from golfram.tile import Tile
+    >>> level = Level(tiles=[[Tile() for column in range(8)]])
+    >>> ball = GolfBall(position=Vector(0.1, 0.1))
+    >>> ball.velocity = Vector(1, 0)
+    >>> level.add_entity(ball)
+    >>> integrator = AnalyticIntegrator(level)
+    >>> integrator.run_until_rest()
+    2.5
+    >>> round(ball.position.x, 9), ball.velocity
+    (1.35, Vector(0.0, 0.0))
+
+    Tiles with any other acceleration (BoostTile, for one) have no closed
+    form, so entities on them are stepped numerically every fallback_dt
+    seconds until they leave the tile, exactly as Level.tick() would.
+
+    """
+    def __init__(self, level, fallback_dt=1 / 600.0):
+        self.level = level
+        self.fallback_dt = fallback_dt
+        self.tile_length = level.tilesize / PX_PER_M
+        # entity -> (x, y, row, column) as the integrator last left it, so
+        # that an entity sitting exactly on a tile edge keeps the tile it
+        # was moved onto.
+        self._cells = {}
+
+    def tick(self, dt):
+        """Advance every physics entity by dt seconds"""
+        for entity, physics in self.level._entities:
+            if physics:
+                self.advance(entity, dt)
+
+    def run_until_rest(self, max_time=60.0, deadline=None):
+        """Advance every entity until they have all stopped
+
+        Returns how long that took, or max_time if something is still moving
+        (or being pushed around by a boost) by then. deadline, if given, is
+        a time.perf_counter() reading to give up at, however far the
+        entities got; None is returned then.
+
+        """
+        elapsed = 0.0
+        for entity, physics in self.level._entities:
+            if physics:
+                remaining = self.advance(entity, max_time, deadline)
+                if remaining is None:
+                    elapsed = None
+                    break
+                elapsed = max(elapsed, max_time - remaining)
+        if self.level.events.queue:
+            self.level.events.dispatch()
+        return elapsed
+
+    def advance(self, entity, dt, deadline=None):
+        """Advance one entity by up to dt seconds
+
+        Returns the time left over if the entity came to rest on an ordinary
+        tile before dt was up, and 0 otherwise; or None if the clock passed
+        deadline (see run_until_rest()) first.
+
+        """
+        level = self.level
+        row, column = self._cell(entity)
+        remaining = dt
+        while remaining > 0:
+            if deadline is not None and _clock() > deadline:
+                remaining = None
+                break
+            tile = level.grid.get(row, column, True)
+            level._redraw_queue.append((row, column))
+            if type(tile).acceleration_on_object is not _plain_acceleration:
+                remaining, cell = self._step(entity, tile, remaining)
+            else:
+                remaining, cell = self._glide(entity, tile, row, column,
+                                              remaining)
+                if cell is None:
+                    break
+            if cell != (row, column):
+                level.events.crossed(entity, tile, (row, column),
+                                     level.grid.get(cell[0], cell[1], True),
+                                     cell)
+                row, column = cell
+        position = entity.position
+        self._cells[entity] = (position.x, position.y, row, column)
+        return remaining
+
+    def _cell(self, entity):
+        position = entity.position
+        known = self._cells.get(entity)
+        if known and known[0] == position.x and known[1] == position.y:
+            return known[2:]
+        return self.level.cell_at_point(position)
+
+    def _glide(self, entity, tile, row, column, remaining):
+        """Move in a straight line to the next edge crossing or to rest
+
+        Returns the time left and the cell the entity is in afterwards, or
+        None as the cell if the entity stopped.
+
+        """
+        position, velocity = entity.position, entity.velocity
+        speed = velocity.magnitude
+        if speed == 0:
+            return remaining, None
+        ux, uy = velocity.x / speed, velocity.y / speed
+        friction = tile.friction
+        # Distance along the direction of motion to the nearest tile edge.
+        # The entity can't cross into a blocked cell, so that edge is moved
+        # in by its radius and reached as a bounce instead.
+        length = self.tile_length
+        shape = getattr(entity, 'shape', None)
+        radius = shape.radius if shape is not None else 0.0
+        distance = float('inf')
+        step, edge = (0, 0), None
+        if ux:
+            forward = 1 if ux > 0 else -1
+            x = (column + (forward > 0)) * length
+            if self._blocked(column + forward, position.y, radius, True):
+                x -= forward * radius
+            distance, step, edge = (x - position.x) / ux, (0, forward), x
+        if uy:
+            forward = 1 if uy > 0 else -1
+            y = (row + (forward > 0)) * length
+            if self._blocked(row + forward, position.x, radius, False):
+                y -= forward * radius
+            d = (y - position.y) / uy
+            if d < distance:
+                distance, step, edge = d, (forward, 0), y
+        distance = max(distance, 0.0)
+        # Solve speed*t - friction*t**2/2 = distance for the first t, in a
+        # form that doesn't divide by a friction of zero
+        discriminant = speed**2 - 2 * friction * distance
+        if discriminant >= 0:
+            t_exit = 2 * distance / (speed + math.sqrt(discriminant))
+        else:
+            t_exit = float('inf')
+        t_rest = speed / friction if friction > 0 else float('inf')
+        t = min(t_exit, t_rest, remaining)
+        if t == t_rest:
+            # Stop exactly where the closed form says, with no velocity left
+            travelled, speed = speed**2 / (2 * friction), 0.0
+        elif t == t_exit:
+            travelled, speed = distance, speed - friction * t
+        else:
+            travelled, speed = speed * t - friction * t**2 / 2, \
+                               speed - friction * t
+        position.x += ux * travelled
+        position.y += uy * travelled
+        velocity.set(ux * speed, uy * speed)
+        remaining -= t
+        if t == t_rest:
+            return remaining, None
+        if t == t_exit:
+            # Land exactly on the edge, so rounding can't leave the entity
+            # short of it
+            if step[1]:
+                position.x = edge
+            else:
+                position.y = edge
+            cell = (row + step[0], column + step[1])
+            if step[1]:
+                wall = self._blocked(cell[1], position.y, radius, True)
+            else:
+                wall = self._blocked(cell[0], position.x, radius, False)
+            if wall:
+                restitution = self._restitution(*wall)
+                if step[1]:
+                    velocity.x *= -restitution
+                else:
+                    velocity.y *= -restitution
+                return remaining, (row, column)
+            return remaining, cell
+        return remaining, (row, column)
+
+    def _blocked(self, line, across, radius, is_column):
+        """Return the first blocked cell of a column (or row) that a circle
+        at across, on the other axis, overlaps, or None"""
+        length = self.tile_length
+        grid = self.level.grid
+        # Along the line, only cells inside the level; the borders are
+        # handled as the line itself being off the grid
+        size = grid.rows if is_column else grid.columns
+        first = max(int(math.floor((across - radius) / length)), 0)
+        last = min(int(math.floor((across + radius) / length)), size - 1)
+        for i in range(first, last + 1):
+            cell = (i, line) if is_column else (line, i)
+            if self.level.is_blocked(*cell):
+                return cell
+        return None
+
+    def _restitution(self, row, column):
+        grid = self.level.grid
+        if 0 <= row < grid.rows and 0 <= column < grid.columns:
+            return grid.type_at(row, column, True).restitution
+        return self.level.border_restitution
+
+    def _step(self, entity, tile, remaining):
+        """Take one numerical step, as Level.tick() would"""
+        dt = min(self.fallback_dt, remaining)
+        a = tile.acceleration_on_object(entity)
+        velocity = entity.velocity
+        velocity.add_scaled(a, dt)
+        self.level.move(entity, 0.5 * a.x * dt**2 + velocity.x * dt,
+                        0.5 * a.y * dt**2 + velocity.y * dt)
+        return remaining - dt, self.level.cell_at_point(entity.position)
+
+
+_plain_acceleration = Tile.acceleration_on_object
@@ -0,0 +1,291 @@
+"""Timing the phases of each frame
+
+When the game stutters, this tells which part of the frame is to blame. A
+Profiler times the main loop's phases: physics (every Level.tick substep),
+drawing (Level.draw and Level.draw_dirty, and within them the tile and
+entity blitting), event pumping (pygame.event.get) and showing the frame
+(pygame.display.flip and update, which also end each frame).
+
+Nothing in the engine checks for profiling. Enabling a Profiler wraps the
+functions that make up each phase, and disabling it puts the originals
+back, so a disabled profiler costs nothing at all:
+
+    >>> os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+    >>> from golfram.level import Level
+    >>> from golfram.tile import Tile
+    >>> level = Level(tiles=[[Tile()]])
+    >>> tick = Level.tick
+    >>> profiler = Profiler(capacity=100)
+    >>> profiler.enable()
+    >>> Level.tick is tick
+    False
+    >>> for frame in range(3):
+    ...     for substep in range(10):
+    ...         level.tick(0.001)
+    ...     profiler.end_frame()
+    >>> profiler.disable()
+    >>> len(profiler.samples('physics'))
+    3
+    >>> Level.tick is tick
+    True
+
+Each phase's total per frame, and the time between frames, are kept in
+ring buffers of the last capacity frames, from which percentiles(),
+histogram() and dump() report. draw_overlay() puts the numbers on screen.
+
+Setting the environment variable GOLFRAM_PROFILE enables the shared
+profiler from enable_from_environment(); its value names the file that
+dump_to_environment() writes when the game exits.
+
+"""
+import functools
+import json
+import os
+import time
+from array import array
+
+from golfram.graphics import LevelRenderer
+from golfram.level import Level
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+# Upper edges, in milliseconds, of the bins of histogram()
+HISTOGRAM_EDGES = (1, 2, 4, 8, 12, 16.7, 25, 33.3, 50, 100, float('inf'))
+
+
+class RingBuffer(object):
+    """The last capacity floats appended"""
+
+    def __init__(self, capacity):
+        self.values = array('d', [0.0] * capacity)
+        self.capacity = capacity
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, value):
+        self.values[self.count % self.capacity] = value
+        self.count += 1
+
+    def to_list(self):
+        """Return the values, oldest first"""
+        if self.count <= self.capacity:
+            return self.values[:self.count].tolist()
+        start = self.count % self.capacity
+        return (self.values[start:] + self.values[:start]).tolist()
+
+
+class Profiler(object):
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.enabled = False
+        # phase -> RingBuffer of its seconds per frame
+        self.buffers = {}
+        # phase -> seconds spent in it so far this frame
+        self._frame = {}
+        self._frame_start = None
+        # The phases being timed right now
+        self._active = set()
+        # (owner, attribute, what owner.__dict__ held) for each wrapped
+        # function
+        self._wrapped = []
+        self._font = None
+
+    def enable(self):
+        """Start timing the phases of each frame"""
+        if self.enabled:
+            return
+        self.enabled = True
+        self._frame_start = _clock()
+        self.wrap(Level, 'tick', 'physics')
+        self.wrap(Level, 'draw', 'draw')
+        self.wrap(Level, 'draw_dirty', 'draw')
+        self.wrap(LevelRenderer, '_draw_area', 'blit tiles')
+        self.wrap(LevelRenderer, '_draw_tile', 'blit tiles')
+        self.wrap(LevelRenderer, '_draw_entities', 'blit entities')
+        try:
+            import pygame
+        except ImportError:
+            return
+        self.wrap(pygame.event, 'get', 'events')
+        self.wrap(pygame.display, 'flip', 'display', end_frame=True)
+        self.wrap(pygame.display, 'update', 'display', end_frame=True)
+
+    def disable(self):
+        """Stop timing, and put back every wrapped function"""
+        for owner, attribute, original in reversed(self._wrapped):
+            if original is None:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, original)
+        del self._wrapped[:]
+        self._active.clear()
+        self.enabled = False
+
+    def wrap(self, owner, attribute, phase, end_frame=False):
+        """Count the time spent in owner.attribute towards phase
+
+        owner is a class or module. Calls that are nested in another call
+        of the same phase (a draw_dirty() inside a draw(), say) are only
+        counted once. If end_frame is set, the frame ends after each call.
+
+        """
+        function = getattr(owner, attribute)
+        frame, active = self._frame, self._active
+        profiler = self
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            if phase in active:
+                return function(*args, **kwargs)
+            active.add(phase)
+            start = _clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                frame[phase] = frame.get(phase, 0.0) + _clock() - start
+                active.discard(phase)
+                if end_frame:
+                    profiler.end_frame()
+        self._wrapped.append((owner, attribute,
+                              vars(owner).get(attribute)))
+        setattr(owner, attribute, timed)
+
+    def end_frame(self):
+        """Record the frame's timings and start a new frame"""
+        now = _clock()
+        self._record('frame', now - self._frame_start)
+        self._frame_start = now
+        for phase in self.buffers:
+            if phase != 'frame':
+                self._record(phase, self._frame.get(phase, 0.0))
+        for phase, seconds in self._frame.items():
+            if phase not in self.buffers:
+                self._record(phase, seconds)
+        self._frame.clear()
+
+    def _record(self, phase, seconds):
+        buffer = self.buffers.get(phase)
+        if buffer is None:
+            buffer = self.buffers[phase] = RingBuffer(self.capacity)
+        buffer.append(seconds)
+
+    def samples(self, phase):
+        """Return the seconds per frame spent in phase, oldest first"""
+        buffer = self.buffers.get(phase)
+        return buffer.to_list() if buffer is not None else []
+
+    def percentiles(self, phase, points=(50, 90, 99)):
+        """Return the given percentiles of phase's seconds per frame
+
+        >>> profiler = Profiler()
+        >>> for ms in range(1, 101):
+        ...     profiler._record('draw', ms / 1000.0)
+        >>> profiler.percentiles('draw')
+        [0.05, 0.09, 0.099]
+
+        Low percentiles of a handful of frames are the fastest frame:
+
+        >>> profiler = Profiler()
+        >>> for ms in (3, 1, 2):
+        ...     profiler._record('draw', ms / 1000.0)
+        >>> profiler.percentiles('draw', (1, 10, 50))
+        [0.001, 0.001, 0.002]
+
+        """
+        samples = sorted(self.samples(phase))
+        if not samples:
+            return [0.0 for point in points]
+        last = len(samples) - 1
+        return [samples[min(max(int(round(point / 100.0 * len(samples))) - 1,
+                                0), last)]
+                for point in points]
+
+    def histogram(self, phase='frame', edges=HISTOGRAM_EDGES):
+        """Return [(upper edge in ms, number of frames)] for phase"""
+        counts = [0] * len(edges)
+        for seconds in self.samples(phase):
+            ms = seconds * 1000
+            for i, edge in enumerate(edges):
+                if ms <= edge:
+                    counts[i] += 1
+                    break
+        return list(zip(edges, counts))
+
+    def report(self):
+        """Return a dict of every phase's percentiles and histogram, ready to
+        be saved as JSON"""
+        phases = {}
+        for phase in sorted(self.buffers):
+            p50, p90, p99 = self.percentiles(phase)
+            phases[phase] = {
+                'frames': len(self.buffers[phase]),
+                'p50_ms': p50 * 1000, 'p90_ms': p90 * 1000,
+                'p99_ms': p99 * 1000,
+                'max_ms': max(self.samples(phase)) * 1000,
+                'histogram': [[edge if edge != float('inf') else None, count]
+                              for edge, count in self.histogram(phase)],
+            }
+        return {'time': time.time(), 'phases': phases}
+
+    def dump(self, filename):
+        """Write report() to filename as JSON, with the raw samples"""
+        report = self.report()
+        for phase, data in report['phases'].items():
+            data['samples_ms'] = [round(seconds * 1000, 4)
+                                  for seconds in self.samples(phase)]
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+    def draw_overlay(self, surface, position=(4, 4)):
+        """Draw the median and 99th percentile of each phase onto surface
+
+        Returns the rectangle drawn, for pygame.display.update(). The
+        overlay has an opaque background, so it can be drawn over whatever
+        is there each frame.
+
+        """
+        import pygame
+        if self._font is None:
+            pygame.font.init()
+            self._font = pygame.font.Font(None, 18)
+        lines = ['{:14} {:6.2f} {:6.2f} ms'.format(phase, p50 * 1000,
+                                                   p99 * 1000)
+                 for phase in sorted(self.buffers)
+                 for p50, p99 in [self.percentiles(phase, (50, 99))]]
+        images = [self._font.render(line, True, (255, 255, 255))
+                  for line in ['phase           p50    p99'] + lines]
+        width = max(image.get_width() for image in images) + 4
+        height = sum(image.get_height() for image in images) + 4
+        rect = pygame.Rect(position, (width, height))
+        surface.fill((0, 0, 0), rect)
+        y = position[1] + 2
+        for image in images:
+            surface.blit(image, (position[0] + 2, y))
+            y += image.get_height()
+        return rect
+
+
+# The profiler shared by the whole game
+profiler = Profiler()
+
+def enable_from_environment():
+    """Enable the shared profiler if GOLFRAM_PROFILE is set; return whether
+    it was"""
+    if os.environ.get('GOLFRAM_PROFILE'):
+        profiler.enable()
+        return True
+    return False
+
+def dump_to_environment():
+    """Dump the shared profiler to the file named by GOLFRAM_PROFILE"""
+    filename = os.environ.get('GOLFRAM_PROFILE')
+    if filename and profiler.enabled:
+        profiler.dump(filename)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,278 @@
+"""Deterministic stepping, and recording and replaying shots
+
+Given the same level, the same shots and the same sequence of dt, the
+physics always comes out the same. Frame times don't repeat, so a
+FixedTimestep advances a level in steps of one fixed dt, however the
+frames happen to fall; the steps that don't fit in a frame are carried
+over to the next one.
+
+A Recorder is a FixedTimestep that also writes down everything needed to
+play the round again: the level's id and seed, the shots taken (at which
+step, by which entity, at what velocity) and a checksum of the state of
+the level after every step. replay() re-simulates a Recording as fast as
+it can, without a display, and stops at the first step whose checksum
+differs:
+
+    >>> from golfram.ball import GolfBall
+    >>> from golfram.geometry import Vector
+    >>> from golfram.level import Level
+    >>> from golfram.tile import Tile
+    >>> def make_level(level_id, seed):
+    ...     level = Level(tiles=[[Tile()] * 4] * 4, seed=seed)
+    ...     level.add_entity(GolfBall(position=Vector(0.3, 0.3)))
+    ...     return level
+    >>> recorder = Recorder(make_level('square', 42), 'square')
+    >>> ball = recorder.level._entities[0][0]
+    >>> recorder.shoot(ball, Vector(2, 1.5))
+    >>> recorder.advance(0.5)
+    300
+    >>> data = recorder.recording().to_bytes()
+    >>> recording = Recording.from_bytes(data)
+    >>> recording.level_id, recording.seed, len(recording.checksums)
+    ('square', 42, 300)
+    >>> replay(recording, make_level).seed
+    42
+
+A round that was tampered with doesn't add up:
+
+    >>> recording.shots[0] = (0, 0, 2.0, 1.6)
+    >>> verify(recording, make_level)
+    False
+
+and neither does one with shots after its last step:
+
+    >>> recording = Recording.from_bytes(data)
+    >>> verify(recording, make_level)
+    True
+    >>> recording.shots.append((300, 0, 1.0, 0.0))
+    >>> verify(recording, make_level)
+    False
+
+"""
+import struct
+import zlib
+from array import array
+
+from golfram.level import LevelComplete
+
+# Magic number and version of the recording format
+MAGIC = b'GLFR'
+VERSION = 1
+
+# The default step: ten substeps of a 60 FPS frame
+DEFAULT_DT = 1 / 600.0
+
+# magic, version, dt, seed, number of steps, whether the level was completed,
+# number of shots, length of the level id
+_HEADER = struct.Struct('<4sHdQI?IH')
+# step, entity index, velocity x, velocity y
+_SHOT = struct.Struct('<IHdd')
+
+
+class ReplayFormatError(Exception):
+    pass
+
+
+class ReplayMismatch(Exception):
+    """A replay didn't reproduce the recorded state"""
+
+    def __init__(self, step):
+        Exception.__init__(self, "state differs at step {}".format(step))
+        self.step = step
+
+
+class Recording(object):
+    """Everything needed to play a round of a level again
+
+    shots is a list of (step, entity index, velocity x, velocity y): before
+    step number step, the entity at that index of the level's entities was
+    given that velocity. checksums holds the checksum() of the level after
+    each step. finished says whether the level was completed right after
+    the last step.
+
+    """
+    def __init__(self, level_id, seed, dt, shots=None, checksums=None,
+                 finished=False):
+        self.level_id = level_id
+        self.seed = seed
+        self.dt = dt
+        self.shots = shots if shots is not None else []
+        self.checksums = (checksums if checksums is not None
+                          else array('I'))
+        self.finished = finished
+
+    def to_bytes(self):
+        level_id = self.level_id.encode('utf-8')
+        parts = [_HEADER.pack(MAGIC, VERSION, self.dt, self.seed,
+                              len(self.checksums), self.finished,
+                              len(self.shots), len(level_id)),
+                 level_id]
+        parts.extend(_SHOT.pack(*shot) for shot in self.shots)
+        parts.append(struct.pack('<{}I'.format(len(self.checksums)),
+                                 *self.checksums))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        try:
+            (magic, version, dt, seed, step_count, finished, shot_count,
+             id_length) = _HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION:
+                raise ReplayFormatError("not a recording")
+            offset = _HEADER.size
+            level_id = bytes(data[offset:offset + id_length]).decode('utf-8')
+            offset += id_length
+            shots = []
+            for i in range(shot_count):
+                shots.append(_SHOT.unpack_from(data, offset))
+                offset += _SHOT.size
+            checksums = array('I', struct.unpack_from(
+                '<{}I'.format(step_count), data, offset))
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ReplayFormatError("bad recording: {}".format(e))
+        return cls(level_id, seed, dt, shots, checksums, finished)
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+class FixedTimestep(object):
+    """Advance a level in steps of exactly dt seconds"""
+
+    def __init__(self, level, dt=DEFAULT_DT):
+        self.level = level
+        self.dt = dt
+        # Number of steps taken so far
+        self.steps = 0
+        self._left_over = 0.0
+
+    def advance(self, elapsed):
+        """Take as many steps as fit in elapsed seconds (plus whatever was
+        left over last time); return how many were taken
+
+        Raises LevelComplete like Level.tick().
+
+        """
+        self._left_over += elapsed
+        taken = 0
+        while self._left_over >= self.dt:
+            self._left_over -= self.dt
+            self.step()
+            taken += 1
+        return taken
+
+    def step(self):
+        self.level.tick(self.dt)
+        self.steps += 1
+
+
+class Recorder(FixedTimestep):
+    """A FixedTimestep that records the shots taken and the resulting state
+
+    level_id is whatever the code that replays the round needs in order to
+    make the same level again, such as the name of its file.
+
+    """
+    def __init__(self, level, level_id, dt=DEFAULT_DT):
+        FixedTimestep.__init__(self, level, dt)
+        self.level_id = level_id
+        self.shots = []
+        self.checksums = array('I')
+        self.finished = False
+
+    def shoot(self, entity, velocity):
+        """Give entity velocity before the next step"""
+        index = [e for e, physics in self.level._entities].index(entity)
+        self.shots.append((self.steps, index, velocity.x, velocity.y))
+        entity.velocity.set(velocity.x, velocity.y)
+
+    def step(self):
+        try:
+            FixedTimestep.step(self)
+        except LevelComplete:
+            self.finished = True
+            raise
+        self.checksums.append(checksum(self.level))
+
+    def recording(self):
+        """Return a Recording of the round so far
+
+        Shots taken since the last step haven't been played yet, so they
+        are left out.
+
+        """
+        steps = len(self.checksums) + self.finished
+        return Recording(self.level_id, self.level.seed, self.dt,
+                         [shot for shot in self.shots if shot[0] < steps],
+                         array('I', self.checksums),
+                         self.finished)
+
+
+def checksum(level):
+    """Return a CRC-32 of the position and velocity of every physics entity"""
+    values = []
+    for entity, physics in level._entities:
+        if physics:
+            position, velocity = entity.position, entity.velocity
+            values.extend((position.x, position.y, velocity.x, velocity.y))
+    return zlib.crc32(struct.pack('<{}d'.format(len(values)),
+                                  *values)) & 0xffffffff
+
+
+def replay(recording, make_level):
+    """Play a Recording again and check that it comes out the same
+
+    make_level(level_id, seed) must return a new, headless level. Returns
+    the level in its final state, or raises ReplayMismatch at the first
+    step that doesn't match. Raises ReplayFormatError, before simulating
+    anything, if a shot comes after the last step.
+
+    """
+    checksums = recording.checksums
+    # A finished round has one more step, the one that completed it
+    steps = len(checksums) + recording.finished
+    shots = sorted(recording.shots, key=lambda shot: shot[0])
+    if shots and shots[-1][0] >= steps:
+        raise ReplayFormatError("shot at step {}, after the last step".format(
+                                shots[-1][0]))
+    level = make_level(recording.level_id, recording.seed)
+    entities = [entity for entity, physics in level._entities]
+    next_shot = 0
+    dt = recording.dt
+    redraw_queue = level._redraw_queue
+    for step in range(steps):
+        while next_shot < len(shots) and shots[next_shot][0] == step:
+            _, index, x, y = shots[next_shot]
+            entities[index].velocity.set(x, y)
+            next_shot += 1
+        try:
+            level.tick(dt)
+        except LevelComplete:
+            if step == len(checksums):
+                return level
+            raise ReplayMismatch(step)
+        # Nothing is drawn, so don't let the queue of cells to redraw grow
+        del redraw_queue[:]
+        if step == len(checksums) or checksum(level) != checksums[step]:
+            raise ReplayMismatch(step)
+    return level
+
+
+def verify(recording, make_level):
+    """Return whether a Recording replays exactly"""
+    try:
+        replay(recording, make_level)
+    except (ReplayMismatch, ReplayFormatError, IndexError):
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,436 @@
+"""An authoritative game server
+
+A GameServer hosts any number of Games at once, without a display. It is
+the only one simulating them: clients send shots, and get back the state
+of the game's entities as it changes. One coroutine ticks every active
+game in turn each cycle and then sends out what changed, so a single core
+can keep hundreds of small matches going; a cycle that overruns is not
+caught up on, which keeps the latency of each tick bounded.
+
+Messages are a header (type, payload length) followed by a payload:
+
+    JOIN     client -> server  the game id, as UTF-8
+    SHOOT    client -> server  entity index, velocity x, velocity y
+    WELCOME  server -> client  the client's player number, and the index
+                               of its ball (NO_BALL if there is none free)
+    STATE    server -> client  tick number, then the index, position and
+                               velocity of every entity that changed
+    OVER     server -> client  the level was completed
+
+State is sent as 32-bit floats, and only for entities whose state (so
+packed) differs from what was last sent; a client that joins gets the
+whole state once. LoopbackClient talks to a server in the same process:
+
+    >>> import asyncio
+    >>> from golfram.ball import GolfBall
+    >>> from golfram.game import Game
+    >>> from golfram.geometry import Vector
+    >>> from golfram.level import Level
+    >>> from golfram.tile import Tile
+    >>> def make_game(game_id):
+    ...     level = Level(tiles=[[Tile()] * 8] * 8)
+    ...     level.add_entity(GolfBall(position=Vector(0.5, 0.5)))
+    ...     level.add_entity(GolfBall(position=Vector(1.5, 0.5)))
+    ...     return Game((512, 512), level)
+    >>> async def play():
+    ...     server = GameServer(make_game)
+    ...     port = await server.start('127.0.0.1', 0)
+    ...     client = await LoopbackClient.connect('127.0.0.1', port)
+    ...     player = await client.join('match-1')
+    ...     await client.receive()
+    ...     client.shoot(client.ball, 1.0, 0.0)
+    ...     while client.states[0][2] == 0:
+    ...         await client.receive()
+    ...     await client.close()
+    ...     await server.stop()
+    ...     return player, client.states[0][0] > 0.5
+    >>> asyncio.run(play())
+    (0, True)
+
+Each client gets a ball of its own, if there is one free, and shots at
+any other ball, or at its own while it is still rolling, are ignored:
+
+    >>> async def steal():
+    ...     server = GameServer(make_game)
+    ...     port = await server.start('127.0.0.1', 0)
+    ...     a = await LoopbackClient.connect('127.0.0.1', port)
+    ...     b = await LoopbackClient.connect('127.0.0.1', port)
+    ...     players = [await a.join('match-3'), await b.join('match-3')]
+    ...     balls = [a.ball, b.ball]
+    ...     b.shoot(a.ball, 1.0, 0.0)
+    ...     b.shoot(b.ball, 1.0, 0.0)
+    ...     await b.receive()
+    ...     while b.states[b.ball][2] == 0:
+    ...         await b.receive()
+    ...     b.shoot(b.ball, -1.0, 0.0)
+    ...     await b.receive()
+    ...     velocities = [(state[2], state[3]) for index, state in
+    ...                   sorted(b.states.items())]
+    ...     for client in (a, b):
+    ...         await client.close()
+    ...     await server.stop()
+    ...     return balls, velocities[0], velocities[1][0] > 0
+    >>> asyncio.run(steal())
+    ([0, 1], (0.0, 0.0), True)
+
+Player numbers are never handed out twice in a game, and a ball is only
+given to another client once its player has left. A game is dropped once
+its last client has left, or once it is over:
+
+    >>> async def until(condition):
+    ...     for i in range(100):
+    ...         if condition():
+    ...             return
+    ...         await asyncio.sleep(0.01)
+    >>> async def rejoin():
+    ...     server = GameServer(make_game)
+    ...     port = await server.start('127.0.0.1', 0)
+    ...     clients = [await LoopbackClient.connect('127.0.0.1', port)
+    ...                for i in range(3)]
+    ...     players = [await clients[0].join('match-2'),
+    ...                await clients[1].join('match-2')]
+    ...     session = server.sessions['match-2']
+    ...     await clients[0].close()
+    ...     await until(lambda: len(session.clients) == 1)
+    ...     players.append(await clients[2].join('match-2'))
+    ...     for client in clients[1:]:
+    ...         await client.close()
+    ...     await until(lambda: not server.sessions)
+    ...     await server.stop()
+    ...     return players, session.game.players, server.sessions
+    >>> asyncio.run(rejoin())
+    ([0, 1, 2], [], {})
+
+"""
+import asyncio
+import math
+import struct
+
+from golfram.level import LevelComplete
+from golfram.physics import AnalyticIntegrator
+from golfram.replay import FixedTimestep
+
+# Message types
+JOIN, SHOOT, WELCOME, STATE, OVER = range(1, 6)
+
+# type, payload length
+_HEADER = struct.Struct('<BH')
+_SHOOT = struct.Struct('<Hff')
+_WELCOME = struct.Struct('<HH')
+# The ball index of a client that has no ball
+NO_BALL = 0xffff
+# tick number, number of entities
+_STATE = struct.Struct('<IH')
+# index, position x and y, velocity x and y
+_ENTITY = struct.Struct('<Hffff')
+
+
+def encode(message_type, payload=b''):
+    return _HEADER.pack(message_type, len(payload)) + payload
+
+async def read_message(reader):
+    """Return the (type, payload) of the next message, or None at EOF"""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+        message_type, length = _HEADER.unpack(header)
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    return message_type, payload
+
+
+class Session(object):
+    """A Game being played on the server, and the clients playing it"""
+
+    def __init__(self, game_id, game, dt, substeps):
+        self.game_id = game_id
+        self.game = game
+        self.clients = []
+        # writer -> player number, counting up from 0 as clients join
+        self.players = {}
+        self._next_player = 0
+        # player number -> the index of the entity that player shoots
+        self.balls = {}
+        # Balls rolling over ordinary tiles come out exactly the same
+        # however long the steps are, so the analytic integrator can take
+        # a whole tick at once
+        if game.level.engine is None:
+            game.level.set_engine(AnalyticIntegrator(game.level))
+        self.stepper = FixedTimestep(game.level, dt / substeps)
+        self.dt = dt
+        self.ticks = 0
+        self.over = False
+        # entity index -> the packed state last sent
+        self._sent = {}
+
+    def add_client(self, writer):
+        """Add a client to the game; return its player number and the index
+        of its ball (NO_BALL if every ball is taken)"""
+        player = self._next_player
+        self._next_player += 1
+        self.clients.append(writer)
+        self.players[writer] = player
+        self.game.add_player(player)
+        taken = set(self.balls.values())
+        for index in range(len(self.entities())):
+            if index not in taken:
+                self.balls[player] = index
+                break
+        return player, self.balls.get(player, NO_BALL)
+
+    def remove_client(self, writer):
+        if writer in self.players:
+            self.clients.remove(writer)
+            player = self.players.pop(writer)
+            self.balls.pop(player, None)
+            self.game.remove_player(player)
+
+    def entities(self):
+        return [entity for entity, physics in self.game.level._entities
+                if physics]
+
+    def is_active(self):
+        """Whether there is anyone to play for and anything moving"""
+        if not self.clients or self.over:
+            return False
+        for entity in self.entities():
+            if entity.velocity:
+                return True
+        return False
+
+    def tick(self):
+        try:
+            self.stepper.advance(self.dt)
+        except LevelComplete:
+            self.over = True
+        self.ticks += 1
+        # Nothing is drawn on the server
+        del self.game.level._redraw_queue[:]
+
+    def state(self, everything=False):
+        """Return a STATE message of what changed since the last one, or
+        None if nothing did
+
+        With everything set, the message holds every entity, for a client
+        that has just joined; the other clients aren't sent it, so it
+        doesn't count as sent.
+
+        """
+        sent = self._sent
+        changed = []
+        for index, entity in enumerate(self.entities()):
+            position, velocity = entity.position, entity.velocity
+            packed = _ENTITY.pack(index, position.x, position.y,
+                                  velocity.x, velocity.y)
+            if everything:
+                changed.append(packed)
+            elif sent.get(index) != packed:
+                sent[index] = packed
+                changed.append(packed)
+        if not changed:
+            return None
+        return encode(STATE, _STATE.pack(self.ticks, len(changed)) +
+                      b''.join(changed))
+
+
+class GameServer(object):
+    """Host Games for clients connecting over TCP
+
+    make_game(game_id) returns a new Game, the first time a client asks to
+    join game_id. Games are ticked tick_rate times a second, each tick
+    being substeps steps of the physics. Levels without a physics engine
+    of their own get an AnalyticIntegrator. Shots faster than max_speed (in
+    m/s) are slowed down to it. A client that can't keep up with its
+    messages, so that more than max_buffer bytes wait to be sent to it, is
+    disconnected rather than slow everyone else down.
+
+    """
+    def __init__(self, make_game, tick_rate=60, substeps=1, max_speed=10.0,
+                 max_buffer=64 * 1024):
+        self.make_game = make_game
+        self.tick_rate = tick_rate
+        self.substeps = substeps
+        self.max_speed = max_speed
+        self.max_buffer = max_buffer
+        # game id -> Session
+        self.sessions = {}
+        # How long the last cycle took, in seconds
+        self.last_cycle = 0.0
+        self._server = None
+        self._ticker = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start listening and ticking; return the port listened on"""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self._ticker = asyncio.ensure_future(self.run())
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            try:
+                await self._ticker
+            except asyncio.CancelledError:
+                pass
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for session in self.sessions.values():
+            for writer in session.clients:
+                writer.close()
+
+    async def run(self):
+        """Tick every active game, tick_rate times a second"""
+        loop = asyncio.get_event_loop()
+        period = 1.0 / self.tick_rate
+        next_cycle = loop.time()
+        while True:
+            start = loop.time()
+            self.cycle()
+            self.last_cycle = loop.time() - start
+            next_cycle += period
+            if next_cycle < loop.time():
+                # Running late: skip the missed cycles instead of bunching
+                # them up
+                next_cycle = loop.time()
+            await asyncio.sleep(next_cycle - loop.time())
+
+    def cycle(self):
+        """Tick all the active games, then send out what changed"""
+        active = [session for session in self.sessions.values()
+                  if session.is_active()]
+        for session in active:
+            session.tick()
+        for session in active:
+            message = session.state()
+            if session.over:
+                message = (message or b'') + encode(OVER)
+            if message:
+                self._broadcast(session, message)
+            if session.over:
+                self._drop(session)
+
+    def _broadcast(self, session, message):
+        for writer in list(session.clients):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self._leave(session, writer)
+            else:
+                writer.write(message)
+
+    async def _serve(self, reader, writer):
+        session = None
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                message_type, payload = message
+                if message_type == JOIN and session is None:
+                    session = self._join(payload.decode('utf-8'), writer)
+                elif message_type == SHOOT and session is not None:
+                    self._shoot(session, writer, *_SHOOT.unpack(payload))
+        except (ValueError, struct.error, UnicodeDecodeError,
+                ConnectionError):
+            pass
+        finally:
+            if session is not None:
+                self._leave(session, writer)
+            else:
+                writer.close()
+
+    def _join(self, game_id, writer):
+        session = self.sessions.get(game_id)
+        if session is None:
+            session = Session(game_id, self.make_game(game_id),
+                              1.0 / self.tick_rate, self.substeps)
+            self.sessions[game_id] = session
+        player, ball = session.add_client(writer)
+        writer.write(encode(WELCOME, _WELCOME.pack(player, ball)) +
+                     (session.state(everything=True) or b''))
+        return session
+
+    def _leave(self, session, writer):
+        session.remove_client(writer)
+        writer.close()
+        if not session.clients:
+            self._drop(session)
+
+    def _drop(self, session):
+        """Forget a game that is over or that everyone left"""
+        if self.sessions.get(session.game_id) is session:
+            del self.sessions[session.game_id]
+
+    def _shoot(self, session, writer, index, vx, vy):
+        """Shoot a client's own ball, if it is at rest"""
+        player = session.players.get(writer)
+        if session.over or session.balls.get(player) != index:
+            return
+        entities = session.entities()
+        if not 0 <= index < len(entities) or entities[index].velocity:
+            return
+        speed = math.hypot(vx, vy)
+        if not speed <= self.max_speed:
+            if not math.isfinite(speed):
+                return
+            vx, vy = vx * self.max_speed / speed, vy * self.max_speed / speed
+        entities[index].velocity.set(vx, vy)
+
+
+class LoopbackClient(object):
+    """A minimal client, for tests and bots
+
+    states maps each entity's index to its (x, y, vx, vy), as last heard
+    from the server. ball is the index of the client's own ball, once it
+    has joined a game.
+
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.states = {}
+        self.ball = None
+        self.tick = 0
+        self.over = False
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def join(self, game_id):
+        """Join a game; return our player number"""
+        self.writer.write(encode(JOIN, game_id.encode('utf-8')))
+        message_type, payload = await read_message(self.reader)
+        if message_type != WELCOME:
+            raise ValueError("expected WELCOME, got {}".format(message_type))
+        player, self.ball = _WELCOME.unpack(payload)
+        return player
+
+    def shoot(self, index, vx, vy):
+        self.writer.write(encode(SHOOT, _SHOOT.pack(index, vx, vy)))
+
+    async def receive(self):
+        """Wait for the next message and apply it; return its type, or None
+        if the server hung up"""
+        message = await read_message(self.reader)
+        if message is None:
+            return None
+        message_type, payload = message
+        if message_type == STATE:
+            self.tick, count = _STATE.unpack_from(payload)
+            for i in range(count):
+                index, x, y, vx, vy = _ENTITY.unpack_from(
+                    payload, _STATE.size + i * _ENTITY.size)
+                self.states[index] = (x, y, vx, vy)
+        elif message_type == OVER:
+            self.over = True
+        return message_type
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,186 @@
+"""Level sets in shared memory, for hosting games in many processes
+
+Every process that loads a level holds its own copy of the tile grid and
+of the level's fields. A SharedLevelSet loads a set of levels once, into
+one block of multiprocessing.shared_memory, and worker processes attach
+read-only views of it instead. What a match changes (entity positions,
+BoostTile activity, or a set_tile()) stays in the worker: the grid and
+fields are copied on the first write, and stateful tiles get their own
+copies as usual.
+
+    >>> import os
+    >>> demo = os.path.join(os.path.dirname(__file__), '..', 'levels',
+    ...                     'demo.lvl')
+    >>> levels = SharedLevelSet.create([demo])
+    >>> worker = SharedLevelSet.attach(levels.name)
+    >>> level = worker.level('demo')
+    >>> level.grid.indices.readonly, level.get_tile(0, 0).char
+    (True, '1')
+    >>> level.set_tile(0, 0, level.get_tile(0, 4))
+    >>> worker.level('demo').get_tile(0, 0).char
+    '1'
+    >>> worker.close()
+    >>> levels.close()
+    >>> levels.unlink()
+
+The block starts with the length of a JSON manifest (a 32-bit integer),
+then the manifest, describing where in the data each level's grid and
+fields are, and with its tile types and settings; then the data, from
+the next multiple of 8 bytes.
+
+"""
+import gc
+import json
+import os
+import struct
+from multiprocessing import shared_memory
+
+from golfram import levelfile
+from golfram.fields import LevelFields
+from golfram.level import Level
+
+_LENGTH = struct.Struct('<I')
+
+# The arrays of a LevelFields, and their typecodes
+_FIELDS = (('energy', 'd'), ('distance_field', 'd'), ('next', 'i'),
+           ('rest', 'i'))
+
+
+class SharedLevelSet(object):
+    """A set of levels in shared memory
+
+    Make one with create() in the process that owns the memory (and must
+    unlink() it when done), and attach() to it by name everywhere else.
+
+    """
+    def __init__(self, memory, owner):
+        self.memory = memory
+        self.name = memory.name
+        self.owner = owner
+        length, = _LENGTH.unpack_from(memory.buf)
+        self.manifest = json.loads(
+            bytes(memory.buf[_LENGTH.size:_LENGTH.size + length]).decode(
+                'utf-8'))
+        self._view = memory.buf.toreadonly()
+        # The data starts after the manifest, 8-byte aligned; offsets in
+        # the manifest are from there
+        self._data = _LENGTH.size + length + (-(_LENGTH.size + length) % 8)
+
+    @classmethod
+    def create(cls, filenames):
+        """Load the .lvl files into a new block of shared memory
+
+        Each level is known by the name of its file, without the extension.
+
+        """
+        levels, chunks = {}, []
+
+        def add(data):
+            """Add data to the block; return its (offset, length)"""
+            start = sum(len(chunk) for chunk in chunks)
+            # Keep every array 8-byte aligned
+            chunks.append(data + b'\0' * (-len(data) % 8))
+            return start, len(data)
+        for filename in filenames:
+            name = os.path.splitext(os.path.basename(filename))[0]
+            compiled = levelfile.load(filename)
+            directory = os.path.abspath(os.path.dirname(filename))
+            level = Level.from_compiled(compiled, directory)
+            indices = level.grid.indices
+            entry = {'width': compiled.width, 'height': compiled.height,
+                     'types': compiled.types, 'info': compiled.info,
+                     'directory': directory,
+                     'typecode': 'B' if indices.itemsize == 1 else 'H',
+                     'grid': add(bytes(indices))}
+            if level.fields is not None:
+                entry['goal'] = level.goal()
+                for attribute, typecode in _FIELDS:
+                    entry[attribute] = add(bytes(getattr(level.fields,
+                                                         attribute)))
+            compiled.close()
+            levels[name] = entry
+        manifest = json.dumps({'levels': levels}).encode('utf-8')
+        header = _LENGTH.pack(len(manifest)) + manifest
+        header += b'\0' * (-len(header) % 8)
+        data = b''.join([header] + chunks)
+        memory = shared_memory.SharedMemory(create=True, size=len(data))
+        memory.buf[:len(data)] = data
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to a SharedLevelSet made in another process
+
+        Before Python 3.13, the memory is destroyed when the resource
+        tracker of any process that attached to it shuts down, so only
+        attach from processes started (through multiprocessing) by the
+        owner, which share its tracker.
+
+        """
+        try:
+            memory = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            memory = shared_memory.SharedMemory(name)
+        return cls(memory, owner=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        if self.owner:
+            self.unlink()
+
+    def names(self):
+        return sorted(self.manifest['levels'])
+
+    def level(self, name, screen=None, seed=None, cls=Level):
+        """Return a new level (of class cls) reading from the shared set"""
+        entry = self.manifest['levels'][name]
+        grid = self._array(entry['grid'], entry['typecode'])
+        types = [dict(tile_type, texture=tile_type['texture'] and
+                      tuple(tile_type['texture']))
+                 for tile_type in entry['types']]
+        compiled = levelfile.CompiledLevel(entry['width'], entry['height'],
+                                           types, grid, entry['info'])
+        level = cls.from_compiled(compiled, entry['directory'], screen, seed,
+                                  fields=False)
+        if 'goal' in entry:
+            arrays = [self._array(entry[attribute], typecode)
+                      for attribute, typecode in _FIELDS]
+            level.fields = LevelFields(level, [tuple(entry['goal'])],
+                                       arrays)
+        return level
+
+    def close(self):
+        """Let go of the memory in this process
+
+        Levels made from the set must be gone by then.
+
+        """
+        if self._view is None:
+            return
+        self._view.release()
+        self._view = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # A level and its fields refer to each other, so levels that
+            # are gone may still be waiting for the garbage collector
+            gc.collect()
+            self.memory.close()
+
+    def unlink(self):
+        """Destroy the memory, once every process has closed it"""
+        self.memory.unlink()
+
+    def _array(self, span, typecode):
+        start, length = span
+        start += self._data
+        view = self._view[start:start + length]
+        return view.cast(typecode) if typecode != 'B' else view
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
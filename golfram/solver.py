@@ -0,0 +1,278 @@
+"""Finding shots that sink the ball
+
+A Solver searches the initial velocities of the ball for shots that leave
+it at rest in a goal region, with as few strokes as possible. Shots are
+simulated with the level's own physics (through an AnalyticIntegrator,
+which plays a whole shot in one go), spread over a pool of processes.
+
+Each simulated shot is remembered by its discretised start position
+(which also fixes the tile it starts on) and velocity, so searching again
+from anywhere that has been searched before costs almost nothing:
+
+    >>> from golfram.geometry import Vector
+    >>> from golfram.level import Level
+    >>> from golfram.tile import Tile
+    >>> def make_level():
+    ...     return Level(tiles=[[Tile()] * 8] * 3)
+    >>> solver = Solver(make_level, goal=(1, 6), processes=0)
+    >>> strokes, shots = solver.solve(Vector(0.2, 0.5))
+    >>> strokes
+    1
+    >>> simulated = len(solver.memo)
+    >>> solver.par(Vector(0.2, 0.5)), len(solver.memo) == simulated
+    (1, True)
+
+Solving every level of a course offline gives its par. In the game,
+hint() suggests a shot within a time budget, trying the most promising
+shots first and settling for the closest one found when time runs out.
+
+"""
+from __future__ import division
+import math
+import multiprocessing
+import time
+
+from golfram.geometry import Rectangle, Vector
+from golfram.physics import AnalyticIntegrator
+from golfram.units import PX_PER_M
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class Solver(object):
+    """Search for shots across a level
+
+    make_level() must return a new level without a display; with a pool of
+    processes it also has to be picklable (a module level function, or a
+    functools.partial of Level.load_file, say). goal is a Rectangle in
+    metres or the (row, column) of a tile; left out, it is read from the
+    level's @goal directive ("row column").
+
+    The candidate shots from each position are speeds evenly spaced up to
+    max_speed (in m/s) in each of angles directions. Positions are snapped
+    to a grid of resolution metres. processes is the size of the pool
+    (0 simulates in this process; None uses every CPU).
+
+    """
+    def __init__(self, make_level, goal=None, speeds=8, angles=32,
+                 max_speed=4.0, resolution=0.02, max_time=30.0,
+                 processes=None):
+        self.make_level = make_level
+        self.resolution = resolution
+        self.max_time = max_time
+        self.processes = processes
+        # (x index, y index, vx, vy) -> where the ball came to rest
+        self.memo = {}
+        self._simulator = _Simulator(make_level, max_time)
+        self._pool = None
+        self.goal = self._goal_region(goal)
+        self.velocities = [(speed * max_speed / speeds * math.cos(angle),
+                            speed * max_speed / speeds * math.sin(angle))
+                           for speed in range(1, speeds + 1)
+                           for angle in [2 * math.pi * i / angles
+                                         for i in range(angles)]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def solve(self, start, max_strokes=3, beam=16):
+        """Find the fewest strokes from start (a Vector) into the goal
+
+        Returns (strokes, shots), each shot being (x, y, vx, vy), or None
+        if no way in was found within max_strokes. After each stroke only
+        the beam resting places closest to the goal are searched on from.
+
+        """
+        frontier = [(self._snap(start.x, start.y), [])]
+        seen = set(position for position, path in frontier)
+        for strokes in range(1, max_strokes + 1):
+            shots, paths = [], []
+            for (x, y), path in frontier:
+                for vx, vy in self.velocities:
+                    shots.append((x, y, vx, vy))
+                    paths.append(path)
+            ends = self.simulate(shots)
+            resting = {}
+            for shot, path, end in zip(shots, paths, ends):
+                if self._in_goal(*end):
+                    return strokes, path + [shot]
+                end = self._snap(*end)
+                if end not in seen:
+                    seen.add(end)
+                    resting[end] = path + [shot]
+            frontier = sorted(resting.items(),
+                              key=lambda item: self._distance(*item[0]))
+            del frontier[beam:]
+        return None
+
+    def par(self, start, max_strokes=5):
+        """Return the fewest strokes into the goal from start, or None"""
+        solution = self.solve(start, max_strokes)
+        return solution[0] if solution is not None else None
+
+    def hint(self, start, budget=0.05):
+        """Suggest a shot from start, taking no longer than budget seconds
+
+        Shots are tried in this process, those aimed at the goal first.
+        Returns the velocity (a Vector) of the first shot found that ends in
+        the goal, or of the one that ended closest to it. The budget covers
+        simulating each shot too, so a long shot is given up on halfway
+        once time runs out; that leaves None if no shot finished at all.
+
+        >>> from golfram.level import Level
+        >>> from golfram.tile import Tile
+        >>> def make_level():
+        ...     return Level(tiles=[[Tile()] * 8] * 3)
+        >>> solver = Solver(make_level, goal=(1, 6), processes=0)
+        >>> print(solver.hint(Vector(0.2, 0.5), budget=0))
+        None
+        >>> solver.memo
+        {}
+
+        """
+        deadline = _clock() + budget
+        x, y = self._snap(start.x, start.y)
+        centre = self._centre()
+        aim = math.atan2(centre[1] - y, centre[0] - x)
+
+        def off_target(velocity):
+            angle = math.atan2(velocity[1], velocity[0]) - aim
+            return abs(math.atan2(math.sin(angle), math.cos(angle)))
+        best, best_distance = None, float('inf')
+        for vx, vy in sorted(self.velocities, key=off_target):
+            end = self.simulate([(x, y, vx, vy)], local=True,
+                                deadline=deadline)[0]
+            if end is None:
+                break
+            if self._in_goal(*end):
+                return Vector(vx, vy)
+            distance = self._distance(*end)
+            if distance < best_distance:
+                best, best_distance = Vector(vx, vy), distance
+            if _clock() > deadline:
+                break
+        return best
+
+    def simulate(self, shots, local=False, deadline=None):
+        """Return where the ball comes to rest after each shot
+
+        Shots already simulated come from the memo; the rest are shared out
+        over the pool, unless local is set. Simulating in this process can
+        be cut short at deadline (a time.perf_counter() reading); the shots
+        that didn't finish by then end at None, and aren't memoised.
+
+        """
+        resolution = self.resolution
+        memo = self.memo
+        keys = [(int(round(x / resolution)), int(round(y / resolution)),
+                 vx, vy) for x, y, vx, vy in shots]
+        missing = {}
+        for key, shot in zip(keys, shots):
+            if key not in memo:
+                missing[key] = shot
+        if missing:
+            todo = list(missing.values())
+            pool = None if local else self._get_pool()
+            if pool is None:
+                ends = self._simulator.run_all(todo, deadline)
+            else:
+                chunk = max(1, len(todo) // (4 * self._pool_size))
+                ends = pool.map(_run_shot, todo, chunk)
+            for key, end in zip(missing, ends):
+                if end is not None:
+                    memo[key] = end
+        return [memo.get(key) for key in keys]
+
+    def _get_pool(self):
+        if self.processes == 0:
+            return None
+        if self._pool is None:
+            self._pool_size = self.processes or multiprocessing.cpu_count()
+            self._pool = multiprocessing.Pool(self._pool_size, _start_worker,
+                                              (self.make_level,
+                                               self.max_time))
+        return self._pool
+
+    def _goal_region(self, goal):
+        level = self._simulator.level
+        if goal is None:
+            goal = level.goal()
+            if goal is None:
+                raise ValueError("level has no @goal; pass one to Solver")
+        if isinstance(goal, Rectangle):
+            return goal
+        length = level.tilesize / PX_PER_M
+        row, column = goal
+        return Rectangle(Vector(column * length, row * length),
+                         width=length, height=length)
+
+    def _snap(self, x, y):
+        resolution = self.resolution
+        return (round(x / resolution) * resolution,
+                round(y / resolution) * resolution)
+
+    def _in_goal(self, x, y):
+        goal = self.goal
+        return goal.nw.x <= x <= goal.se.x and goal.nw.y <= y <= goal.se.y
+
+    def _centre(self):
+        goal = self.goal
+        return (goal.nw.x + goal.se.x) / 2, (goal.nw.y + goal.se.y) / 2
+
+    def _distance(self, x, y):
+        cx, cy = self._centre()
+        return math.hypot(x - cx, y - cy)
+
+
+class _Simulator(object):
+    """A level, a ball and an integrator, reused shot after shot"""
+
+    def __init__(self, make_level, max_time):
+        self.level = level = make_level()
+        # Only the ball being shot moves
+        del level._entities[:]
+        self.ball = level.ball_class()
+        level.add_entity(self.ball)
+        self.integrator = AnalyticIntegrator(level)
+        self.max_time = max_time
+
+    def run(self, shot, deadline=None):
+        """Return where shot leaves the ball, or None if the clock passed
+        deadline first"""
+        x, y, vx, vy = shot
+        ball = self.ball
+        ball.position.set(x, y)
+        ball.velocity.set(vx, vy)
+        elapsed = self.integrator.run_until_rest(self.max_time, deadline)
+        del self.level._redraw_queue[:]
+        if elapsed is None:
+            return None
+        return ball.position.x, ball.position.y
+
+    def run_all(self, shots, deadline=None):
+        return [self.run(shot, deadline) for shot in shots]
+
+
+# The _Simulator of a pool's worker process
+_worker = None
+
+def _start_worker(make_level, max_time):
+    global _worker
+    _worker = _Simulator(make_level, max_time)
+
+def _run_shot(shot):
+    return _worker.run(shot)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
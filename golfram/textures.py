@@ -0,0 +1,219 @@
+"""Loading and sharing textures
+
+Every image is decoded once, however many tiles, levels or classes ask for
+it. Tiles that live in a texture atlas get subsurfaces of the atlas, which
+share its pixels instead of copying them. Once a display mode is set, the
+images are converted to the display's pixel format, which makes blitting
+them much faster; until then the unconverted images are handed out. Each
+image is converted once, as it is loaded, or by convert_all() when the
+display mode is set or changed, so handing out a texture already loaded
+costs no more than a dict lookup.
+
+    >>> os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+    >>> manager = TextureManager()
+    >>> a = manager.get('levels/sprites.png', (0, 0, 8, 8))
+    >>> b = manager.get('levels/sprites.png', (0, 0, 8, 8))
+    >>> a is b, a.get_parent() is manager.get('levels/sprites.png')
+    (True, True)
+    >>> manager.decoded
+    1
+
+Most code should use the shared manager through the module level get().
+
+Textures are drawn at whatever size the renderer's zoom calls for, which is
+rarely the size they were drawn at. A SpriteCache scales each texture once
+per size it is needed at, instead of on every blit:
+
+    >>> sprites = SpriteCache()
+    >>> tile = manager.get('levels/sprites.png', (0, 0, 8, 8))
+    >>> big = sprites.get(tile, (64, 64))
+    >>> big.get_size(), sprites.get(tile, (64, 64)) is big
+    ((64, 64), True)
+    >>> sprites.get(tile, (8, 8)) is tile
+    True
+
+"""
+import os
+from collections import OrderedDict
+
+class TextureManager(object):
+
+    def __init__(self):
+        # filename -> decoded (and maybe converted) image
+        self._images = {}
+        # (filename, rect) -> subsurface of the image
+        self._subsurfaces = {}
+        # The display surface the images were converted for, if any
+        self._display = None
+        # How many images have been decoded, for keeping an eye on startup
+        self.decoded = 0
+        # How many times convert_all() replaced the images; anything made
+        # from them earlier (like a renderer's chunks) is out of date once
+        # this changes
+        self.conversions = 0
+
+    def get(self, filename, rect=None):
+        """Return the texture in filename, or a subsurface of it
+
+        rect is (x, y, width, height). Identical requests get the very same
+        surface back.
+
+        """
+        if rect is None:
+            image = self._images.get(filename)
+            if image is None:
+                image = self._images[filename] = self._load(filename)
+            return image
+        key = (filename, tuple(rect))
+        texture = self._subsurfaces.get(key)
+        if texture is None:
+            texture = self.get(filename).subsurface(key[1])
+            self._subsurfaces[key] = texture
+        return texture
+
+    @property
+    def converted(self):
+        """Whether the images are in the display's pixel format"""
+        return self._display is not None
+
+    def convert_all(self):
+        """Convert every image to the display's pixel format
+
+        Call this after setting the display mode, and again whenever it
+        changes; does nothing without a display. Images loaded afterwards
+        are converted as they are loaded. Textures handed out before are
+        replaced, so get them again. The shared SpriteCache is emptied, as
+        its sprites were scaled from the old images, and renderers drop
+        their chunks the next time they draw.
+
+        """
+        import pygame
+        display = pygame.display.get_init() and pygame.display.get_surface()
+        if not display:
+            return
+        for filename, image in self._images.items():
+            self._images[filename] = _convert(image)
+        # The old subsurfaces point into the unconverted images
+        for key in self._subsurfaces:
+            filename, rect = key
+            self._subsurfaces[key] = self._images[filename].subsurface(rect)
+        self._display = display
+        self.conversions += 1
+        sprites.clear()
+
+    def memory_usage(self):
+        """Return the number of bytes of pixel data held
+
+        Subsurfaces share their parent's pixels, so only whole images count.
+
+        """
+        return sum(image.get_bytesize() * image.get_width() *
+                   image.get_height() for image in self._images.values())
+
+    def clear(self):
+        self._images.clear()
+        self._subsurfaces.clear()
+
+    def _load(self, filename):
+        import pygame
+        image = pygame.image.load(filename)
+        self.decoded += 1
+        # Loading is rare, so this is where a new display mode is noticed
+        display = pygame.display.get_init() and pygame.display.get_surface()
+        if display and display is not self._display:
+            self.convert_all()
+        if self.converted:
+            image = _convert(image)
+        return image
+
+
+def _convert(image):
+    import pygame
+    if image.get_flags() & pygame.SRCALPHA:
+        return image.convert_alpha()
+    return image.convert()
+
+
+class SpriteCache(object):
+    """Textures scaled to the sizes they are drawn at
+
+    Scaled sprites are made with pygame.transform.smoothscale when they are
+    first asked for, and kept by (texture, size). Shrinking goes through a
+    chain of halves, like a mipmap, so each step averages all the pixels of
+    the one before and the halves are shared by all the smaller sizes. The
+    least recently used sprites are dropped once they take up more than
+    max_bytes.
+
+    """
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # How many sprites have been scaled, for keeping an eye on the cache
+        self.scaled = 0
+        # (texture, (width, height)) -> scaled surface
+        self._sprites = OrderedDict()
+
+    def __len__(self):
+        return len(self._sprites)
+
+    def get(self, texture, size):
+        """Return texture scaled to size, a (width, height) in pixels"""
+        size = (int(size[0]), int(size[1]))
+        if texture.get_size() == size:
+            return texture
+        key = (texture, size)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self._sprites.move_to_end(key)
+            return sprite
+        sprite = self._sprites[key] = self._scale(texture, size)
+        self.bytes += _bytes(sprite)
+        while self.bytes > self.max_bytes and len(self._sprites) > 1:
+            self.bytes -= _bytes(self._sprites.popitem(last=False)[1])
+        return sprite
+
+    def clear(self):
+        self._sprites.clear()
+        self.bytes = 0
+
+    def _scale(self, texture, size):
+        import pygame
+        # Start from the smallest level of the chain that is still bigger
+        level = texture.get_size()
+        while True:
+            half = ((level[0] + 1) // 2, (level[1] + 1) // 2)
+            if half == size or half[0] < size[0] or half[1] < size[1]:
+                break
+            level = half
+        source = texture
+        if level != texture.get_size():
+            source = self.get(texture, level)
+        self.scaled += 1
+        if source.get_bitsize() in (24, 32):
+            return pygame.transform.smoothscale(source, size)
+        # smoothscale only takes 24 and 32 bit surfaces
+        return pygame.transform.scale(source, size)
+
+
+def _bytes(surface):
+    return surface.get_bytesize() * surface.get_width() * surface.get_height()
+
+
+manager = TextureManager()
+
+def get(filename, rect=None):
+    """Return a texture from the shared TextureManager
+
+    Callers should pass filenames in a consistent form (for instance through
+    os.path.normpath) so that the same file is not decoded twice.
+
+    """
+    return manager.get(filename, rect)
+
+# The sprite cache shared by every renderer
+sprites = SpriteCache()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
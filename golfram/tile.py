@@ -1,16 +1,36 @@
+from golfram.geometry import Vector
+
+
 class Tile(object):
 
+    # Whether the texture can change while the level is running. Animated
+    # tiles are redrawn every frame instead of being pre-rendered.
+    animated = False
     friction = 0.4
+    # Solid tiles can't be entered; entities bounce off their edges, keeping
+    # this fraction of their speed into the wall.
+    restitution = 1.0
+    solid = False
+    # Whether each cell needs its own instance because the tile keeps state.
+    # Other tiles are shared between every cell of their kind.
+    stateful = False
     texture = None
 
     def acceleration_on_object(self, object):
         """Calculate the frictional acceleration applied by self to object.
 
-        object must have the vector property 'velocity'.
+        object must have the vector property 'velocity'. Nothing acts on an
+        object at rest:
+
+        >>> from golfram.ball import GolfBall
+        >>> Tile().acceleration_on_object(GolfBall())
+        Vector(0.0, 0.0)
 
         """
-        direction = -object.velocity.normalize()
-        friction = self.friction * direction
+        if not object.velocity:
+            return Vector(0, 0)
+        friction = object.velocity.normalize()
+        friction *= -self.friction
         return friction
 
     def draw(self):
@@ -25,6 +45,8 @@ class Tile(object):
 
 class BoostTile(Tile):
 
+    animated = True
+    stateful = True
     boost_velocity = None
     friction = 5.0
     texture_active = None
@@ -48,7 +70,8 @@ class BoostTile(Tile):
         # the target velocity
         velocity_projection = object.velocity.project(self.boost_velocity)
         dv = self.boost_velocity - velocity_projection
-        object.velocity += dv / 60
+        dv /= 60
+        object.velocity += dv
         return friction
 
     def on_enter(self, entity):
@@ -58,6 +81,11 @@ class BoostTile(Tile):
         self.active -= 1
 
 
+class WallTile(Tile):
+
+    solid = True
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
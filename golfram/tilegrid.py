@@ -0,0 +1,177 @@
+"""Compact storage for a level's tiles
+
+Most cells of a level are one of a handful of kinds of tile, so instead of
+a Tile object per cell a TileGrid keeps one shared (flyweight) Tile per
+kind and a packed grid of 8- or 16-bit indices into them:
+
+    >>> from golfram.tile import BoostTile, Tile
+    >>> grass, sand = Tile(), Tile()
+    >>> grid = TileGrid.from_rows([[grass, sand, grass]] * 2)
+    >>> grid.get(1, 2) is grass, len(grid.types), grid.indices.itemsize
+    (True, 2, 1)
+
+Tiles that keep per-cell state (those with stateful set, like BoostTile's
+active counter) can't be shared. Each cell of such a kind gets its own copy
+of the flyweight, made the first time the cell is asked for and kept in a
+side table, so only the cells that need state pay for it:
+
+    >>> boost = BoostTile()
+    >>> grid.set(0, 0, boost)
+    >>> grid.get(0, 0) is grid.get(0, 0), grid.get(0, 0) is boost
+    (True, False)
+
+With NumPy installed, the friction and boost velocity of every cell are
+available as arrays for vectorized lookups; see friction_plane() and
+boost_plane().
+
+"""
+import copy
+from array import array
+
+class TileGrid(object):
+    """A rows x columns grid of tiles
+
+    types is the list of flyweight tiles, and indices a flat, row-major
+    buffer of indices into it (an array, or a read-only memoryview such as
+    one onto a compiled level file, which is copied on the first set()).
+
+    """
+    def __init__(self, types, indices, rows, columns):
+        if len(indices) != rows * columns:
+            raise ValueError("Expected {} indices, got {}".format(
+                                 rows * columns, len(indices)))
+        self.types = list(types)
+        self.indices = indices
+        self.rows = rows
+        self.columns = columns
+        self._type_indices = dict((id(tile), i)
+                                  for i, tile in enumerate(self.types))
+        # (row, column) -> the cell's own copy of a stateful flyweight
+        self._cell_tiles = {}
+        self._planes = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Make a grid from a list of rows of tiles
+
+        Cells holding the very same Tile object share one entry in types.
+
+        """
+        types, type_indices, indices = [], {}, []
+        for row in rows:
+            for tile in row:
+                i = type_indices.get(id(tile))
+                if i is None:
+                    i = type_indices[id(tile)] = len(types)
+                    types.append(tile)
+                indices.append(i)
+        return cls(types, array(_typecode(len(types)), indices), len(rows),
+                   len(rows[0]) if rows else 0)
+
+    def __len__(self):
+        return self.rows
+
+    def get(self, row, column, wait=False):
+        """Return the tile at (row, column)
+
+        Raises IndexError outside the grid, including for negative indices.
+        wait is only there to match PagedTileGrid.get(); every tile of a
+        TileGrid is always loaded.
+
+        """
+        if not (0 <= row < self.rows and 0 <= column < self.columns):
+            raise IndexError("no tile at ({}, {})".format(row, column))
+        tile = self.types[self.indices[row * self.columns + column]]
+        if tile.stateful:
+            cell_tile = self._cell_tiles.get((row, column))
+            if cell_tile is None:
+                cell_tile = self._cell_tiles[(row, column)] = copy.copy(tile)
+            return cell_tile
+        return tile
+
+    def set(self, row, column, tile):
+        """Put tile at (row, column)"""
+        if not (0 <= row < self.rows and 0 <= column < self.columns):
+            raise IndexError("no tile at ({}, {})".format(row, column))
+        i = self._type_indices.get(id(tile))
+        if i is None:
+            i = self._type_indices[id(tile)] = len(self.types)
+            self.types.append(tile)
+        typecode = _typecode(len(self.types))
+        if getattr(self.indices, 'typecode', None) != typecode:
+            self.indices = array(typecode, self.indices)
+        self.indices[row * self.columns + column] = i
+        self._cell_tiles.pop((row, column), None)
+        self._planes.clear()
+
+    def type_at(self, row, column, wait=False):
+        """Return the flyweight of the tile at (row, column)"""
+        return self.types[self.indices[row * self.columns + column]]
+
+    def to_rows(self):
+        """Return the grid as a list of rows of tiles"""
+        return [[self.get(row, column) for column in range(self.columns)]
+                for row in range(self.rows)]
+
+    def index_plane(self):
+        """Return the type indices as a rows x columns NumPy array
+
+        The array shares memory with the grid where possible.
+
+        """
+        import numpy
+        plane = self._planes.get('index')
+        if plane is None:
+            dtype = numpy.uint8 if self.indices.itemsize == 1 else numpy.uint16
+            plane = numpy.frombuffer(self.indices, dtype=dtype)
+            plane = self._planes['index'] = plane.reshape(self.rows,
+                                                          self.columns)
+        return plane
+
+    def type_table(self, attribute, default=0.0):
+        """Return a NumPy array of one attribute of each type
+
+        Vectors (like BoostTile.boost_velocity) become pairs, and types
+        without the attribute (or with it set to None) get default.
+
+        """
+        import numpy
+        values = []
+        for tile in self.types:
+            value = getattr(tile, attribute, None)
+            if value is None:
+                value = default
+            elif hasattr(value, 'x'):
+                value = (value.x, value.y)
+            values.append(value)
+        return numpy.array(values, dtype=float)
+
+    def friction_plane(self):
+        """Return the friction of every cell as a rows x columns array"""
+        plane = self._planes.get('friction')
+        if plane is None:
+            plane = self.type_table('friction')[self.index_plane()]
+            self._planes['friction'] = plane
+        return plane
+
+    def boost_plane(self):
+        """Return the boost velocity of every cell as a rows x columns x 2
+        array, zero where a cell doesn't boost"""
+        plane = self._planes.get('boost')
+        if plane is None:
+            table = self.type_table('boost_velocity', (0.0, 0.0))
+            plane = self._planes['boost'] = table[self.index_plane()]
+        return plane
+
+    def memory_usage(self):
+        """Return the approximate bytes used by the grid itself"""
+        return self.indices.itemsize * len(self.indices)
+
+
+def _typecode(type_count):
+    return 'B' if type_count <= 0x100 else 'H'
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -1,3 +1,5 @@
+import os
+
 class Unit:
     """Store conversion information for units of measure
 
@@ -22,7 +24,7 @@ class Unit:
     5
 
     """
-    __slots__ = ('conversions', 'value', 'unit_name')
+    __slots__ = ('conversions', 'integral', 'value', 'unit_name')
 
     def __init__(self, name, integral=False, **conversions):
         self.unit_name = name
@@ -51,6 +53,27 @@ class Unit:
             result = int(result)
         return result
 
+    def factor(self, other):
+        """Return how many of this unit make up one of other
+
+        Multiplying a plain number in other by this gives it in this unit,
+        which lets hot code do conversions with a single multiplication:
+
+        >>> px.factor(m)
+        187.0
+        >>> m.factor(px) # doctest:+ELLIPSIS
+        0.005347...
+
+        """
+        if other.unit_name == self.unit_name:
+            return 1.0
+        elif other.unit_name in self.conversions:
+            return 1.0 / self.conversions[other.unit_name]
+        elif self.unit_name in other.conversions:
+            return float(other.conversions[self.unit_name])
+        raise ValueError("No conversion info for {0} to {1}".format(
+                             other.unit_name, self.unit_name))
+
     def __add__(self, other):
         x = self.__copy__()
         x.value += x(other)
@@ -82,13 +105,25 @@ class Unit:
         return x
 
     def __copy__(self):
-        x = Unit(self.unit_name, **self.conversions)
+        # Skip __init__: the conversions are never modified, so every
+        # quantity of a unit can share them instead of copying them.
+        x = Unit.__new__(Unit)
+        x.unit_name = self.unit_name
+        x.integral = self.integral
+        x.conversions = self.conversions
         x.value = self.value
         return x
 
 px = Unit('px', integral=True)
 m = Unit('m', px=187)
 
+# Hot code (like Level.cell_at_point()) converts between metres and pixels
+# with this plain float rather than going through Unit objects. Set the
+# GOLFRAM_DEBUG_UNITS environment variable to make it use the checked Unit
+# conversions instead.
+PX_PER_M = px.factor(m)
+DEBUG = bool(os.environ.get('GOLFRAM_DEBUG_UNITS'))
+
 
 if __name__ == '__main__':
     import doctest